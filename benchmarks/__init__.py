@@ -0,0 +1,5 @@
+'''
+Performance benchmarks for conquer, run them with:
+
+    python -m benchmarks [--size MB] [--output FILE] [--baseline FILE]
+'''
@@ -0,0 +1,86 @@
+'''
+Benchmark runner: run the cases, print results as JSON and compare them
+against a baseline (exit code is 1 on regression).
+'''
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+from .cases import CASES
+
+
+def compare(results, baseline, tolerance):
+    '''
+    Return the list of (name, ratio) for results that are worse than
+    the baseline by more than tolerance (a fraction)
+    '''
+    regressions = []
+    for name, item in results.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]['value']
+        if not base:
+            continue
+        higher_is_better = item['unit'].endswith('/s')
+        if higher_is_better:
+            ratio = base / item['value']
+        else:
+            ratio = item['value'] / base
+        item['ratio'] = ratio
+        if ratio > 1 + tolerance:
+            regressions.append((name, ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    parser.add_argument('cases', nargs='*', default=list(CASES),
+                        help=f'Cases to run (default: all of {list(CASES)})')
+    parser.add_argument('--size', type=int, default=1024,
+                        help='Size of the data streamed, in MB')
+    parser.add_argument('--spawn-count', type=int, default=200)
+    parser.add_argument('--fanout-count', type=int, default=200)
+    parser.add_argument('--ssh-host', default='localhost')
+    parser.add_argument('--output', help='Save results in this file')
+    parser.add_argument('--baseline', help='Compare with this file')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    config = parser.parse_args(argv)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config.tmp_dir = tmp_dir
+        config.size = config.size * 2**20
+        config.data_file = os.path.join(tmp_dir, 'data.bin')
+        with open(config.data_file, 'wb') as fh:
+            # Random text, Func stages need decodable lines
+            hexa = os.urandom(2**19).hex().encode()
+            block = b'\n'.join(
+                hexa[i:i + 79] for i in range(0, len(hexa), 79))[:2**20]
+            for _ in range(config.size // len(block)):
+                fh.write(block)
+            fh.write(block[:config.size % len(block)])
+
+        for name in config.cases:
+            for key, (value, unit) in CASES[name](config).items():
+                results[key] = {'value': value, 'unit': unit}
+
+    regressions = []
+    if config.baseline:
+        with open(config.baseline) as fh:
+            baseline = json.load(fh)
+        regressions = compare(results, baseline, config.tolerance)
+
+    content = json.dumps(results, indent=2, sort_keys=True)
+    if config.output:
+        with open(config.output, 'w') as fh:
+            fh.write(content)
+    print(content)
+    for name, ratio in regressions:
+        print(f'Regression on {name}: {ratio:.2f}x worse', file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
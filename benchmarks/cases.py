@@ -0,0 +1,89 @@
+'''
+Benchmark cases, each one is a function that receives the run
+configuration and returns a {name: (value, unit)} dict. Units ending
+with '/s' are better when higher, the others when lower.
+'''
+import os
+import time
+
+import conquer
+from conquer import sh, Func, SSH
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def identity(line):
+    return line
+
+
+def spawn(config):
+    count = config.spawn_count
+    duration = timed(lambda: [sh.true() for _ in range(count)])
+    native = timed(lambda: [sh.true(_native=True) for _ in range(count)])
+    return {
+        'spawn.latency': (duration / count, 's'),
+        'spawn.native_latency': (native / count, 's'),
+    }
+
+
+def pipes(config):
+    path, size = config.data_file, config.size
+    out = os.path.join(config.tmp_dir, 'out.bin')
+    mb = size / 2**20
+
+    def check(res):
+        assert int(res.stdout) == size
+
+    results = {}
+    duration = timed(lambda: check(((sh.cat < path) | sh.wc - 'c')()))
+    results['pipe.cmd_cmd'] = (mb / duration, 'MB/s')
+
+    cmd = (sh.cat < path) | Func(identity) | sh.wc - 'c'
+    duration = timed(lambda: check(cmd()))
+    results['pipe.cmd_func_cmd'] = (mb / duration, 'MB/s')
+
+    duration = timed(lambda: (sh.cat + path).bg() > out)
+    assert os.path.getsize(out) == size
+    results['pipe.redirect_out'] = (mb / duration, 'MB/s')
+
+    duration = timed(lambda: check((sh.wc - 'c' < path)()))
+    results['pipe.redirect_in'] = (mb / duration, 'MB/s')
+    return results
+
+
+def fanout(config):
+    results = {}
+    targets = [str(i) for i in range(config.fanout_count)]
+    for concurrency in (1, 4, 16):
+        duration = timed(lambda: list(
+            conquer.map(sh.echo, targets, concurrency=concurrency)))
+        results[f'fanout.c{concurrency}'] = (duration, 's')
+    return results
+
+
+def ssh(config):
+    try:
+        localhost = SSH(config.ssh_host)
+    except Exception:
+        # No paramiko or no ssh server, skip
+        return {}
+    path, size = config.data_file, config.size
+    mb = size / 2**20
+    duration = timed(lambda: ((sh.cat < path) | localhost.wc - 'c')())
+    results = {'ssh.upload': (mb / duration, 'MB/s')}
+    cmd = localhost.cat + path | sh.wc - 'c'
+    duration = timed(cmd)
+    results['ssh.download'] = (mb / duration, 'MB/s')
+    return results
+
+
+CASES = {
+    'spawn': spawn,
+    'pipes': pipes,
+    'fanout': fanout,
+    'ssh': ssh,
+}
@@ -1,2 +1,13 @@
-from .main import sh, SSH, Func, Result
+from .main import sh, Func, Result, CancelToken
+from .cache import Cache
+from .group import Group, map
+from .parse import jsonl, csv
+from .worker import Worker
 
+
+def __getattr__(name):
+    # Loading SSH imports paramiko, only pay for it when it is used
+    if name == 'SSH':
+        from .remote import SSH
+        return SSH
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
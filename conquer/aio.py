@@ -0,0 +1,337 @@
+'''
+Asyncio execution engine. Local stages are spawned with
+asyncio.create_subprocess_exec and wired together with os pipes,
+remote stages are read through the channel file descriptor, so a
+single event loop can drive many pipelines. Blocking calls (Func
+stages, reads of stdin files, SSH calls) still run in executor threads.
+'''
+import asyncio
+import io
+import os
+import socket
+
+from .main import (Cmd, Func, Result, command_argv, is_cmd, is_remote,
+                   open_outputs)
+
+CHUNK_SIZE = 2**16
+PIPE = asyncio.subprocess.PIPE
+DEVNULL = asyncio.subprocess.DEVNULL
+
+
+async def iterate(generator):
+    # Consume a (blocking) generator without blocking the loop
+    loop = asyncio.get_running_loop()
+    sentinel = object()
+    while True:
+        chunk = await loop.run_in_executor(None, next, generator, sentinel)
+        if chunk is sentinel:
+            return
+        yield chunk.encode() if isinstance(chunk, str) else chunk
+
+
+async def poll(ready, max_delay=0.05):
+    # Wait until ready() is true, without blocking the loop
+    delay = 0.001
+    while not ready():
+        await asyncio.sleep(delay)
+        delay = min(2 * delay, max_delay)
+
+
+async def read_file(fh):
+    # Consume a buffer (opened file or BytesIO) as an async generator
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            chunk = await loop.run_in_executor(None, fh.read, CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+    finally:
+        fh.close()
+
+
+def read_input(stdin):
+    # Async generator over a `<` redirection (see input_of): a file or
+    # the output of a running Result
+    if hasattr(stdin, 'read'):
+        return read_file(stdin)
+    return iterate(stdin)
+
+
+class AsyncProcess:
+
+    def __init__(self, cmd, args=tuple(), shell=False):
+        self.cmd = cmd
+        self.args = args
+        self.shell = shell
+        self.process = None
+        self.errcode = None
+        self.err_buff = io.BytesIO()
+        self.tasks = []
+
+    async def start(self, stdin=None, stdout=PIPE, stderr=PIPE):
+        feed = None
+        if stdin is None:
+            stdin_arg = DEVNULL
+        elif isinstance(stdin, (int, io.BufferedReader)):
+            stdin_arg = stdin
+        else:
+            stdin_arg = PIPE
+            feed = stdin
+
+        argv = command_argv(self.cmd, self.args, self.shell)
+        self.process = await asyncio.create_subprocess_exec(
+            *argv, stdin=stdin_arg, stdout=stdout, stderr=stderr)
+
+        if self.process.stderr is not None:
+            self.tasks.append(asyncio.create_task(self._collect_stderr()))
+        if feed is not None:
+            self.tasks.append(asyncio.create_task(self._feed(feed)))
+
+    async def _collect_stderr(self):
+        while True:
+            chunk = await self.process.stderr.read(CHUNK_SIZE)
+            if not chunk:
+                return
+            self.err_buff.write(chunk)
+
+    async def _feed(self, source):
+        writer = self.process.stdin
+        broken = False
+        try:
+            async for chunk in source:
+                if broken:
+                    # Keep consuming so that upstream stages can terminate
+                    continue
+                try:
+                    writer.write(chunk)
+                    await writer.drain()
+                except (BrokenPipeError, ConnectionResetError):
+                    broken = True
+        finally:
+            # On error too, the process must see the end of its input
+            # (the error is raised by wait)
+            writer.close()
+
+    async def chunks(self):
+        # Nothing to read when stdout is redirected
+        while self.process.stdout is not None:
+            chunk = await self.process.stdout.read(CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+    async def wait(self):
+        self.errcode = await self.process.wait()
+        await asyncio.gather(*self.tasks)
+        return self.errcode
+
+    def kill(self):
+        try:
+            self.process.kill()
+        except ProcessLookupError:
+            pass
+
+
+class AsyncRemoteProcess:
+
+    def __init__(self, connection, cmd, args=tuple()):
+        self.connection = connection
+        self.cmd = cmd
+        self.args = args
+        self.chan = None
+        self.released = False
+        self.errcode = None
+        self.err_buff = io.BytesIO()
+        self.out_queue = None
+        self.tasks = []
+
+    async def start(self, stdin=None):
+        loop = asyncio.get_running_loop()
+        # Wait for a free session slot on the loop, executor threads
+        # blocked on it could starve the ones that give slots back
+        await poll(lambda: self.connection.acquire(timeout=0))
+        self.chan = await loop.run_in_executor(
+            None, self.connection.open_channel)
+        try:
+            self.chan.exec_command(self.cmd + ' ' + ' '.join(self.args))
+        except Exception:
+            self.chan.close()
+            self.release()
+            raise
+        self.chan.setblocking(0)
+        self.out_queue = asyncio.Queue()
+        # The channel fileno becomes readable when data (stdout or
+        # stderr) is buffered or when the channel is closed
+        loop.add_reader(self.chan.fileno(), self._on_readable)
+        if stdin is None:
+            self.chan.shutdown_write()
+        else:
+            self.tasks.append(asyncio.create_task(self._feed(stdin)))
+
+    def _on_readable(self):
+        while self.chan.recv_stderr_ready():
+            self.err_buff.write(self.chan.recv_stderr(CHUNK_SIZE))
+        try:
+            chunk = self.chan.recv(CHUNK_SIZE)
+        except socket.timeout:
+            return
+        if chunk:
+            self.out_queue.put_nowait(chunk)
+            return
+        # Eof
+        asyncio.get_running_loop().remove_reader(self.chan.fileno())
+        while self.chan.recv_stderr_ready():
+            self.err_buff.write(self.chan.recv_stderr(CHUNK_SIZE))
+        self.out_queue.put_nowait(None)
+
+    async def _feed(self, source):
+        broken = False
+        try:
+            async for chunk in source:
+                while chunk and not broken:
+                    if self.chan.closed:
+                        broken = True
+                    elif self.chan.send_ready():
+                        chunk = chunk[self.chan.send(chunk):]
+                    else:
+                        # Remote window is full
+                        await asyncio.sleep(0.001)
+        finally:
+            if not self.chan.closed:
+                self.chan.shutdown_write()
+
+    async def chunks(self):
+        while True:
+            chunk = await self.out_queue.get()
+            if chunk is None:
+                return
+            yield chunk
+
+    async def wait(self):
+        await asyncio.gather(*self.tasks)
+        # The exit status follows the end of stdout
+        await poll(self.chan.exit_status_ready)
+        self.errcode = self.chan.recv_exit_status()
+        self.release()
+        return self.errcode
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.connection.release()
+
+    def kill(self):
+        self.chan.close()
+        self.release()
+
+
+async def start(node, extra_args=tuple(), stdout=PIPE):
+    '''
+    Spawn node and all its parents, return the list of stages (the
+    last one being node itself)
+    '''
+    stages = []
+    stdin = None
+    head = node
+    if is_remote(node):
+        # Same-host remote stages are run as one remote pipeline
+        head, cmd_line = node.collapse(extra_args)
+
+    if head.redirect_stdin:
+        stdin = head.redirect_stdin
+        if is_remote(node) or not isinstance(
+                stdin, io.BufferedReader):
+            stdin = read_input(stdin)
+    elif isinstance(head.parent, Cmd) and isinstance(node, Cmd):
+        # Local to local, hand over the pipe fd
+        read_fd, write_fd = os.pipe()
+        try:
+            stages = await start(head.parent, stdout=write_fd)
+        finally:
+            os.close(write_fd)
+        stdin = read_fd
+    elif is_cmd(head.parent):
+        stages = await start(head.parent)
+        stdin = stages[-1].chunks()
+    elif isinstance(head.parent, Func):
+        stdin = iterate(head.parent.run())
+
+    try:
+        if isinstance(node, Cmd):
+            proc = AsyncProcess(node.cmd, node.args + extra_args,
+                                shell=node.shell)
+            out, err, opened = open_outputs(node)
+            try:
+                await proc.start(stdin, stdout=stdout if out is None else out,
+                                 stderr=PIPE if err is None else err)
+            finally:
+                for fh in opened:
+                    fh.close()
+        elif node.redirected() or node.compression not in (None, 'transport'):
+            raise ValueError(
+                f'Redirections and compression of remote command "{node}" '
+                'are not supported by the asyncio engine')
+        else:
+            proc = AsyncRemoteProcess(node.ssh.connection, cmd_line)
+            await proc.start(stdin)
+    finally:
+        if isinstance(stdin, int):
+            os.close(stdin)
+    return stages + [proc]
+
+
+async def finish(stages, killed=False):
+    for stage in stages:
+        await stage.wait()
+    last = stages[-1]
+    if not killed and last.errcode != 0:
+        raise RuntimeError(last.err_buff.getvalue().decode())
+
+
+def kill(stages):
+    for stage in stages:
+        stage.kill()
+
+
+async def run(node, extra_args=tuple()):
+    '''
+    Run node (and its parents) to completion and return a Result
+    '''
+    stages = await start(node, extra_args)
+    last = stages[-1]
+    out_buff = io.BytesIO()
+    try:
+        async for chunk in last.chunks():
+            out_buff.write(chunk)
+    except asyncio.CancelledError:
+        kill(stages)
+        raise
+
+    res = Result(last)
+    for stage in stages:
+        await stage.wait()
+    res.collect(out_buff.getvalue(), last.err_buff.getvalue(), last.errcode)
+    return res
+
+
+async def stream(node, extra_args=tuple()):
+    '''
+    Run node (and its parents) and yield its output line by line
+    '''
+    stages = await start(node, extra_args)
+    tail = b''
+    done = False
+    try:
+        async for chunk in stages[-1].chunks():
+            *lines, tail = (tail + chunk).split(b'\n')
+            for line in lines:
+                yield line.decode() + '\n'
+        if tail:
+            yield tail.decode()
+        done = True
+    finally:
+        if not done:
+            # Consumer stopped early or was cancelled
+            kill(stages)
+        await finish(stages, killed=not done)
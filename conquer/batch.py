@@ -0,0 +1,236 @@
+'''
+Run a file of jobs, locally or over SSH, and stream the results as
+JSON lines:
+
+    python -m conquer jobs.yaml --concurrency 50 --per-host 2 \
+        --checkpoint jobs.done
+
+A jobs file is either a JSON or YAML list of jobs (`{"host": "web1",
+"cmd": "uptime"}`, host defaults to local, an optional id identifies
+the job in the checkpoint) or a text file with one job per line: the
+host (or `local`) followed by the command.
+'''
+from collections import deque
+import json
+import os
+import sys
+import threading
+import time
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+from .main import Cmd
+
+LOCAL = 'local'
+
+
+def load(path, format=None):
+    '''
+    Return the list of jobs (dicts with id, host and cmd) defined in
+    path. format is 'json', 'yaml' or 'lines', it is guessed from the
+    file extension by default.
+    '''
+    if format is None:
+        ext = os.path.splitext(path)[1].lower()
+        format = {'.json': 'json', '.yaml': 'yaml', '.yml': 'yaml'}.get(
+            ext, 'lines')
+    with open(path) as fh:
+        content = fh.read()
+    if format == 'json':
+        items = json.loads(content)
+    elif format == 'yaml':
+        if yaml is None:
+            raise RuntimeError('Please install pyyaml to read YAML jobs')
+        items = yaml.safe_load(content)
+    elif format == 'lines':
+        items = list(parse_lines(content))
+    else:
+        raise ValueError(f'Unknown jobs format "{format}"')
+    if isinstance(items, dict):
+        items = items.get('jobs')
+    if not isinstance(items, list):
+        raise ValueError(f'No list of jobs found in "{path}"')
+    return [job(item, pos) for pos, item in enumerate(items)]
+
+
+def parse_lines(content):
+    for line in content.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        host, _, cmd = line.partition(' ')
+        yield {'host': host, 'cmd': cmd.strip()}
+
+
+def job(item, pos):
+    if isinstance(item, str):
+        item = {'cmd': item}
+    if not isinstance(item, dict) or not item.get('cmd'):
+        raise ValueError(f'Job #{pos} has no command: {item!r}')
+    return {
+        # Position based ids are only stable if the file is not edited
+        'id': str(item.get('id', pos)),
+        'host': item.get('host') or LOCAL,
+        'cmd': item['cmd'],
+    }
+
+
+class Batch:
+    '''
+    Run jobs with at most concurrency of them at once, and at most
+    per_host on a given host. A JSON line is written to out for each
+    job as soon as it completes.
+
+    With checkpoint, the id and status of each completed job are
+    appended to this file, and jobs found in it are skipped on the next
+    run (failed ones are run again with retry_failed).
+    '''
+
+    def __init__(self, jobs, concurrency=10, per_host=4, timeout=None,
+                 checkpoint=None, retry_failed=False, out=None):
+        self.jobs = jobs
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.timeout = timeout
+        self.checkpoint = checkpoint
+        self.retry_failed = retry_failed
+        self.out = out or sys.stdout
+        self.cond = threading.Condition()
+        self.running = 0
+        self.per_host_running = {}
+        self.hosts = {}
+        self.counts = {'ok': 0, 'failed': 0, 'skipped': 0}
+
+    def completed(self):
+        # Return the ids of the jobs to skip
+        done = set()
+        if self.checkpoint is None or not os.path.exists(self.checkpoint):
+            return done
+        with open(self.checkpoint) as fh:
+            for line in fh:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Line cut by a crash
+                    continue
+                if entry['ok'] or not self.retry_failed:
+                    done.add(entry['id'])
+        return done
+
+    def run(self):
+        '''
+        Run all the jobs, return the number of ok, failed and skipped
+        ones
+        '''
+        done = self.completed()
+        pending = deque()
+        for job in self.jobs:
+            if job['id'] in done:
+                self.counts['skipped'] += 1
+            else:
+                pending.append(job)
+        # Jobs block until their command completes, they get their own
+        # threads (the pump runs the stream copies)
+        from concurrent import futures
+        with futures.ThreadPoolExecutor(self.concurrency) as executor:
+            with self.cond:
+                while pending:
+                    job = self.next_job(pending)
+                    if job is None:
+                        self.cond.wait()
+                        continue
+                    self.running += 1
+                    self.per_host_running[job['host']] = \
+                        self.per_host_running.get(job['host'], 0) + 1
+                    executor.submit(self.run_job, job)
+        return dict(self.counts)
+
+    def next_job(self, pending):
+        # Called with cond held, pop the first job that can start now
+        if self.running >= self.concurrency:
+            return None
+        for pos, job in enumerate(pending):
+            if self.per_host_running.get(job['host'], 0) < self.per_host:
+                del pending[pos]
+                return job
+        return None
+
+    def run_job(self, job):
+        start = time.perf_counter()
+        record = {'id': job['id'], 'host': job['host'], 'cmd': job['cmd'],
+                  'errcode': None, 'stdout': '', 'stderr': ''}
+        try:
+            res = self.command(job).bg(_timeout=self.timeout)
+            try:
+                res.wait()
+            except RuntimeError as e:
+                record['error'] = f'{type(e).__name__}: {e}'.strip()
+            record['errcode'] = res.process.errcode
+            record['stdout'] = res.stdout.decode(errors='replace')
+            record['stderr'] = res.stderr.decode(errors='replace')
+        except Exception as e:
+            # Connection failure, unknown command, ...
+            record['error'] = f'{type(e).__name__}: {e}'
+        record['time'] = time.perf_counter() - start
+        self.report(record)
+
+    def command(self, job):
+        if job['host'] == LOCAL:
+            # Killed with its process group on timeout, so the commands
+            # of a compound line (`sleep 5; true`) are stopped too
+            return Cmd(job['cmd'], _shell=True)
+        from .remote import RemoteCmd, SSH
+        with self.cond:
+            ssh = self.hosts.get(job['host'])
+        if ssh is None:
+            ssh = SSH(job['host'])
+            with self.cond:
+                ssh = self.hosts.setdefault(job['host'], ssh)
+        return RemoteCmd(ssh, job['cmd'])
+
+    def report(self, record):
+        ok = record['errcode'] == 0 and 'error' not in record
+        with self.cond:
+            self.counts['ok' if ok else 'failed'] += 1
+            self.out.write(json.dumps(record) + '\n')
+            self.out.flush()
+            if self.checkpoint is not None:
+                with open(self.checkpoint, 'a') as fh:
+                    entry = {'id': record['id'], 'ok': ok,
+                             'errcode': record['errcode']}
+                    fh.write(json.dumps(entry) + '\n')
+            self.running -= 1
+            self.per_host_running[record['host']] -= 1
+            self.cond.notify()
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='python -m conquer',
+        description='Run a file of jobs and print results as JSON lines')
+    parser.add_argument('jobs', help='Jobs file (JSON, YAML or lines)')
+    parser.add_argument('--format', choices=('json', 'yaml', 'lines'),
+                        help='Jobs file format (from extension by default)')
+    parser.add_argument('-c', '--concurrency', type=int, default=10,
+                        help='Maximum number of jobs running at once')
+    parser.add_argument('--per-host', type=int, default=4,
+                        help='Maximum number of jobs running on one host')
+    parser.add_argument('--timeout', type=float,
+                        help='Kill jobs running for longer (in seconds)')
+    parser.add_argument('--checkpoint',
+                        help='Record completed jobs here, and skip them')
+    parser.add_argument('--retry-failed', action='store_true',
+                        help='Run again failed jobs found in checkpoint')
+    args = parser.parse_args(argv)
+
+    jobs = load(args.jobs, args.format)
+    batch = Batch(jobs, concurrency=args.concurrency,
+                  per_host=args.per_host, timeout=args.timeout,
+                  checkpoint=args.checkpoint,
+                  retry_failed=args.retry_failed)
+    counts = batch.run()
+    print(json.dumps(counts), file=sys.stderr)
+    return 1 if counts['failed'] else 0
@@ -0,0 +1,272 @@
+'''
+Memoize the results of idempotent commands (`uname -a`, `cat
+/etc/os-release`, ...):
+
+    cache = Cache(ttl=600)
+    ssh.uname('-a', _cache=cache)  # Run
+    ssh.uname('-a', _cache=cache)  # Served from the cache
+'''
+from collections import OrderedDict
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+
+from .main import Cmd, Result, stage_stats, stage_done, is_remote, pump
+
+
+class CachedProcess:
+    '''
+    Process-like object (as expected by Result) replaying a cached
+    output
+    '''
+
+    def __init__(self, entry):
+        self.mode = self.size = None
+        self.out = entry['stdout']
+        self.err = entry['stderr']
+        self.status = entry['errcode']
+        self.errcode = None
+        self.upstream = None
+        self.stats = stage_stats('cache', entry['cmd'])
+        self.stats['spawn_time'] = 0
+        self.stdout = io.BytesIO(self.out)
+        self.stderr = io.BytesIO(self.err)
+
+    def push_stdout(self, output):
+        output.write(self.out)
+
+    def push_stderr(self, output):
+        output.write(self.err)
+
+    def wait(self):
+        self.errcode = self.status
+        stage_done(self.stats, self.errcode)
+        return self.errcode
+
+    def detach(self):
+        return pump.submit(self.wait)
+
+    def kill(self):
+        pass
+
+
+class Cache:
+    '''
+    Cache of successful results, keyed on the host, the resolved
+    command and arguments of every stage, a digest of stdin, the
+    output limit and, with env, the local environment. Entries expire after ttl seconds, the
+    least recently used ones are dropped when there is more than
+    max_size of them. With path, entries are also saved as files in
+    this directory (and shared between processes).
+
+    Set enabled to False to bypass the cache altogether, run(...,
+    refresh=True) bypasses the lookup but saves the new result.
+    '''
+
+    def __init__(self, ttl=300, max_size=1024, path=None, env=False):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.path = path and os.path.expanduser(path)
+        self.env = env
+        self.enabled = True
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        if self.path is not None:
+            os.makedirs(self.path, exist_ok=True)
+
+    def key(self, cmd, extra_args=tuple(), limit=None):
+        '''
+        Return the cache key of cmd, or None if it can not be cached
+        (Func stage, redirected output or stdin that can not be read
+        twice). limit is the _limit of the call, the output it keeps
+        differs.
+        '''
+        parts = []
+        node = cmd
+        args = extra_args
+        while node is not None:
+            if isinstance(node, Cmd):
+                parts.append(('local', os.fspath(node.cmd), node.shell,
+                              node.args + args))
+            elif is_remote(node):
+                parts.append((node.ssh._host, node.command_line(args)))
+            else:
+                return None
+            if node.redirected():
+                # Replaying would not write the files
+                return None
+            args = tuple()
+            if node.redirect_stdin is not None:
+                digest = self.stdin_digest(node.redirect_stdin)
+                if digest is None:
+                    return None
+                parts.append(('stdin', digest))
+                break
+            node = node.parent
+        if limit is not None:
+            parts.append(('limit', limit))
+        if self.env:
+            parts.append(('env', sorted(os.environ.items())))
+        return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+    def stdin_digest(self, stdin):
+        if isinstance(stdin, io.BytesIO):
+            return hashlib.sha256(stdin.getvalue()).hexdigest()
+        try:
+            pos = stdin.tell()
+            digest = hashlib.sha256()
+            for chunk in iter(lambda: stdin.read(2**20), b''):
+                digest.update(chunk)
+            stdin.seek(pos)
+        except (AttributeError, OSError, ValueError):
+            return None
+        return digest.hexdigest()
+
+    def run(self, cmd, *extra_args, refresh=False, **kw):
+        '''
+        Return the cached result of cmd(*extra_args, **kw) or run it
+        (and cache the result if it succeeds)
+        '''
+        key = self.key(cmd, extra_args, kw.get('_limit')) \
+            if self.enabled else None
+        if key is None:
+            with self.lock:
+                self.bypassed += 1
+            return cmd(*extra_args, **kw)
+        entry = None if refresh else self.get(key)
+        if entry is not None:
+            res = Result(CachedProcess(entry))
+            res.wait()
+            return res
+        res = cmd(*extra_args, **kw)
+        self.put(key, {
+            'cmd': str(cmd),
+            'host': getattr(getattr(cmd, 'ssh', None), '_host', 'local'),
+            'stdout': res.stdout,
+            'stderr': res.stderr,
+            'errcode': res.process.errcode,
+            'time': time.time(),
+        })
+        return res
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None and self.path is not None:
+                entry = self.load(key)
+                if entry is not None:
+                    self.entries[key] = entry
+            if entry is not None and now - entry['time'] > self.ttl:
+                self.drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            if self.path is not None:
+                self.save(key, entry)
+            while len(self.entries) > self.max_size:
+                old, _ = self.entries.popitem(last=False)
+                self.drop(old)
+
+    def file(self, key):
+        return os.path.join(self.path, key)
+
+    def load(self, key):
+        # Files hold plain data only (the directory may be shared): a
+        # JSON header line, then the raw stdout and stderr
+        try:
+            with open(self.file(key), 'rb') as fh:
+                header = json.loads(fh.readline())
+                sizes = header['stdout'], header['stderr']
+                stdout, stderr = fh.read(sizes[0]), fh.read(sizes[1])
+                entry = {
+                    'cmd': str(header['cmd']),
+                    'host': str(header['host']),
+                    'errcode': int(header['errcode']),
+                    'time': float(header['time']),
+                    'stdout': stdout,
+                    'stderr': stderr,
+                }
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        if (len(stdout), len(stderr)) != sizes:
+            # Truncated file
+            return None
+        return entry
+
+    def save(self, key, entry):
+        header = {name: entry[name] for name in ('cmd', 'host', 'errcode',
+                                                 'time')}
+        header['stdout'] = len(entry['stdout'])
+        header['stderr'] = len(entry['stderr'])
+        # Write then rename, readers never see a partial entry
+        tmp = f'{self.file(key)}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as fh:
+            fh.write(json.dumps(header).encode() + b'\n')
+            fh.write(entry['stdout'])
+            fh.write(entry['stderr'])
+        os.replace(tmp, self.file(key))
+
+    def drop(self, key):
+        # Must be called with self.lock held
+        self.entries.pop(key, None)
+        if self.path is not None:
+            try:
+                os.unlink(self.file(key))
+            except FileNotFoundError:
+                pass
+
+    def invalidate(self, cmd=None, *extra_args, host=None):
+        '''
+        Drop the entry of cmd (with extra_args), the entries of host or,
+        without arguments, all the entries
+        '''
+        with self.lock:
+            if cmd is not None:
+                key = self.key(cmd, extra_args)
+                if key is not None:
+                    self.drop(key)
+                return
+            for key, entry in list(self.entries.items()):
+                if host is None or entry['host'] == host:
+                    self.drop(key)
+            if self.path is None:
+                return
+            for key in os.listdir(self.path):
+                if key.endswith('.tmp'):
+                    continue
+                entry = self.load(key)
+                if host is None or entry is None or entry['host'] == host:
+                    self.drop(key)
+
+    def clear(self):
+        self.invalidate()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'bypassed': self.bypassed,
+                'hit_rate': self.hits / lookups if lookups else 0,
+                'size': len(self.entries),
+            }
+
+    def __call__(self, cmd, *extra_args, **kw):
+        return self.run(cmd, *extra_args, **kw)
@@ -0,0 +1,172 @@
+'''
+Compression of the data sent over remote command channels: the remote
+command is wrapped with a zstd or gzip encoder (and decoder for stdin),
+the local side compresses and decompresses on the fly:
+
+    ssh = SSH('host', compress='auto')
+    res = (sh.cat < 'dump.sql' | ssh.psql)()
+    res.stats[-1]['compression']  # {'codec': 'gzip', 'ratio': 7.9, ...}
+'''
+import io
+import zlib
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CHUNK_SIZE = 2**16
+CODECS = ('zstd', 'gzip')
+
+# Keep the exit code of cmd (the pipeline status would be the one of
+# the encoder), fd 3 carries it out of the command substitution
+SCRIPT = ('exec 4>&1; __rc=$( {{ {{ ( {decode}(\n{cmd_line}\n) ) 3>&- 4>&-; '
+          'echo $? >&3; }} | {encode} >&4; }} 3>&1 ); exit $__rc')
+
+
+class Codec:
+
+    COMMANDS = {
+        'zstd': ('zstd -q -c -1', 'zstd -q -dc'),
+        'gzip': ('gzip -c -1', 'gzip -dc'),
+    }
+
+    def __init__(self, name):
+        self.name = name
+        self.encode, self.decode = self.COMMANDS[name]
+
+    def command_line(self, cmd_line, stdin=False):
+        decode = f'{self.decode} | ' if stdin else ''
+        return SCRIPT.format(cmd_line=cmd_line, decode=decode,
+                             encode=self.encode)
+
+    def compressor(self):
+        if self.name == 'zstd':
+            return zstandard.ZstdCompressor(level=1).compressobj()
+        return zlib.compressobj(1, zlib.DEFLATED, 31)
+
+    def decompressor(self):
+        if self.name == 'zstd':
+            return zstandard.ZstdDecompressor().decompressobj()
+        return zlib.decompressobj(31)
+
+    def local(self):
+        return self.name != 'zstd' or zstandard is not None
+
+
+def remote_tools(ssh):
+    '''
+    Return the codecs available on the ssh host (probed once per
+    connection)
+    '''
+    connection = ssh.connection
+    if getattr(connection, 'codecs', None) is None:
+        from .remote import RemoteCmd
+        # One name per call, dash ignores the others
+        cmd_line = f'for c in {" ".join(CODECS)}; do command -v $c; done; true'
+        try:
+            res = RemoteCmd(ssh, cmd_line).compress(None)()
+            found = res.stdout.decode().split()
+        except RuntimeError:
+            found = []
+        connection.codecs = {name for name in CODECS
+                             if any(p.endswith('/' + name) for p in found)}
+    return connection.codecs
+
+
+def resolve(ssh, compress):
+    '''
+    Return the Codec to use for compress ('auto', 'zstd' or 'gzip') or
+    None if it is not available on both sides (data is then sent as is)
+    '''
+    names = CODECS if compress == 'auto' else (compress,)
+    if any(name not in CODECS for name in names):
+        raise ValueError(f'Unknown compression "{compress}"')
+    available = remote_tools(ssh)
+    for name in names:
+        codec = Codec(name)
+        if name in available and codec.local():
+            return codec
+    return None
+
+
+def stream_stats():
+    return {'bytes': 0, 'wire_bytes': 0}
+
+
+class DecompressReader(io.RawIOBase):
+    '''
+    Readable stream of the decompressed content of raw
+    '''
+
+    def __init__(self, raw, decompressor, stats):
+        self.raw = raw
+        self.decompressor = decompressor
+        self.stats = stats
+        self.pending = memoryview(b'')
+        self.eof = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buff):
+        while not self.pending and not self.eof:
+            chunk = self.raw.read(CHUNK_SIZE)
+            if chunk:
+                self.stats['wire_bytes'] += len(chunk)
+                data = self.decompressor.decompress(chunk)
+            else:
+                self.eof = True
+                data = self.decompressor.flush()
+            self.pending = memoryview(data)
+        n = min(len(buff), len(self.pending))
+        buff[:n] = self.pending[:n]
+        self.pending = self.pending[n:]
+        self.stats['bytes'] += n
+        return n
+
+
+class CompressWriter:
+    '''
+    File-like object compressing what is written into raw, the end of
+    the stream is written on close
+    '''
+
+    def __init__(self, raw, compressor, stats):
+        self.raw = raw
+        self.compressor = compressor
+        self.stats = stats
+        self.closed = False
+
+    def write(self, data):
+        self.stats['bytes'] += len(data)
+        self.send(self.compressor.compress(data))
+        return len(data)
+
+    def send(self, data):
+        if data:
+            self.stats['wire_bytes'] += len(data)
+            self.raw.write(data)
+
+    def flush(self):
+        if not self.closed:
+            self.raw.flush()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.send(self.compressor.flush())
+        self.raw.close()
+
+
+def summary(codec, stdin, stdout):
+    '''
+    Return the compression stats of a remote process
+    '''
+    raw = stdin['bytes'] + stdout['bytes']
+    wire = stdin['wire_bytes'] + stdout['wire_bytes']
+    return {
+        'codec': codec.name,
+        'stdin': stdin,
+        'stdout': stdout,
+        'ratio': raw / wire if wire else None,
+    }
@@ -0,0 +1,143 @@
+'''
+Run one command over many targets (arguments or SSH hosts) with a
+bounded concurrency.
+'''
+import copy
+import io
+import threading
+import time
+
+from .main import Timeout, is_cmd, is_remote
+
+
+class Group:
+    '''
+    Run cmd for each target, with at most concurrency commands at
+    once. A target can be:
+     - an SSH instance: cmd (a RemoteCmd) is run on this host
+     - a tuple: extra arguments for cmd
+     - anything else: a single extra argument for cmd
+    cmd can also be a callable, it receives the target and must return
+    a Result.
+
+    Iterating on the group yields (target, Result) pairs as they
+    complete. With fail_fast, the first failure kills the running
+    commands, drops the pending ones and raises a RuntimeError,
+    otherwise failed results are yielded too (or the exception raised
+    while starting the command). Run times are saved in `timings`.
+
+    With timeout, each command is killed after timeout seconds (and
+    yields a conquer.main.Timeout error).
+    '''
+
+    def __init__(self, cmd, targets, concurrency=10, fail_fast=False,
+                 timeout=None):
+        self.cmd = cmd
+        self.targets = list(targets)
+        self.concurrency = concurrency
+        self.fail_fast = fail_fast
+        self.timeout = timeout
+        self.timings = {}
+        self.running = {}
+        self.lock = threading.Lock()
+
+    def bind(self, target):
+        # Return a zero-argument function launching cmd for target
+        cmd = self.cmd
+        if not is_cmd(cmd):
+            return lambda: cmd(target)
+        if is_remote(target, 'SSH'):
+            if not is_remote(cmd):
+                raise ValueError(f'Unable to run "{cmd}" on an SSH host')
+            other = copy_chain(cmd, cmd.ssh, target)
+            return lambda: other.bg(_timeout=self.timeout)
+        other = copy_chain(cmd)
+        args = target if isinstance(target, tuple) else (target,)
+        return lambda: other.bg(*args, _timeout=self.timeout)
+
+    def run_one(self, idx, target):
+        start = time.perf_counter()
+        try:
+            res = self.bind(target)()
+            with self.lock:
+                self.running[idx] = res
+            try:
+                res.wait()
+            except Timeout:
+                raise
+            except RuntimeError:
+                if self.fail_fast:
+                    raise
+            return res
+        finally:
+            with self.lock:
+                self.running.pop(idx, None)
+            self.timings[target] = time.perf_counter() - start
+
+    def kill(self):
+        with self.lock:
+            running = list(self.running.values())
+        for res in running:
+            res.kill()
+
+    def __iter__(self):
+        from concurrent import futures
+        with futures.ThreadPoolExecutor(self.concurrency) as executor:
+            jobs = {
+                executor.submit(self.run_one, idx, target): target
+                for idx, target in enumerate(self.targets)
+            }
+            try:
+                for job in futures.as_completed(jobs):
+                    target = jobs[job]
+                    try:
+                        yield target, job.result()
+                    except Exception as e:
+                        if self.fail_fast:
+                            raise
+                        yield target, e
+            finally:
+                for job in jobs:
+                    job.cancel()
+                self.kill()
+
+    def results(self):
+        '''
+        Wait for all targets, return a {target: Result} dict
+        '''
+        return dict(self)
+
+
+def copy_chain(node, ssh=None, target=None):
+    '''
+    Return a copy of the pipeline ending with node, the stages running
+    on ssh run on target in the copy. Each copy gets its own stdin, so
+    that concurrent runs do not read the same file.
+    '''
+    other = copy.copy(node)
+    if ssh is not None and is_remote(node) and node.ssh is ssh:
+        other.ssh = target
+    other.redirect_stdin = reopen(node.redirect_stdin)
+    if node.parent is not None:
+        other.parent = copy_chain(node.parent, ssh, target)
+    return other
+
+
+def reopen(stdin):
+    # Return a new stdin reading the same data as stdin (see input_of)
+    if stdin is None:
+        return None
+    if isinstance(stdin, io.BytesIO):
+        return io.BytesIO(stdin.getvalue())
+    if isinstance(getattr(stdin, 'name', None), str):
+        return open(stdin.name, 'rb')
+    raise ValueError('Unable to share a streamed stdin between several runs')
+
+
+def map(cmd, targets, concurrency=10, fail_fast=False, timeout=None):
+    '''
+    Run cmd over targets, yield (target, Result) pairs as they
+    complete. See Group.
+    '''
+    return iter(Group(cmd, targets, concurrency=concurrency,
+                      fail_fast=fail_fast, timeout=timeout))
@@ -1,38 +1,528 @@
+from collections import deque
 from pathlib import Path
+import atexit
+import codecs
+import errno
+import heapq
 import io
+import itertools
+import mmap
 import os
 import platform
+import signal
 import types
 import subprocess
 import sys
+import tempfile
 import threading
-try:
-    import paramiko
-except ImportError:
-    paramiko = None
+import time
 
 WIN = platform.system() == 'Windows'
 ellipsis = lambda x: x if len(x) < 40 else x[:40] + '...'
+FD_CHUNK_SIZE = 2**20
+
+
+def fileno(stream):
+    '''
+    Return the file descriptor behind stream, or None if stream is not
+    backed by a real one (BytesIO, paramiko channels, generators, ...)
+    '''
+    if isinstance(stream, int):
+        return stream
+    if not isinstance(stream, io.IOBase):
+        return None
+    try:
+        return stream.fileno()
+    except (OSError, ValueError):
+        return None
+
+
+def is_remote(obj, name='RemoteCmd'):
+    '''
+    Tell if obj is an instance of conquer.remote.<name>, without
+    loading the module (no such instance exists before it is loaded)
+    '''
+    remote = sys.modules.get(f'{__package__}.remote')
+    return remote is not None and isinstance(obj, getattr(remote, name))
+
+
+def is_cmd(obj):
+    return isinstance(obj, Cmd) or is_remote(obj)
+
+
+def sendfile(in_fd, out_fd, count):
+    return os.sendfile(out_fd, in_fd, None, count)
+
+
+def copy_fd(in_fd, out_fd):
+    '''
+    Move everything from in_fd to out_fd. Data stays in kernel space
+    with splice (one end is a pipe) or sendfile (in_fd is a regular
+    file), with a plain read/write loop as last resort. Return the
+    number of bytes and of chunks moved.
+    '''
+    total = chunks = 0
+    for move in (getattr(os, 'splice', None),
+                 getattr(os, 'sendfile', None) and sendfile):
+        if move is None:
+            continue
+        try:
+            moved = move(in_fd, out_fd, FD_CHUNK_SIZE)
+        except OSError as e:
+            if e.errno in (errno.EINVAL, errno.ENOSYS, errno.EBADF):
+                # Not supported for this pair of fds
+                continue
+            raise
+        while moved:
+            total += moved
+            chunks += 1
+            moved = move(in_fd, out_fd, FD_CHUNK_SIZE)
+        return total, chunks
+
+    while True:
+        data = os.read(in_fd, FD_CHUNK_SIZE)
+        if not data:
+            return total, chunks
+        total += len(data)
+        chunks += 1
+        view = memoryview(data)
+        while view:
+            view = view[os.write(out_fd, view):]
+
+
+def decode(chunks, encoding='utf-8', errors='strict'):
+    '''
+    Decode an iterable of bytes chunks, a multibyte character split
+    between two chunks is kept by the incremental decoder until its
+    end is read
+    '''
+    decoder = codecs.getincrementaldecoder(encoding)(errors)
+    for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    text = decoder.decode(b'', final=True)
+    if text:
+        yield text
+
+
+def stream_stats():
+    # Time spent blocked on read and on write, in seconds
+    return {'bytes': 0, 'chunks': 0, 'read_time': 0, 'write_time': 0}
+
+
+class Tracer:
+    '''
+    Base class for tracers, instances registered with add_tracer are
+    notified when a stage (a process, a remote process or a function)
+    terminates and when a Result is complete. Stats are plain dicts,
+    see Result.stats.
+    '''
+
+    def on_stage(self, stats):
+        pass
+
+    def on_result(self, stages):
+        pass
+
+
+tracers = []
+
+
+def add_tracer(tracer):
+    tracers.append(tracer)
+    return tracer
+
+
+def remove_tracer(tracer):
+    tracers.remove(tracer)
+
+
+def trace(event, *args):
+    for tracer in tracers:
+        getattr(tracer, event)(*args)
+
+
+def stage_stats(kind, cmd):
+    return {
+        'stage': kind,
+        'cmd': cmd,
+        'start': time.time(),
+        'spawn_time': None,
+        'wall_time': None,
+        'errcode': None,
+        'streams': {},
+        'rusage': None,
+    }
+
+
+def timed(iterable, stats, key):
+    # Yield from iterable, add the time spent in it to stats[key]
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            stats[key] += time.perf_counter() - start
+        yield item
+
+
+def stage_done(stats, errcode):
+    # Record end of stage (only once) and notify tracers
+    if stats['wall_time'] is not None:
+        return
+    stats['errcode'] = errcode
+    stats['wall_time'] = time.time() - stats['start']
+    trace('on_stage', stats)
+
+
+def rusage(ru):
+    '''
+    Convert a resource.struct_rusage into a dict: CPU times in seconds,
+    max_rss in bytes and context switches
+    '''
+    # ru_maxrss is in kilobytes, except on MacOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return {
+        'user_time': ru.ru_utime,
+        'system_time': ru.ru_stime,
+        'max_rss': ru.ru_maxrss * scale,
+        'voluntary_switches': ru.ru_nvcsw,
+        'involuntary_switches': ru.ru_nivcsw,
+    }
+
+
+def total_rusage(usages):
+    '''
+    Aggregate rusage dicts: CPU times and context switches are summed,
+    max_rss is the largest one. Missing values (None) are ignored.
+    '''
+    usages = [u for u in usages if u]
+    if not usages:
+        return None
+    total = {}
+    for key in usages[0]:
+        values = [u[key] for u in usages if u[key] is not None]
+        if not values:
+            total[key] = None
+        elif key == 'max_rss':
+            total[key] = max(values)
+        else:
+            total[key] = sum(values)
+    return total
+
+
+def reap(pid):
+    '''
+    Wait for child pid, return its exit code and resource usage (None
+    when os.wait4 is not available)
+    '''
+    if not hasattr(os, 'wait4'):
+        _, status = os.waitpid(pid, 0)
+        return os.waitstatus_to_exitcode(status), None
+    _, status, ru = os.wait4(pid, 0)
+    return os.waitstatus_to_exitcode(status), rusage(ru)
+
+
+class Cancelled(RuntimeError):
+    '''
+    Raised when a command was stopped through its CancelToken
+    '''
+
+
+class Timeout(Cancelled, TimeoutError):
+    '''
+    Raised when a command was stopped because its deadline expired
+    '''
+
+
+class Watchdog:
+    '''
+    Single daemon thread expiring the CancelToken deadlines, started
+    on first use
+    '''
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.heap = []
+        self.counter = itertools.count()
+        self.thread = None
+
+    def schedule(self, token):
+        with self.cond:
+            heapq.heappush(self.heap,
+                           (token.deadline, next(self.counter), token))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.loop, daemon=True)
+                self.thread.start()
+            self.cond.notify()
+
+    def next_expired(self):
+        with self.cond:
+            while True:
+                # Skip tokens already cancelled or closed
+                while self.heap and self.heap[0][2].done:
+                    heapq.heappop(self.heap)
+                if not self.heap:
+                    self.cond.wait()
+                    continue
+                delay = self.heap[0][0] - time.monotonic()
+                if delay <= 0:
+                    return heapq.heappop(self.heap)[2]
+                self.cond.wait(delay)
+
+    def loop(self):
+        while True:
+            self.next_expired().cancel(expired=True)
+
+
+watchdog = Watchdog()
+
+
+class Task:
+    '''
+    Function submitted to the pump, join() waits for its completion
+    (like Thread.join)
+    '''
+
+    def __init__(self, fn, args):
+        self.fn = fn
+        self.args = args
+        self.queued = time.perf_counter()
+        self.finished = threading.Event()
+
+    def run(self):
+        try:
+            self.fn(*self.args)
+        except Exception:
+            # Same as an uncaught exception in a thread
+            import traceback
+            traceback.print_exc()
+        finally:
+            self.finished.set()
+
+    def join(self, timeout=None):
+        self.finished.wait(timeout)
+
+    def is_alive(self):
+        return not self.finished.is_set()
+
+
+class Pump:
+    '''
+    Pool of reusable daemon threads running the blocking stream copies
+    (Streamer.plug) and background waits (detach) of all the commands.
+    An idle thread picks up new tasks, a new thread is started when
+    none is idle and less than max_threads run, otherwise tasks are
+    queued. Threads idle for idle_timeout seconds exit.
+
+    Copies block until their peer reads or writes, so a max_threads
+    lower than the number of streams of the pipelines running at once
+    can stall them.
+    '''
+
+    def __init__(self, max_threads=256, idle_timeout=10):
+        self.max_threads = max_threads
+        self.idle_timeout = idle_timeout
+        self.reset()
+        if hasattr(os, 'register_at_fork'):
+            # Threads do not survive a fork
+            os.register_at_fork(after_in_child=self.reset)
+
+    def reset(self):
+        self.cond = threading.Condition()
+        self.tasks = deque()
+        self.threads = 0
+        self.starting = 0
+        self.idle = 0
+        self.busy = 0
+        self.spawned = 0
+        self.submitted = 0
+        self.max_queued = 0
+        self.queue_time = 0
+
+    def submit(self, fn, *args):
+        task = Task(fn, args)
+        with self.cond:
+            self.tasks.append(task)
+            self.submitted += 1
+            # Tasks not taken by an idle or starting thread
+            waiting = len(self.tasks) - self.idle - self.starting
+            if waiting <= 0:
+                self.cond.notify()
+            elif self.threads < self.max_threads:
+                self.threads += 1
+                self.starting += 1
+                self.spawned += 1
+                threading.Thread(target=self.loop, daemon=True).start()
+            else:
+                self.max_queued = max(self.max_queued, waiting)
+        return task
+
+    def next_task(self):
+        # Called with cond held, return None once idle for too long
+        while not self.tasks:
+            self.idle += 1
+            notified = self.cond.wait(self.idle_timeout)
+            self.idle -= 1
+            if not notified and not self.tasks:
+                self.threads -= 1
+                return None
+        task = self.tasks.popleft()
+        self.busy += 1
+        self.queue_time += time.perf_counter() - task.queued
+        return task
+
+    def loop(self):
+        cond = self.cond
+        with cond:
+            self.starting -= 1
+            task = self.next_task()
+        while task is not None:
+            task.run()
+            with cond:
+                self.busy -= 1
+                if not self.busy and not self.tasks:
+                    cond.notify_all()
+                task = self.next_task()
+
+    def drain(self, timeout=None):
+        '''
+        Wait until no task is running or queued, return False on
+        timeout
+        '''
+        with self.cond:
+            return self.cond.wait_for(
+                lambda: not self.busy and not self.tasks, timeout)
+
+    def stats(self):
+        with self.cond:
+            return {
+                'threads': self.threads,
+                'idle': self.idle,
+                'busy': self.busy,
+                'queued': len(self.tasks),
+                'max_queued': self.max_queued,
+                'spawned': self.spawned,
+                'tasks': self.submitted,
+                'queue_time': self.queue_time,
+            }
+
+
+pump = Pump()
+# Pump threads are daemons, let running copies complete at exit (like
+# regular threads would)
+atexit.register(pump.drain)
+
+
+class CancelToken:
+    '''
+    Stop one or several commands: results created with the token (see
+    the _cancel argument of bg and __call__) kill all their stages when
+    cancel() is called. With timeout, the token is cancelled after
+    timeout seconds, so a token shared by several commands acts as a
+    common deadline.
+    '''
+
+    def __init__(self, timeout=None):
+        self.lock = threading.Lock()
+        self.callbacks = {}
+        self.keys = itertools.count()
+        self.cancelled = False
+        self.expired = False
+        self.closed = False
+        self.deadline = None
+        if timeout is not None:
+            self.deadline = time.monotonic() + timeout
+            watchdog.schedule(self)
+
+    @property
+    def done(self):
+        return self.cancelled or self.closed
+
+    def remaining(self):
+        '''
+        Seconds left before the deadline (None without timeout)
+        '''
+        if self.deadline is None:
+            return None
+        return max(0, self.deadline - time.monotonic())
+
+    def cancel(self, expired=False):
+        with self.lock:
+            if self.done:
+                return
+            self.cancelled = True
+            self.expired = expired
+            callbacks = list(self.callbacks.values())
+            self.callbacks.clear()
+        for callback in callbacks:
+            callback()
+
+    def register(self, callback):
+        '''
+        Call callback on cancellation (at once if already cancelled),
+        return a key for unregister
+        '''
+        with self.lock:
+            if not self.cancelled:
+                key = next(self.keys)
+                self.callbacks[key] = callback
+                return key
+        callback()
+
+    def unregister(self, key):
+        with self.lock:
+            self.callbacks.pop(key, None)
+
+    def close(self):
+        # Token not needed anymore, its deadline is dropped
+        with self.lock:
+            self.closed = True
+            self.callbacks.clear()
+
+    def check(self):
+        if self.expired:
+            raise Timeout('Deadline expired')
+        if self.cancelled:
+            raise Cancelled('Command cancelled')
 
 
 class Streamer:
+    '''
+    Copy data from a stream. Reads are done according to mode:
+     - 'line' (the default): line by line, at most size bytes at once
+     - 'chunk': blocks of (at most) size bytes, for binary data
+     - a bytes delimiter (like b'\\0'): one record at a time
+    '''
+
+    LINE_SIZE = 2048
+    CHUNK_SIZE = 2**16
 
-    def __init__(self, stream=None, name=None):
+    def __init__(self, stream=None, name=None, mode=None, size=None):
         self.in_stream = stream
         self.name = name or id(self)
+        self.mode = mode or 'line'
+        if isinstance(self.mode, str) and self.mode not in ('line', 'chunk'):
+            raise ValueError(f'Unknown stream mode "{self.mode}"')
+        self.size = size or (
+            self.LINE_SIZE if self.mode == 'line' else self.CHUNK_SIZE)
+        self.stats = stream_stats()
+        # Set when the reading end went away before the end of the input
+        self.broken = False
 
     def reader(self):
         # handles buffers
         if hasattr(self.in_stream, 'readline'):
-            try:
-                for chunk in iter(lambda: self.in_stream.readline(2048), ''):
-                    if not chunk:
-                        return
-                    yield chunk
-
-            except ValueError:
-                # readline raises a valueerror on closed paramiko chan
-                return
+            if self.mode == 'line':
+                yield from self.lines()
+            elif self.mode == 'chunk':
+                yield from self.chunks()
+            else:
+                yield from self.records(self.mode)
         # handle iterable
         elif isinstance(self.in_stream, types.GeneratorType):
             yield from self.in_stream
@@ -41,13 +531,100 @@ class Streamer:
                 f'Unable to consume "{self.in_stream}" of type '
                 f'{type(self.in_stream)} as stream input')
 
+    def lines(self):
+        try:
+            for chunk in iter(lambda: self.in_stream.readline(self.size), ''):
+                if not chunk:
+                    return
+                yield chunk
+
+        except ValueError:
+            # readline raises a valueerror on closed paramiko chan
+            return
+
+    def chunks(self):
+        # read1 returns as soon as some data is available, paramiko
+        # files only provide read
+        read = getattr(self.in_stream, 'read1', self.in_stream.read)
+        try:
+            for chunk in iter(lambda: read(self.size), b''):
+                if not chunk:
+                    return
+                yield chunk
+        except ValueError:
+            return
+
+    def records(self, delimiter):
+        # The consumed head of pending is dropped without moving the
+        # partial record, and bytes already searched are not searched
+        # again when a record spans several reads
+        pending = bytearray()
+        width = len(delimiter)
+        scan = 0
+        for chunk in self.chunks():
+            pending += chunk
+            start = 0
+            with memoryview(pending) as view:
+                while True:
+                    pos = pending.find(delimiter, max(start, scan))
+                    if pos < 0:
+                        break
+                    end = pos + width
+                    yield bytes(view[start:end])
+                    start = end
+            del pending[:start]
+            scan = max(len(pending) - width + 1, 0)
+        if pending:
+            yield bytes(pending)
+
+    def pump(self, out_stream):
+        '''
+        Copy in_stream to out_stream in chunk mode through a single
+        reused buffer
+        '''
+        has_buff = hasattr(out_stream, 'buffer')
+        write = out_stream.buffer.write if has_buff else out_stream.write
+        # paramiko files only accept bytes
+        as_view = isinstance(out_stream, io.IOBase)
+        buff = bytearray(self.size)
+        view = memoryview(buff)
+        stats = self.stats
+        clock = time.perf_counter
+        try:
+            while True:
+                start = clock()
+                n = self.in_stream.readinto1(buff)
+                read_done = clock()
+                stats['read_time'] += read_done - start
+                if not n:
+                    return
+                write(view[:n] if as_view else bytes(view[:n]))
+                stats['write_time'] += clock() - read_done
+                stats['bytes'] += n
+                stats['chunks'] += 1
+        except ValueError:
+            return
+
     def writer(self, generator, out_stream):
         if hasattr(out_stream, 'write'):
             # handle buffers
             has_buff = hasattr(out_stream, 'buffer')
             write = out_stream.buffer.write if has_buff else out_stream.write
+            stats = self.stats
+            clock = time.perf_counter
+            start = clock()
             for chunk in generator:
+                if isinstance(chunk, str):
+                    # Output of a Func stage
+                    chunk = chunk.encode()
+                read_done = clock()
                 write(chunk)
+                end = clock()
+                stats['read_time'] += read_done - start
+                stats['write_time'] += end - read_done
+                stats['bytes'] += len(chunk)
+                stats['chunks'] += 1
+                start = end
         else:
             raise ValueError('Can not handle "%s"' % out_stream)
 
@@ -55,14 +632,158 @@ class Streamer:
         if isinstance(out_stream, Streamer):
             # Daisy chain streams
             out_stream = out_stream.in_stream
-        self.writer(self.reader(), out_stream)
+        in_fd = fileno(self.in_stream)
+        out_fd = fileno(getattr(out_stream, 'buffer', out_stream))
+        if in_fd is not None and out_fd is not None:
+            # Both ends are real fds, bypass python buffers
+            out_stream.flush()
+            start = time.perf_counter()
+            try:
+                moved, chunks = copy_fd(in_fd, out_fd)
+                self.stats['bytes'] += moved
+                self.stats['chunks'] += chunks
+            except BrokenPipeError:
+                self.broken = True
+            # Kernel copies can not tell reads from writes
+            self.stats['read_time'] += time.perf_counter() - start
+        else:
+            pump = self.mode == 'chunk' and hasattr(self.in_stream, 'readinto1')
+            try:
+                if pump:
+                    self.pump(out_stream)
+                else:
+                    self.writer(self.reader(), out_stream)
+            except BrokenPipeError:
+                # Reading end is gone (killed or stopped early)
+                self.broken = True
         if callback:
-            callback()
+            try:
+                callback()
+            except BrokenPipeError:
+                pass
 
     def plug(self, out_stream, callback=None):
-        t = threading.Thread(target=self._plug, args=(out_stream, callback))
-        t.start()
-        return t
+        return pump.submit(self._plug, out_stream, callback)
+
+
+class PathIndex:
+    '''
+    Process-wide index of the executables found in PATH. Directories
+    are listed lazily, the first time a lookup reaches them, and are
+    listed again when their mtime changes. The whole index is dropped
+    when PATH itself changes.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.refresh()
+
+    def refresh(self):
+        with self.lock:
+            self.path = None
+            self.dirs = []
+            self.listings = {}
+
+    def _listing(self, directory):
+        # Return the (cached) content of directory, a stat is enough
+        # to validate the cache
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            self.listings.pop(directory, None)
+            return None, False
+        cached = self.listings.get(directory)
+        if cached is not None and cached[0] == mtime:
+            return cached[1], False
+        try:
+            names = frozenset(os.listdir(directory))
+        except OSError:
+            # Not a directory or not readable
+            names = frozenset()
+        self.listings[directory] = (mtime, names)
+        return names, True
+
+    def resolve(self, cmd):
+        '''
+        Return the full path of cmd, or None if it is not found in PATH
+        '''
+        with self.lock:
+            path = os.environ.get('PATH', '')
+            if path != self.path:
+                self.path = path
+                self.dirs = [p for p in path.split(os.pathsep) if p]
+                self.listings = {}
+
+            missed = False
+            cmd_path = None
+            for directory in self.dirs:
+                names, listed = self._listing(directory)
+                missed = missed or listed
+                if names and cmd in names:
+                    cmd_path = Path(directory) / cmd
+                    break
+            if missed:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return cmd_path
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'directories': len(self.listings),
+        }
+
+
+path_index = PathIndex()
+
+# Pass as stderr to redirect() to merge stderr into stdout
+STDOUT = subprocess.STDOUT
+
+
+def open_outputs(node):
+    '''
+    Open the files the output of node (a Cmd or RemoteCmd) is
+    redirected to. Return stdout, stderr (None when not redirected) and
+    the list of files opened here, to close once handed over.
+    '''
+    opened = []
+
+    def open_(target, append):
+        if fileno(target) is not None or hasattr(target, 'write'):
+            return target
+        fh = open(target, 'ab' if append else 'wb')
+        opened.append(fh)
+        return fh
+
+    stdout = stderr = None
+    try:
+        if node.redirect_stdout is not None:
+            stdout = open_(*node.redirect_stdout)
+        if node.redirect_stderr is not None:
+            target, append = node.redirect_stderr
+            stderr = STDOUT if target is STDOUT else open_(target, append)
+    except Exception:
+        for fh in opened:
+            fh.close()
+        raise
+    return stdout, stderr, opened
+
+
+def command_argv(cmd, args=tuple(), shell=False):
+    '''
+    Return the argv running cmd with args. With shell, cmd is a script
+    and args are its positional parameters (like with Popen). Shared by
+    all the engines, so that a command runs the same everywhere.
+    '''
+    if not shell:
+        return (os.fspath(cmd),) + args
+    if WIN:
+        return (os.environ.get('COMSPEC', 'cmd.exe'), '/c', str(cmd)) + args
+    return ('/bin/sh', '-c', str(cmd)) + args
 
 
 class Cmd:
@@ -74,65 +795,160 @@ class Cmd:
             if WIN and not cmd.endswith('.exe'):
                 cmd += '.exe'
             # Resolve full path
-            cmd_path = None
-            for p in os.environ.get('PATH', '').split(os.pathsep):
-                if not os.path.isdir(p):
-                    continue
-                if cmd in os.listdir(p):
-                    cmd_path = Path(p) / cmd
-                    break
-            else:
+            cmd_path = path_index.resolve(cmd)
+            if cmd_path is None:
                 raise Exception(f'Command not found: {cmd}')
             self.cmd = cmd_path
 
         self.args = args
         self.parent = None
         self.redirect_stdin = None
+        self.redirect_stdout = None
+        self.redirect_stderr = None
         self.shell = _shell
+        self.mode = None
+        self.size = None
 
-    def run(self, extra_args=tuple()):
+    def run(self, extra_args=tuple(), native=False, group=False):
         '''
         Create process instance, plug file descriptor (stdin) to parent
-        process one (stdout) if any.
+        process one (stdout) if any. With native, an all-local pipeline
+        is spawned in one pass as a ProcessGroup. With group, each stage
+        runs in its own process group (see Process).
         '''
+        if native and ProcessGroup.supported:
+            head, argvs = self.local_stages(extra_args)
+            if head is not None and not self.redirected(head):
+                return ProcessGroup(argvs, stdin=head.redirect_stdin,
+                                    mode=self.mode, size=self.size)
+
         parent_proc = parent_func = stdin = None
         if self.redirect_stdin:
             stdin = self.redirect_stdin
-        elif self.parent and isinstance(self.parent, (Cmd, RemoteCmd)):
-            parent_proc = self.parent.run()
+        elif self.parent and is_cmd(self.parent):
+            parent_proc = self.parent.run(group=group)
             stdin = parent_proc.stdout
         elif self.parent and isinstance(self.parent, Func):
             parent_func = self.parent.run()
             stdin = parent_func
+        # Called if the command exits before the end of its input
+        stop = parent_proc.stop if parent_proc else \
+            parent_func.close if parent_func else None
 
-        proc = Process(
-            self.cmd,
-            self.args + extra_args,
-            stdin=stdin,
-            shell=self.shell,
-        )
+        stdout, stderr, opened = open_outputs(self)
+        try:
+            proc = Process(
+                self.cmd,
+                self.args + extra_args,
+                stdin=stdin,
+                shell=self.shell,
+                mode=self.mode,
+                size=self.size,
+                stdout=stdout,
+                stderr=stderr,
+                group=group,
+                stop=stop,
+            )
+        finally:
+            # The child has its own copy of the fds
+            for fh in opened:
+                fh.close()
+        if parent_proc and fileno(stdin) is not None:
+            # Same for the pipe from the parent: once ours is closed the
+            # parent gets SIGPIPE if this stage exits early
+            stdin.close()
+        # Keep track of upstream stage for stats
+        proc.upstream = parent_proc or (parent_func and self.parent)
 
         if parent_proc:
             parent_proc.detach()
         return proc
 
+    def argv(self, extra_args=tuple()):
+        return command_argv(self.cmd, self.args + extra_args, self.shell)
+
+    def local_stages(self, extra_args=tuple()):
+        '''
+        Return the first stage and the list of argv of the pipeline
+        ending with self, or (None, None) if some stages are not local
+        commands.
+        '''
+        head = self
+        argvs = [self.argv(extra_args)]
+        while head.parent is not None and not head.redirect_stdin:
+            if not isinstance(head.parent, Cmd):
+                return None, None
+            head = head.parent
+            argvs.insert(0, head.argv())
+        return head, argvs
+
+    def redirected(self, head=None):
+        '''
+        Tell if the output of some stage, from head (defaults to self)
+        to self, is redirected
+        '''
+        node = self
+        while node is not None:
+            if node.redirect_stdout is not None \
+               or node.redirect_stderr is not None:
+                return True
+            if node is head or head is None:
+                return False
+            node = node.parent
+        return False
+
     def clone(self, *extra_args):
-        return Cmd(self.cmd, *(self.args + extra_args))
+        other = Cmd(self.cmd, *(self.args + extra_args))
+        other.mode, other.size = self.mode, self.size
+        return other
 
-    def __call__(self, *extra_args):
-        process = self.run(extra_args)
-        res = Result(process)
+    def __call__(self, *extra_args, _spill=None, _limit=None, _native=False,
+                 _timeout=None, _cancel=None, _cache=None):
+        if _cache is not None:
+            # See conquer.cache.Cache
+            return _cache.run(self, *extra_args, _spill=_spill, _limit=_limit,
+                              _native=_native, _timeout=_timeout,
+                              _cancel=_cancel)
+        res = self.bg(*extra_args, _spill=_spill, _limit=_limit,
+                      _native=_native, _timeout=_timeout, _cancel=_cancel)
         res.wait()
         return res
 
-    def bg(self, *extra_args):
-        process = self.run(extra_args)
-        res = Result(process)
+    def bg(self, *extra_args, _spill=None, _limit=None, _native=False,
+           _timeout=None, _cancel=None):
+        # Stages that may be killed get their own process group
+        group = _timeout is not None or _cancel is not None
+        process = self.run(extra_args, native=_native, group=group)
+        res = Result(process, spill=_spill, limit=_limit, timeout=_timeout,
+                     cancel=_cancel)
         return res
 
+    def aio(self, *extra_args):
+        '''
+        Coroutine that runs the command with the asyncio engine and
+        returns a Result
+        '''
+        from .aio import run
+        return run(self, extra_args)
+
+    def astream(self, *extra_args):
+        '''
+        Async generator that yields output lines, with the asyncio engine
+        '''
+        from .aio import stream
+        return stream(self, extra_args)
+
+    def tee(self, *sinks, buffer=2**24, policy='block'):
+        '''
+        Broadcast the output of this command to several sinks, see
+        conquer.tee.Tee
+        '''
+        from .tee import Tee
+        return Tee(self, sinks, buffer=buffer, policy=policy)
+
     def pipe_cmd(self, cmd, *args):
         # Chain commands
-        if not isinstance(cmd, (Cmd, RemoteCmd)):
+        if not is_cmd(cmd):
             other = Cmd(cmd, *args)
         elif args:
             other = cmd.clone(*args)
@@ -142,12 +958,12 @@ class Cmd:
         return other
 
     def pipe_func(self, fn):
-        func = Func(fn)
+        func = fn if isinstance(fn, Func) else Func(fn)
         func.set_parent(self)
         return func
 
     def pipe(self, something, *args):
-        if isinstance(something, (Cmd, RemoteCmd)):
+        if is_cmd(something):
             return self.pipe_cmd(something, *args)
         elif isinstance(something, str):
             return self.pipe_cmd(something, *args)
@@ -160,6 +976,17 @@ class Cmd:
         assert self.parent is None
         self.parent = parent
 
+    def stream_mode(self, mode, size=None):
+        '''
+        Set read strategy (see Streamer) on this command and on the
+        upstream stages of the pipeline
+        '''
+        node = self
+        while node is not None:
+            node.mode, node.size = mode, size
+            node = node.parent
+        return self
+
     def __add__(self, arg):
         return self.clone(arg)
 
@@ -177,91 +1004,426 @@ class Cmd:
         return f'{self.cmd} {args}'
 
     def __lt__(self, other):
-        if isinstance(other, Result):
-            self.redirect_stdin = io.BytesIO(other.stdout)
-        else:
-            self.redirect_stdin = open(other, 'rb')
+        self.redirect_stdin = input_of(other)
+        return self
+
+    def redirect(self, stdout=None, stderr=None, append=False):
+        '''
+        Send the output of this stage to files (paths or file objects),
+        the files are opened when the command is run and handed over to
+        the child, so data does not go through python. stderr can also
+        be STDOUT, to merge it into stdout. With append, files are not
+        truncated.
+        '''
+        if stdout is not None:
+            self.redirect_stdout = (stdout, append)
+        if stderr is not None:
+            self.redirect_stderr = (stderr, append)
         return self
 
+    def __gt__(self, other):
+        return self.redirect(stdout=other)
 
-class Process:
+    def __rshift__(self, other):
+        return self.redirect(stdout=other, append=True)
 
-    def __init__(self, cmd, args=tuple(), stdin=None, shell=False):
-        self.cmd = cmd
 
-        # Check if stdin is a readable filehandle
-        is_stdin_fh = isinstance(stdin, io.BufferedReader)
+def input_of(other):
+    '''
+    Return the stdin for a `cmd < other` redirection: a file opened on
+    path other or the output of a Result (streamed if it did not
+    complete yet)
+    '''
+    if not isinstance(other, Result):
+        return open(other, 'rb')
+    if other.waited:
+        return io.BytesIO(other.stdout)
+    return other.iter_bytes()
+
+
+class Process:
+    '''
+    Local stage of a pipeline. With group, the command runs in its own
+    process group so that kill() also stops its children (it then no
+    longer gets the signals of the terminal, like Ctrl-C). When stdin
+    is copied by a thread, stop is called if the command exits before
+    the end of it, to stop the stage producing it.
+    '''
+
+    def __init__(self, cmd, args=tuple(), stdin=None, shell=False,
+                 mode=None, size=None, stdout=None, stderr=None,
+                 group=False, stop=None):
+        self.cmd = cmd
+        self.group = group and not WIN
+        self.mode = mode
+        self.size = size
+
+        self.upstream = None
+        self.stats = stage_stats('process', ' '.join(map(str, (cmd,) + args)))
+
+        # Check if stdin is a readable filehandle, in which case the
+        # file descriptor is handed over to the child
+        is_stdin_fh = fileno(stdin) is not None
+        kw = {}
+        if self.group:
+            # Not a new session: the command keeps the controlling
+            # terminal (password prompts)
+            if sys.version_info >= (3, 11):
+                kw['process_group'] = 0
+            else:
+                kw['preexec_fn'] = os.setpgrp
+        start = time.perf_counter()
         self.process = subprocess.Popen(
-            (cmd,) + args,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
+            command_argv(cmd, args, shell),
+            stdout=subprocess.PIPE if stdout is None else stdout,
+            stderr=subprocess.PIPE if stderr is None else stderr,
             stdin=stdin if is_stdin_fh else subprocess.PIPE,
-            shell=shell,
+            **kw
         )
-        self.stdout = self.process.stdout
-        self.stderr = self.process.stderr
-        self.stdin = self.process.stderr
+        self.stats['spawn_time'] = time.perf_counter() - start
+        self.stats['pid'] = self.process.pid
+        # Redirected streams (to a file or into stdout) read as empty
+        self.stdout = self.process.stdout or io.BytesIO()
+        self.stderr = self.process.stderr or io.BytesIO()
+        self.stdin = self.stderr
         self.errcode = None
         self.to_join = []
+        self.lock = threading.Lock()
         if stdin is not None and not is_stdin_fh:
-            self.pull_stdin(stdin)
+            self.pull_stdin(stdin, stop)
+
+    def streamer(self, stream, name):
+        streamer = Streamer(stream, name=name, mode=self.mode, size=self.size)
+        self.stats['streams'][name] = streamer.stats
+        return streamer
 
     def push_stdout(self, output):
-        thread = Streamer(self.process.stdout).plug(output)
+        thread = self.streamer(self.stdout, 'stdout').plug(output)
         self.to_join.append(thread)
 
     def push_stderr(self, output):
-        thread = Streamer(self.stderr).plug(output)
+        thread = self.streamer(self.stderr, 'stderr').plug(output)
         self.to_join.append(thread)
 
-    def pull_stdin(self, input_):
-        thread = Streamer(input_).plug(
-            self.process.stdin, callback=self.process.stdin.close)
+    def pull_stdin(self, input_, stop=None):
+        streamer = self.streamer(input_, 'stdin')
+
+        def done():
+            if streamer.broken and stop is not None:
+                # Like SIGPIPE in a shell, otherwise the producer
+                # would block (and be waited) forever
+                stop()
+            self.process.stdin.close()
+
+        thread = streamer.plug(self.process.stdin, callback=done)
         self.to_join.append(thread)
 
     def wait(self):
-        self.errcode = self.process.wait()
+        with self.lock:
+            if self.errcode is None:
+                self.errcode = self.reap()
         for thread in self.to_join:
             thread.join()
         for stream in (self.stdin, self.stdout, self.stderr):
-            stream.flush()
+            if not stream.closed:
+                stream.flush()
+        stage_done(self.stats, self.errcode)
         return self.errcode
 
+    def reap(self):
+        # Reap the child ourselves to collect its resource usage
+        if not hasattr(os, 'wait4'):
+            return self.process.wait()
+        try:
+            errcode, self.stats['rusage'] = reap(self.process.pid)
+        except ChildProcessError:
+            # Already reaped by Popen (through kill or poll)
+            return self.process.wait()
+        self.process.returncode = errcode
+        return errcode
+
     def detach(self):
-        t = threading.Thread(target=self.wait)
-        t.start()
-        return t
+        return pump.submit(self.wait)
+
+    def stop(self):
+        '''
+        Stop reading stdout, the command gets SIGPIPE on its next write
+        '''
+        self.stdout.close()
 
     def kill(self):
-        self.process.kill()
+        if not self.group:
+            self.process.kill()
+            return
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+class ProcessGroup:
+    '''
+    Local pipeline spawned in one pass: all the stages are wired with
+    os pipes up front, started with posix_spawn in a dedicated process
+    group (so kill() stops the whole pipeline at once) and reaped by a
+    single waiter. Stages share the same stderr, like in a shell.
+    '''
+
+    supported = hasattr(os, 'posix_spawn')
+
+    def __init__(self, argvs, stdin=None, mode=None, size=None):
+        self.argvs = argvs
+        self.mode = mode
+        self.size = size
+        self.pids = []
+        self.pgid = None
+        self.errcode = None
+        self.errcodes = []
+        self.rusages = []
+        self.to_join = []
+        self.lock = threading.Lock()
+        self.upstream = None
+        self.stats = stage_stats(
+            'group', ' | '.join(' '.join(map(str, argv)) for argv in argvs))
+        start = time.perf_counter()
+
+        feed = None
+        stdin_fd = fileno(stdin)
+        # Only close the fds created here, not a caller's file
+        owned = stdin_fd is None
+        if owned:
+            stdin_fd, write_fd = os.pipe()
+            if stdin is None:
+                os.close(write_fd)
+            else:
+                feed = os.fdopen(write_fd, 'wb')
+        err_read, err_write = os.pipe()
+        try:
+            for argv in argvs:
+                try:
+                    out_read, out_write = os.pipe()
+                    try:
+                        self.spawn(argv, stdin_fd, out_write, err_write)
+                    except Exception:
+                        os.close(out_read)
+                        raise
+                    finally:
+                        os.close(out_write)
+                finally:
+                    if owned:
+                        os.close(stdin_fd)
+                stdin_fd, owned = out_read, True
+        except Exception:
+            os.close(err_read)
+            if feed is not None:
+                feed.close()
+            # Do not leave the stages already spawned behind
+            self.kill()
+            for pid in self.pids:
+                reap(pid)
+            raise
+        finally:
+            os.close(err_write)
+
+        self.stats['spawn_time'] = time.perf_counter() - start
+        self.stats['pids'] = self.pids
+        self.stdout = os.fdopen(stdin_fd, 'rb')
+        self.stderr = os.fdopen(err_read, 'rb')
+        if feed is not None:
+            self.pull_stdin(stdin, feed)
+
+    def spawn(self, argv, stdin, stdout, stderr):
+        actions = [
+            (os.POSIX_SPAWN_DUP2, stdin, 0),
+            (os.POSIX_SPAWN_DUP2, stdout, 1),
+            (os.POSIX_SPAWN_DUP2, stderr, 2),
+        ]
+        pid = os.posix_spawn(argv[0], argv, os.environ,
+                             file_actions=actions,
+                             setpgroup=self.pgid or 0)
+        if self.pgid is None:
+            self.pgid = pid
+        self.pids.append(pid)
+
+    def streamer(self, stream, name):
+        streamer = Streamer(stream, name=name, mode=self.mode, size=self.size)
+        self.stats['streams'][name] = streamer.stats
+        return streamer
 
-class Func:
+    def push_stdout(self, output):
+        thread = self.streamer(self.stdout, 'stdout').plug(output)
+        self.to_join.append(thread)
+
+    def push_stderr(self, output):
+        thread = self.streamer(self.stderr, 'stderr').plug(output)
+        self.to_join.append(thread)
 
-    def __init__(self, fn, *args):
+    def pull_stdin(self, input_, feed):
+        thread = self.streamer(input_, 'stdin').plug(
+            feed, callback=feed.close)
+        self.to_join.append(thread)
+
+    def wait(self):
+        with self.lock:
+            if self.errcode is None:
+                for pid in self.pids:
+                    errcode, usage = reap(pid)
+                    self.errcodes.append(errcode)
+                    self.rusages.append(usage)
+                self.errcode = self.errcodes[-1]
+        for thread in self.to_join:
+            thread.join()
+        self.stats['errcodes'] = self.errcodes
+        self.stats['rusages'] = self.rusages
+        self.stats['rusage'] = total_rusage(self.rusages)
+        stage_done(self.stats, self.errcode)
+        return self.errcode
+
+    def detach(self):
+        return pump.submit(self.wait)
+
+    def kill(self):
+        if self.pgid is None:
+            return
+        try:
+            os.killpg(self.pgid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+class Func:
+    '''
+    Python stage of a pipeline. When piped after a command, fn is
+    called on each line (as str) and on the extra args. Options:
+     - batch: fn receives lists of (at most) batch lines
+     - block: fn receives raw blocks of (at most) block bytes, as
+       memoryviews (or bytes with a process pool)
+     - pool: run fn in an executor, 'thread', 'process' or any
+       concurrent.futures.Executor instance, with workers workers.
+       Results are yielded in order, at most inflight calls are pending
+       at once.
+    '''
+
+    def __init__(self, fn, *args, pool=None, workers=None, batch=None,
+                 block=None, inflight=None):
         self.fn = fn
         self.args = args
         self.parent = None
+        self.redirect_stdin = None
+        self.mode = None
+        self.size = None
+        self.pool = pool
+        self.workers = workers
+        self.batch = batch
+        self.block = block
+        self.inflight = inflight or 2 * (workers or os.cpu_count() or 1)
+        self.upstream = None
+        self.stats = None
 
     def pipe(self, other):
-        assert isinstance(other, (Cmd, RemoteCmd))
+        assert is_cmd(other)
         other.set_parent(self)
         return other
 
     def run(self, args=tuple()):
-        if self.parent:
-            parent_proc = self.parent.run()
-            stdin = parent_proc.stdout
-            reader = Streamer(stdin).reader()
-            parent_proc.detach()
-            for chunk in reader:
-                yield self.fn(chunk.decode(), *args)
+        name = getattr(self.fn, '__name__', str(self.fn))
+        stats = self.stats = stage_stats('func', name)
+        stats['calls'] = 0
+        stats['call_time'] = 0
+        clock = time.perf_counter
+        if self.parent or self.redirect_stdin:
+            if self.redirect_stdin:
+                items = self.items(self.redirect_stdin)
+            else:
+                parent_proc = self.parent.run()
+                self.upstream = parent_proc
+                items = self.items(parent_proc.stdout)
+                parent_proc.detach()
+            try:
+                if self.pool is None:
+                    for item in items:
+                        start = clock()
+                        value = self.fn(item, *args)
+                        stats['call_time'] += clock() - start
+                        stats['calls'] += 1
+                        yield value
+                else:
+                    # Time spent waiting for the executor
+                    results = self.pool_map(items, args)
+                    for value in timed(results, stats, 'call_time'):
+                        stats['calls'] += 1
+                        yield value
+            except GeneratorExit:
+                # The next stage stopped early, so does the previous one
+                if self.upstream is not None:
+                    self.upstream.stop()
+                raise
         else:
-            for chunk in self.fn():
+            for chunk in timed(self.fn(), stats, 'call_time'):
+                stats['calls'] += 1
                 yield chunk.encode()
+        stage_done(stats, 0)
+
+    def items(self, stdin):
+        # Generate the values passed to fn
+        if self.block:
+            reader = Streamer(stdin, mode='chunk', size=self.block).reader()
+            if self.pool == 'process':
+                # memoryviews can not be pickled
+                yield from reader
+            else:
+                yield from map(memoryview, reader)
+            return
+
+        reader = Streamer(stdin, mode=self.mode, size=self.size).reader()
+        lines = decode(reader)
+        if not self.batch:
+            yield from lines
+            return
+        while True:
+            batch = list(itertools.islice(lines, self.batch))
+            if not batch:
+                return
+            yield batch
+
+    def pool_map(self, items, args):
+        # Imported here, concurrent.futures is slow to import
+        from concurrent import futures
+        if self.pool == 'thread':
+            executor = futures.ThreadPoolExecutor(self.workers)
+        elif self.pool == 'process':
+            executor = futures.ProcessPoolExecutor(self.workers)
+        else:
+            executor = self.pool
+        pending = deque()
+        try:
+            for item in items:
+                pending.append(executor.submit(self.fn, item, *args))
+                if len(pending) >= self.inflight:
+                    # Backpressure
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for job in pending:
+                job.cancel()
+            if executor is not self.pool:
+                executor.shutdown()
 
     def set_parent(self, parent):
         self.parent = parent
 
+    def stream_mode(self, mode, size=None):
+        '''
+        Set read strategy (see Streamer) on this command and on the
+        upstream stages of the pipeline
+        '''
+        node = self
+        while node is not None:
+            node.mode, node.size = mode, size
+            node = node.parent
+        return self
+
     def __call__(self, *extra_args):
         return self.run(self.args + extra_args)
 
@@ -269,28 +1431,158 @@ class Func:
         return self.pipe(other)
 
 
+class Capture:
+    '''
+    Write-only buffer collecting process output. Data is kept in memory
+    until more than spill bytes are written, it is then moved to a
+    temporary file. If limit is set, only the first and last limit / 2
+    bytes are kept, the number of bytes dropped in between is counted.
+    '''
+
+    def __init__(self, spill=None, limit=None):
+        self.spill = spill
+        self.limit = limit
+        self.buff = io.BytesIO()
+        self.spilled = False
+        self.stored = 0
+        self.tail = bytearray()
+        self.dropped = 0
+        self._mmap = None
+
+    def write(self, data):
+        size = len(data)
+        if self.limit is None:
+            self._store(data)
+            return size
+
+        head_size = self.limit // 2
+        room = head_size - self.stored
+        if room > 0:
+            self._store(data[:room])
+            data = data[room:]
+        if data:
+            self.tail += data
+            excess = len(self.tail) - (self.limit - head_size)
+            if excess > 0:
+                del self.tail[:excess]
+                self.dropped += excess
+        return size
+
+    def _store(self, data):
+        self.buff.write(data)
+        self.stored += len(data)
+        if self.spill is not None and not self.spilled \
+           and self.stored > self.spill:
+            spill_file = tempfile.TemporaryFile()
+            spill_file.write(self.buff.getbuffer())
+            self.buff = spill_file
+            self.spilled = True
+
+    def flush(self):
+        self.buff.flush()
+
+    def getvalue(self):
+        if self.spilled:
+            self.buff.seek(0)
+            value = self.buff.read()
+        else:
+            value = self.buff.getvalue()
+        return value + self.tail
+
+    def view(self):
+        '''
+        Return a read-only memoryview on the content, without copying
+        it (the spill file is memory-mapped)
+        '''
+        if self.tail:
+            return memoryview(self.getvalue())
+        if not self.spilled:
+            return self.buff.getbuffer().toreadonly()
+        if self._mmap is None:
+            self.buff.flush()
+            if not self.stored:
+                return memoryview(b'')
+            self._mmap = mmap.mmap(self.buff.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+        return memoryview(self._mmap)
+
+
 class Result:
 
-    def __init__(self, process):
+    # Output bigger than this is moved out of memory (64MB)
+    SPILL = 2**26
+
+    def __init__(self, process, spill=None, limit=None, timeout=None,
+                 cancel=None):
+        '''
+        Wrap process, its output is kept in memory up to spill bytes
+        (defaults to Result.SPILL) and to a temporary file above. If
+        limit is set, only limit bytes (from the head and tail of the
+        output) are kept.
+
+        All the stages are killed after timeout seconds or when the
+        cancel token is triggered, waiting on the result then raises
+        Timeout or Cancelled.
+        '''
         self.process = process
-        self._stdout = None
-        self._stderr = None
+        self.spill = spill or self.SPILL
+        self.limit = limit
+        self._out = self._stdout = None
+        self._err = self._stderr = None
         self.waited = False
-
-    def wait(self, raise_on_error=True):
-        # Wait for process and collect stdout/stderr
+        self.tokens = []
+        self.own_token = None
+        if cancel is not None:
+            self.tokens.append(cancel)
+        if timeout is not None:
+            self.own_token = CancelToken(timeout)
+            self.tokens.append(self.own_token)
+        self.keys = [token.register(self.kill) for token in self.tokens]
+
+    def wait(self, raise_on_error=True, stdout=None):
+        '''
+        Wait for process and collect stdout/stderr. If stdout is
+        given, output is sent to it instead of being collected.
+        '''
         if self.waited:
             return
-        out_buff = io.BytesIO()
-        err_buff = io.BytesIO()
-        self.process.push_stdout(out_buff)
+        out_buff = Capture(self.spill, self.limit)
+        err_buff = Capture(self.spill, self.limit)
+        self.process.push_stdout(out_buff if stdout is None else stdout)
         self.process.push_stderr(err_buff)
-        errcode = self.process.wait()
-        self._stdout = out_buff.getvalue()
-        self._stderr = err_buff.getvalue()
+        try:
+            errcode = self.process.wait()
+            # Like a shell, also wait for the upstream stages (whose
+            # output may be redirected to a file)
+            self.wait_upstream()
+        except KeyboardInterrupt:
+            # Stages in their own process group did not get the signal
+            self.kill()
+            raise
+        self.release()
+        self.collect(out_buff, err_buff, errcode)
+
+    def release(self):
+        # Process is done, stop listening to cancel tokens
+        for token, key in zip(self.tokens, self.keys):
+            token.unregister(key)
+        if self.own_token is not None:
+            self.own_token.close()
+
+    def collect(self, stdout, stderr, errcode):
+        '''
+        Save output, stdout and stderr can be bytes or Capture
+        instances
+        '''
+        self._out = stdout
+        self._err = stderr
         self.waited = True
+        if tracers:
+            trace('on_result', self.stats)
+        for token in self.tokens:
+            token.check()
         if errcode != 0:
-            raise RuntimeError(self._stderr.decode())
+            raise RuntimeError(self.stderr.decode())
 
     @property
     def success(self):
@@ -300,34 +1592,161 @@ class Result:
     @property
     def stdout(self):
         self.wait()
+        if self._stdout is None:
+            self._stdout = self._out
+            if isinstance(self._out, Capture):
+                self._stdout = self._out.getvalue()
         return self._stdout
 
     @property
     def stderr(self):
         self.wait()
+        if self._stderr is None:
+            self._stderr = self._err
+            if isinstance(self._err, Capture):
+                self._stderr = self._err.getvalue()
         return self._stderr
 
+    @property
+    def stdout_view(self):
+        '''
+        Read-only memoryview on stdout, a spilled output is
+        memory-mapped instead of being loaded in memory
+        '''
+        self.wait()
+        if isinstance(self._out, Capture):
+            return self._out.view()
+        return memoryview(self._out)
+
+    @property
+    def stdout_dropped(self):
+        self.wait()
+        return getattr(self._out, 'dropped', 0)
+
+    @property
+    def stderr_dropped(self):
+        self.wait()
+        return getattr(self._err, 'dropped', 0)
+
+    @property
+    def stats(self):
+        '''
+        List of stats dicts, one per stage of the pipeline (upstream
+        first): command, spawn and wall time, exit code and, per stream,
+        bytes and chunks moved and time blocked on read and on write.
+        '''
+        if self.waited:
+            # Make sure upstream stages are done too
+            self.wait_upstream()
+        stages = []
+        node = self.process
+        while node is not None:
+            stats = getattr(node, 'stats', None)
+            if stats is not None:
+                stages.insert(0, stats)
+            node = getattr(node, 'upstream', None)
+        return stages
+
+    @property
+    def rusage(self):
+        '''
+        Resource usage of the whole pipeline (user and system CPU time,
+        largest max_rss, context switches), None if not available. Per
+        stage values are in stats.
+        '''
+        self.wait()
+        return total_rusage(s['rusage'] for s in self.stats)
+
+    def wait_upstream(self):
+        # Upstream stages are reaped by detached threads
+        node = getattr(self.process, 'upstream', None)
+        while node is not None:
+            if hasattr(node, 'wait'):
+                node.wait()
+            node = getattr(node, 'upstream', None)
+
     def kill(self):
-        self.process.kill()
+        '''
+        Kill every stage of the pipeline
+        '''
+        node = self.process
+        while node is not None:
+            if hasattr(node, 'kill'):
+                node.kill()
+            node = getattr(node, 'upstream', None)
 
     def __iter__(self):
+        return decode(self.consume(self.process.mode, self.process.size))
+
+    def iter_bytes(self, size=None):
+        '''
+        Yield stdout as raw blocks of at most size bytes
+        '''
+        return self.consume('chunk', size)
+
+    def iter_records(self, delimiter=b'\0', encoding=None, errors='strict',
+                     keepends=False):
+        '''
+        Yield stdout records separated by delimiter, as bytes or, with
+        encoding, as str. Records are not limited in size.
+        '''
+        records = self.consume(delimiter, None)
+        if not keepends:
+            width = len(delimiter)
+            records = (r[:-width] if r.endswith(delimiter) else r
+                       for r in records)
+        if encoding is None:
+            return records
+        # Records are whole, a character can not be split between two
+        return (r.decode(encoding, errors) for r in records)
+
+    def iter_lines(self, delimiter=b'\n', encoding='utf-8', errors='strict',
+                   keepends=True):
+        '''
+        Yield stdout lines (as bytes if encoding is None), see
+        iter_records
+        '''
+        return self.iter_records(delimiter, encoding=encoding, errors=errors,
+                                 keepends=keepends)
+
+    def consume(self, mode, size):
+        '''
+        Run the pipeline in the background and yield the raw reads of
+        stdout, done according to mode (see Streamer). Stopping early
+        kills the pipeline.
+        '''
         # Plug stderr
         err_buff = io.BytesIO()
         self.process.push_stderr(err_buff)
         # Create streamer to consume stdout
-        reader = Streamer(self.process.stdout).reader()
+        streamer = Streamer(self.process.stdout, mode=mode, size=size)
+        reader = timed(streamer.reader(), streamer.stats, 'read_time')
+        stats = getattr(self.process, 'stats', None)
+        if stats is not None:
+            stats['streams']['stdout'] = streamer.stats
         thread = self.process.detach()
 
-        killed = False
+        killed = True
         try:
             for chunk in reader:
-                yield chunk.decode()
+                streamer.stats['bytes'] += len(chunk)
+                streamer.stats['chunks'] += 1
+                yield chunk
+            killed = False
         except KeyboardInterrupt:
-            self.process.kill()
-            killed = True
+            pass
+        finally:
+            if killed:
+                # Interrupted or consumer stopped early
+                self.kill()
+            # Wait for detached thread
+            thread.join()
+            self.release()
 
-        # Wait for detached thread
-        thread.join()
+        if tracers:
+            trace('on_result', self.stats)
+        for token in self.tokens:
+            token.check()
         ok = killed or self.process.errcode == 0
         if not ok:
             raise RuntimeError(err_buff.getvalue().decode())
@@ -342,8 +1761,8 @@ class Result:
 
     def __repr__(self):
         extra = ''
-        if self.stdout:
-            stdout = ellipsis(repr(self.stdout)[2:-1])
+        if self.stdout_view:
+            stdout = ellipsis(repr(bytes(self.stdout_view[:40]))[2:-1])
             extra += f" stdout='{stdout}'"
         if self.stderr:
             stderr = ellipsis(repr(self.stderr)[2:-1])
@@ -351,197 +1770,20 @@ class Result:
         return f'<Result(errorcode={self.process.errcode}{extra})>'
 
     def __gt__(self, other):
-        if isinstance(other, (Cmd, RemoteCmd)):
+        if is_cmd(other):
             return other.__lt__(self)
         elif isinstance(other, (str, bytes)):
             with open(other, 'wb') as fh:
-                fh.write(self.stdout)
+                if self.waited:
+                    fh.write(self.stdout)
+                else:
+                    # Stream output straight into the file
+                    self.wait(stdout=fh)
             return self.success
         else:
             raise ValueError(f'Unable to pipe "{other}" of type "{type(other)}"')
 
 
-
-class SSH:
-
-    _connection_cache = {}
-
-    def __init__(self, host, password=None, private_key=None):
-        if host in self._connection_cache:
-            self.client = self._connection_cache[host]
-            return
-
-        if private_key:
-            private_key = os.path.expanduser(private_key)
-            if not os.path.exists(private_key):
-                msg = f'Private key file "{private_key}" not found'
-                raise FileNotFoundError(msg)
-            password = self.get_passphrase(private_key)
-        else:
-            password = self.get_password(host)
-
-        if '@' in host:
-            username, hostname = host.split('@', 1)
-        else:
-            hostname = host
-            username = None
-        client = paramiko.SSHClient()
-        client.load_system_host_keys()
-        client.connect(hostname, username=username, password=password,
-                       key_filename=private_key,
-        )
-        self._connection_cache[host] = client
-        self.client = client
-
-
-    def get_password(self, host):
-        pass  # XXX needed ?
-
-    def __getattr__(self, cmd):
-        return RemoteCmd(self, cmd)
-
-    def __call__(self, script):
-        return RemoteCmd(self, script)()
-
-
-class RemoteCmd:
-
-    def __init__(self, ssh, cmd, args=tuple()):
-        self.ssh = ssh
-        self.cmd = cmd
-        self.args = args
-        self.parent= None
-        self.redirect_stdin = None
-
-    def run(self, extra_args=tuple()):
-        parent_proc = parent_func = stdin = None
-        if self.redirect_stdin:
-            stdin = self.redirect_stdin
-        elif self.parent and isinstance(self.parent, (Cmd, RemoteCmd)):
-            parent_proc = self.parent.run()
-            stdin = parent_proc.stdout
-        elif self.parent and isinstance(self.parent, Func):
-            parent_func = self.parent.run()
-            stdin = parent_func
-
-        proc = RemoteProcess(self.ssh.client, self.cmd, self.args + extra_args,
-                             stdin=stdin)
-        if parent_proc:
-            # Will eventually close fd's
-            parent_proc.detach()
-        return proc
-
-    def __call__(self, *extra_args):
-        process = self.run(extra_args)
-        res = Result(process)
-        res.wait()
-        return res
-
-    def __or__(self, other):
-        return self.pipe(other)
-
-    def set_parent(self, parent):
-        assert self.parent is None
-        self.parent = parent
-
-    def clone(self, *extra_args):
-        return RemoteCmd(self.ssh, self.cmd, extra_args)
-
-    def pipe_cmd(self, cmd, *args):
-        # Chain commands
-        if not isinstance(cmd, (Cmd, RemoteCmd)):
-            other = Cmd(cmd, *args)
-        elif args:
-            other = cmd.clone(*args)
-        else:
-            other = cmd
-        other.set_parent(self)
-        return other
-
-    def pipe_func(self, fn):
-        func = Func(fn)
-        func.set_parent(self)
-        return func
-
-    def pipe(self, something, *args):
-        if isinstance(something, (Cmd, RemoteCmd)):
-            return self.pipe_cmd(something, *args)
-        elif isinstance(something, str):
-            return self.pipe_cmd(something, *args)
-        elif callable(something):
-            return self.pipe_func(something, *args)
-        else:
-            raise ValueError(f'Unable to pipe to type: "{type(something)}"')
-
-    def __add__(self, arg):
-        return self.clone(arg)
-
-    def __sub__(self, arg):
-        return self.clone(f'-{arg}')
-
-    def __truediv__(self, arg):
-        return self.clone(f'/{arg}')
-
-    def __str__(self):
-        args = ' '.join(self.args)
-        return f'{self.cmd_path} {args}'
-
-    def __lt__(self, other):
-        if isinstance(other, Result):
-            self.redirect_stdin = io.BytesIO(other.stdout)
-        else:
-            self.redirect_stdin = open(other, 'rb')
-        return self
-
-
-class RemoteProcess:
-
-    def __init__(self, client, cmd, args=None, stdin=None):
-        self.errcode = None
-        self.chan = client.get_transport().open_session()
-        self.stdin = self.chan.makefile('wb')
-        self.stdout = self.chan.makefile('rb')
-        self.stderr = self.chan.makefile_stderr('rb')
-        self.chan.exec_command(cmd + ' ' + ' '.join(args))
-
-        self.to_join = []
-        if stdin:
-            self.pull_stdin(stdin)
-
-    def wait(self):
-        self.errcode = self.chan.recv_exit_status()
-        for thread in self.to_join:
-            thread.join()
-        for stream in (self.stdin, self.stdout, self.stderr):
-            stream.flush()
-        return self.errcode
-
-    def pull_stdin(self, input_):
-        name = 'RemoteProcess.pull_stdin'
-        thread = Streamer(input_, name=name).plug(self.stdin, callback=self._close_stdin)
-        self.to_join.append(thread)
-
-    def _close_stdin(self):
-        self.stdin.flush()
-        self.stdin.close()
-        self.chan.shutdown_write()
-
-    def push_stdout(self, output):
-        name = 'Remote_Process.push_stdout'
-        thread = Streamer(self.stdout, name=name).plug(output)
-        self.to_join.append(thread)
-
-    def push_stderr(self, output):
-        name = 'Remote_Process.push_stderr'
-        thread = Streamer(self.stderr, name=name).plug(output)
-        self.to_join.append(thread)
-
-    def detach(self):
-        t = threading.Thread(target=self.wait)
-        t.start()
-        return t
-
-
 class SH:
 
     def __getattr__(self, name):
@@ -561,6 +1803,19 @@ class Sudo:
 sh = SH()
 
 
+REMOTE = ('Connection', 'ConnectionPool', 'SSH', 'RemoteCmd', 'Accounting',
+          'RemoteProcess')
+
+
+def __getattr__(name):
+    # SSH classes live in conquer.remote, loaded (with paramiko) on
+    # first access
+    if name in REMOTE:
+        from . import remote
+        return getattr(remote, name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
 if __name__ == '__main__':
     cmd = Cmd(*sys.argv[1:])
     print(cmd())
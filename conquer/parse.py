@@ -0,0 +1,160 @@
+'''
+Parser stages, to be put at the end of a pipeline. They yield records
+as the output is read, with bounded memory:
+
+    for entry in sh.journalctl + '-o' + 'json' | conquer.jsonl():
+        print(entry['MESSAGE'])
+'''
+import csv as csvlib
+import io
+import json
+
+from .main import Func, Result, decode, stage_stats, stage_done
+
+
+class Parser(Func):
+    '''
+    Tail stage parsing the output of the upstream pipeline, iterate on
+    it (or call it) to get the records. fn receives the output as an
+    iterable of blocks of (at most) block bytes and yields the records,
+    parsers below parse the complete records of a block in one call and
+    keep the incomplete last one for the next block.
+    '''
+
+    BLOCK = 2**20
+
+    def __init__(self, fn, block=None):
+        super().__init__(fn, block=block or self.BLOCK)
+
+    def run(self, args=tuple()):
+        if self.parent is None:
+            raise ValueError(f'Nothing to parse, pipe a command to {self}')
+        stats = self.stats = stage_stats('parser', str(self))
+        stats['records'] = 0
+        parent_proc = self.parent.run()
+        self.upstream = parent_proc
+        # Result kills the pipeline if we stop early and raises if the
+        # command fails
+        blocks = Result(parent_proc).iter_bytes(self.block)
+        for record in self.fn(blocks):
+            stats['records'] += 1
+            yield record
+        stage_done(stats, 0)
+
+    def pipe(self, other):
+        raise ValueError(f'{self} must be the last stage of a pipeline')
+
+    def __iter__(self):
+        return self.run()
+
+    def __str__(self):
+        return type(self).__name__.lower()
+
+
+def complete(blocks, sep):
+    '''
+    Regroup blocks so that each one ends after the last occurrence of
+    sep it contains (except the last one)
+    '''
+    pending = b''
+    for block in blocks:
+        cut = block.rfind(sep) + 1
+        if not cut:
+            pending += block
+            continue
+        yield pending + block[:cut]
+        pending = block[cut:]
+    if pending:
+        yield pending
+
+
+class JSONLines(Parser):
+    '''
+    Parse JSON lines, blank lines are ignored. A block is parsed as a
+    single JSON array, lines are parsed one at a time only if this
+    fails (blank or invalid lines).
+    '''
+
+    def __init__(self, block=None, **loads_kw):
+        super().__init__(self.parse, block=block)
+        self.loads_kw = loads_kw
+
+    def parse(self, blocks):
+        loads = json.loads
+        kw = self.loads_kw
+        for block in complete(blocks, b'\n'):
+            block = block.strip()
+            if not block:
+                continue
+            try:
+                values = loads(b'[' + block.replace(b'\n', b',') + b']',
+                               **kw)
+            except ValueError:
+                values = None
+            # A line like '1, 2' would give two values
+            if values is not None and len(values) == block.count(b'\n') + 1:
+                yield from values
+                continue
+            for line in block.splitlines():
+                if line.strip():
+                    yield loads(line, **kw)
+
+
+class CSV(Parser):
+    '''
+    Parse CSV rows with the csv module, as lists or, with header, as
+    dicts keyed by the first row. Quoted fields may contain newlines,
+    rows are only cut where an even number of quotechar were read.
+    '''
+
+    def __init__(self, block=None, header=False, encoding='utf-8',
+                 **fmt):
+        super().__init__(self.parse, block=block)
+        self.header = header
+        self.encoding = encoding
+        self.fmt = fmt
+        self.quotechar = fmt.get('quotechar', '"')
+
+    def parse(self, blocks):
+        fields = None
+        for text in self.rows(decode(blocks, self.encoding)):
+            reader = csvlib.reader(io.StringIO(text, newline=''), **self.fmt)
+            if not self.header:
+                yield from reader
+                continue
+            for row in reader:
+                if fields is None:
+                    fields = row
+                else:
+                    yield dict(zip(fields, row))
+
+    def rows(self, texts):
+        # Yield texts made of complete rows
+        pending = ''
+        for text in texts:
+            text = pending + text
+            cut = text.rfind('\n')
+            while cut >= 0 and text.count(self.quotechar, 0, cut) % 2:
+                # Newline inside a quoted field
+                cut = text.rfind('\n', 0, cut)
+            pending = text[cut + 1:]
+            if cut >= 0:
+                yield text[:cut + 1]
+        if pending:
+            yield pending
+
+
+def jsonl(block=None, **loads_kw):
+    '''
+    Stage yielding the JSON documents of the upstream output, one per
+    line. Extra arguments are passed to json.loads.
+    '''
+    return JSONLines(block=block, **loads_kw)
+
+
+def csv(block=None, header=False, encoding='utf-8', **fmt):
+    '''
+    Stage yielding the rows (lists, or dicts with header) of the
+    upstream CSV output. Extra arguments are passed to csv.reader.
+    '''
+    return CSV(block=block, header=header, encoding=encoding, **fmt)
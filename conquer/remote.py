@@ -0,0 +1,773 @@
+'''
+SSH machinery: connections, remote commands and processes. This module
+(and paramiko) is only loaded when SSH is first used, see
+conquer.main.__getattr__.
+'''
+from collections import OrderedDict
+from concurrent import futures
+import io
+import os
+import threading
+import time
+try:
+    import paramiko
+except ImportError:
+    paramiko = None
+
+from .main import (Cmd, Func, Result, Streamer, STDOUT, stage_stats,
+                   stage_done, input_of, open_outputs, pump)
+
+
+class Connection:
+    '''
+    SSH client shared by all the commands run on a given host, the
+    number of sessions opened at once on its transport is capped by
+    max_sessions (extra ones wait for a free slot)
+    '''
+
+    def __init__(self, connect, max_sessions=8, keepalive=30):
+        self.connect = connect
+        self.keepalive = keepalive
+        self.client = None
+        self.max_sessions = max_sessions
+        self.sessions = threading.BoundedSemaphore(max_sessions)
+        self.lock = threading.Lock()
+        self.channels = 0
+        self.waits = 0
+        self.wait_time = 0
+        self.last_used = time.monotonic()
+        # Compression tools found on the host (see conquer.compress)
+        self.codecs = None
+        self.reconnect()
+
+    def reconnect(self):
+        if self.client is not None:
+            self.client.close()
+        self.client = self.connect()
+        transport = self.client.get_transport()
+        if self.keepalive and transport is not None:
+            transport.set_keepalive(self.keepalive)
+
+    def alive(self):
+        transport = self.client.get_transport()
+        return transport is not None and transport.is_active()
+
+    def open_session(self, **kw):
+        '''
+        Return a new channel, release() must be called once it is
+        closed. kw (window_size, max_packet_size) is passed to the
+        transport.
+        '''
+        self.acquire()
+        return self.open_channel(**kw)
+
+    def acquire(self, timeout=None):
+        '''
+        Take a session slot, waiting at most timeout seconds (0 to not
+        wait) for a free one. Return False if none was free in time,
+        otherwise open_channel() must follow.
+        '''
+        start = time.monotonic()
+        if self.sessions.acquire(blocking=False):
+            return True
+        if timeout == 0 or not self.sessions.acquire(timeout=timeout):
+            return False
+        with self.lock:
+            self.waits += 1
+            self.wait_time += time.monotonic() - start
+        return True
+
+    def open_channel(self, **kw):
+        '''
+        Return a new channel on the slot taken with acquire() (given
+        back if opening fails), see open_session
+        '''
+        try:
+            with self.lock:
+                if not self.alive():
+                    self.reconnect()
+                kw = {k: v for k, v in kw.items() if v is not None}
+                chan = self.client.get_transport().open_session(**kw)
+                self.channels += 1
+                self.last_used = time.monotonic()
+        except Exception:
+            self.sessions.release()
+            raise
+        return chan
+
+    def open_sftp(self, window_size=None, max_packet_size=None):
+        '''
+        Return an SFTP client on a new channel (larger windows keep more
+        data in flight), release() must be called once it is closed
+        '''
+        chan = self.open_session(window_size=window_size,
+                                 max_packet_size=max_packet_size)
+        try:
+            chan.invoke_subsystem('sftp')
+            return paramiko.SFTPClient(chan)
+        except Exception:
+            chan.close()
+            self.release()
+            raise
+
+    def release(self):
+        with self.lock:
+            self.channels -= 1
+            self.last_used = time.monotonic()
+        self.sessions.release()
+
+    def close(self):
+        self.client.close()
+
+    def stats(self):
+        return {
+            'channels': self.channels,
+            'waits': self.waits,
+            'wait_time': self.wait_time,
+            'alive': self.alive(),
+        }
+
+
+class ConnectionPool:
+    '''
+    Keep one Connection per host. Connections idle (no open channel)
+    for more than ttl seconds are closed, as well as the least recently
+    used ones when there is more than max_size of them.
+    '''
+
+    def __init__(self, max_sessions=8, keepalive=30, ttl=600, max_size=64):
+        self.max_sessions = max_sessions
+        self.keepalive = keepalive
+        self.ttl = ttl
+        self.max_size = max_size
+        self.connections = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, host, connect):
+        '''
+        Return the connection for host, connect() is called to create
+        the paramiko client when needed
+        '''
+        with self.lock:
+            conn = self.connections.get(host)
+            if conn is not None:
+                self.connections.move_to_end(host)
+                if not conn.alive():
+                    conn.reconnect()
+                return conn
+
+        conn = Connection(connect, max_sessions=self.max_sessions,
+                          keepalive=self.keepalive)
+        with self.lock:
+            if host in self.connections:
+                # Lost the race against another thread
+                conn.close()
+                return self.connections[host]
+            self.connections[host] = conn
+            self.evict()
+        return conn
+
+    def evict(self):
+        # Must be called with self.lock held
+        now = time.monotonic()
+        idle = [h for h, c in self.connections.items() if c.channels == 0]
+        for host in idle:
+            conn = self.connections[host]
+            too_many = len(self.connections) > self.max_size
+            if too_many or now - conn.last_used > self.ttl:
+                del self.connections[host]
+                conn.close()
+
+    def clear(self):
+        with self.lock:
+            for conn in self.connections.values():
+                conn.close()
+            self.connections.clear()
+
+    def stats(self):
+        with self.lock:
+            return {h: c.stats() for h, c in self.connections.items()}
+
+
+class SSH:
+
+    pool = ConnectionPool()
+
+    def __init__(self, host, password=None, private_key=None,
+                 accounting=False, compress=None):
+        '''
+        With compress, data sent over the channels of remote commands
+        is compressed: 'auto', 'zstd' or 'gzip' wrap the commands with
+        the codec (the first available on both sides with 'auto', data
+        is sent as is when none is), 'transport' enables the compression
+        of the ssh transport (for the whole connection, when it is
+        created).
+        '''
+        # Private names: other attributes are remote commands
+        self._host = host
+        # Report resource usage of remote commands (see RemoteProcess)
+        self._accounting = accounting
+        self._compress = compress
+        connect = lambda: self.connect(host, password, private_key)
+        self.connection = self.pool.get(host, connect)
+
+    @property
+    def client(self):
+        return self.connection.client
+
+    def connect(self, host, password=None, private_key=None):
+        if private_key:
+            private_key = os.path.expanduser(private_key)
+            if not os.path.exists(private_key):
+                msg = f'Private key file "{private_key}" not found'
+                raise FileNotFoundError(msg)
+            password = self.get_passphrase(private_key)
+        else:
+            password = self.get_password(host)
+
+        if '@' in host:
+            username, hostname = host.split('@', 1)
+        else:
+            hostname = host
+            username = None
+        client = paramiko.SSHClient()
+        client.load_system_host_keys()
+        client.connect(hostname, username=username, password=password,
+                       key_filename=private_key,
+                       compress=self._compress == 'transport',
+        )
+        return client
+
+    @classmethod
+    def prewarm(cls, hosts, concurrency=10, **kw):
+        '''
+        Connect to all hosts in parallel, return the list of SSH
+        instances
+        '''
+        with futures.ThreadPoolExecutor(concurrency) as executor:
+            return list(executor.map(lambda h: cls(h, **kw), hosts))
+
+    def get_password(self, host):
+        pass  # XXX needed ?
+
+    def put(self, local, remote, **kw):
+        '''
+        Copy local (file or directory) to remote over SFTP, kw is
+        passed to conquer.transfer.Transfer. Return the transfer stats.
+        '''
+        from .transfer import Transfer
+        with Transfer(self, **kw) as transfer:
+            return transfer.put(local, remote)
+
+    def get(self, remote, local, **kw):
+        '''
+        Copy remote (file or directory) to local over SFTP, see put
+        '''
+        from .transfer import Transfer
+        with Transfer(self, **kw) as transfer:
+            return transfer.get(remote, local)
+
+    def sync(self, src, dst, direction='put', check='mtime', **kw):
+        '''
+        Like put (or get with direction='get') but files that did not
+        change (see check) are skipped
+        '''
+        if direction not in ('put', 'get'):
+            raise ValueError(f'Unknown sync direction "{direction}"')
+        return getattr(self, direction)(src, dst, check=check, **kw)
+
+    def __getattr__(self, cmd):
+        if cmd.startswith('_'):
+            raise AttributeError(cmd)
+        return RemoteCmd(self, cmd)
+
+    def __call__(self, script):
+        return RemoteCmd(self, script)()
+
+
+class RemoteCmd:
+
+    def __init__(self, ssh, cmd, args=tuple()):
+        self.ssh = ssh
+        self.cmd = cmd
+        self.args = args
+        self.parent= None
+        self.redirect_stdin = None
+        self.redirect_stdout = None
+        self.redirect_stderr = None
+        self.mode = None
+        self.size = None
+        self.compression = getattr(ssh, '_compress', None)
+
+    def command_line(self, extra_args=tuple()):
+        return self.cmd + ' ' + ' '.join(self.args + extra_args)
+
+    def collapse(self, extra_args=tuple()):
+        '''
+        Return the first stage of the chain of RemoteCmd running on the
+        same host and ending with self, and the remote shell pipeline
+        equivalent to this chain. Data between those stages then never
+        leaves the remote host.
+        '''
+        head = self
+        parts = [self.command_line(extra_args)]
+        while not head.redirect_stdin and isinstance(head.parent, RemoteCmd) \
+              and not head.parent.redirected() \
+              and head.parent.ssh.connection is self.ssh.connection:
+            head = head.parent
+            parts.insert(0, head.command_line())
+        return head, ' | '.join(parts)
+
+    def run(self, extra_args=tuple(), group=False):
+        head, cmd_line = self.collapse(extra_args)
+        parent_proc = parent_func = stdin = None
+        if head.redirect_stdin:
+            stdin = head.redirect_stdin
+        elif head.parent and isinstance(head.parent, (Cmd, RemoteCmd)):
+            parent_proc = head.parent.run(group=group)
+            stdin = parent_proc.stdout
+        elif head.parent and isinstance(head.parent, Func):
+            parent_func = head.parent.run()
+            stdin = parent_func
+
+        codec = None
+        if self.compression not in (None, 'transport'):
+            from .compress import resolve
+            codec = resolve(self.ssh, self.compression)
+        stdout, stderr, opened = open_outputs(self)
+        try:
+            proc = RemoteProcess(
+                self.ssh.connection, cmd_line, stdin=stdin, mode=self.mode,
+                size=self.size, stdout=stdout, stderr=stderr, opened=opened,
+                accounting=getattr(self.ssh, '_accounting', False),
+                codec=codec)
+        except Exception:
+            for fh in opened:
+                fh.close()
+            raise
+        proc.upstream = parent_proc or (parent_func and head.parent)
+        if parent_proc:
+            # Will eventually close fd's
+            parent_proc.detach()
+        return proc
+
+    def __call__(self, *extra_args, _spill=None, _limit=None, _timeout=None,
+                 _cancel=None, _cache=None):
+        if _cache is not None:
+            # See conquer.cache.Cache
+            return _cache.run(self, *extra_args, _spill=_spill, _limit=_limit,
+                              _timeout=_timeout, _cancel=_cancel)
+        res = self.bg(*extra_args, _spill=_spill, _limit=_limit,
+                      _timeout=_timeout, _cancel=_cancel)
+        res.wait()
+        return res
+
+    def bg(self, *extra_args, _spill=None, _limit=None, _timeout=None,
+           _cancel=None):
+        # Local stages that may be killed get their own process group
+        group = _timeout is not None or _cancel is not None
+        process = self.run(extra_args, group=group)
+        res = Result(process, spill=_spill, limit=_limit, timeout=_timeout,
+                     cancel=_cancel)
+        return res
+
+    def aio(self, *extra_args):
+        '''
+        Coroutine that runs the command with the asyncio engine and
+        returns a Result
+        '''
+        from .aio import run
+        return run(self, extra_args)
+
+    def astream(self, *extra_args):
+        '''
+        Async generator that yields output lines, with the asyncio engine
+        '''
+        from .aio import stream
+        return stream(self, extra_args)
+
+    def tee(self, *sinks, buffer=2**24, policy='block'):
+        '''
+        Broadcast the output of this command to several sinks, see
+        conquer.tee.Tee
+        '''
+        from .tee import Tee
+        return Tee(self, sinks, buffer=buffer, policy=policy)
+
+    def __or__(self, other):
+        return self.pipe(other)
+
+    def set_parent(self, parent):
+        assert self.parent is None
+        self.parent = parent
+
+    def stream_mode(self, mode, size=None):
+        '''
+        Set read strategy (see Streamer) on this command and on the
+        upstream stages of the pipeline
+        '''
+        node = self
+        while node is not None:
+            node.mode, node.size = mode, size
+            node = node.parent
+        return self
+
+    def compress(self, compression='auto'):
+        '''
+        Set the compression of this command (see SSH), None to disable
+        it
+        '''
+        self.compression = compression
+        return self
+
+    def clone(self, *extra_args):
+        other = RemoteCmd(self.ssh, self.cmd, self.args + extra_args)
+        other.mode, other.size = self.mode, self.size
+        other.compression = self.compression
+        return other
+
+    def pipe_cmd(self, cmd, *args):
+        # Chain commands
+        if not isinstance(cmd, (Cmd, RemoteCmd)):
+            other = Cmd(cmd, *args)
+        elif args:
+            other = cmd.clone(*args)
+        else:
+            other = cmd
+        other.set_parent(self)
+        return other
+
+    def pipe_func(self, fn):
+        func = fn if isinstance(fn, Func) else Func(fn)
+        func.set_parent(self)
+        return func
+
+    def pipe(self, something, *args):
+        if isinstance(something, (Cmd, RemoteCmd)):
+            return self.pipe_cmd(something, *args)
+        elif isinstance(something, str):
+            return self.pipe_cmd(something, *args)
+        elif callable(something):
+            return self.pipe_func(something, *args)
+        else:
+            raise ValueError(f'Unable to pipe to type: "{type(something)}"')
+
+    def __add__(self, arg):
+        return self.clone(arg)
+
+    def __sub__(self, arg):
+        return self.clone(f'-{arg}')
+
+    def __truediv__(self, arg):
+        return self.clone(f'/{arg}')
+
+    def __str__(self):
+        return self.command_line()
+
+    def __lt__(self, other):
+        self.redirect_stdin = input_of(other)
+        return self
+
+    def redirect(self, stdout=None, stderr=None, append=False):
+        '''
+        Write the output of this stage to local files (paths or file
+        objects) as it is received, see Cmd.redirect. With stderr=STDOUT
+        the streams are merged on the remote side.
+        '''
+        if stdout is not None:
+            self.redirect_stdout = (stdout, append)
+        if stderr is not None:
+            self.redirect_stderr = (stderr, append)
+        return self
+
+    def redirected(self):
+        return self.redirect_stdout is not None \
+            or self.redirect_stderr is not None
+
+    def __gt__(self, other):
+        return self.redirect(stdout=other)
+
+    def __rshift__(self, other):
+        return self.redirect(stdout=other, append=True)
+
+
+class Accounting:
+    '''
+    Lightweight shim reporting the CPU time used by a remote command:
+    the command is followed by the `times` shell builtin, whose output
+    is written on stderr after a random token. The report is removed
+    from stderr by the writer returned by wrap().
+    '''
+
+    SCRIPT = ('{{ {cmd_line}\n}}; __rc=$?; '
+              'printf %s {token} >&2; times >&2; exit $__rc')
+
+    def __init__(self):
+        self.token = f'__conquer_times_{os.urandom(8).hex()}__'.encode()
+        self.output = None
+        self.pending = b''
+        self.report = None
+
+    def command_line(self, cmd_line):
+        return self.SCRIPT.format(cmd_line=cmd_line, token=self.token.decode())
+
+    def wrap(self, output):
+        self.output = output
+        return self
+
+    def write(self, data):
+        if self.report is not None:
+            self.report += data
+            return
+        data = self.pending + data
+        pos = data.find(self.token)
+        if pos >= 0:
+            self.output.write(data[:pos])
+            self.report = data[pos + len(self.token):]
+            self.pending = b''
+            return
+        # Hold back what could be the beginning of the token
+        keep = len(self.token) - 1
+        self.output.write(data[:-keep])
+        self.pending = data[-keep:]
+
+    def flush(self):
+        self.output.flush()
+
+    def rusage(self):
+        '''
+        Flush held back data and return the parsed report (max_rss and
+        context switches are not available)
+        '''
+        if self.pending:
+            self.output.write(self.pending)
+            self.pending = b''
+        # First line gives the shell times, the second the times of
+        # its children: "0m0.060s 0m0.009s"
+        lines = (self.report or b'').decode().splitlines()
+        if len(lines) < 2:
+            return None
+        try:
+            user, system = (self.seconds(v) for v in lines[1].split())
+        except ValueError:
+            return None
+        return {
+            'user_time': user,
+            'system_time': system,
+            'max_rss': None,
+            'voluntary_switches': None,
+            'involuntary_switches': None,
+        }
+
+    @staticmethod
+    def seconds(value):
+        minutes, _, secs = value.rstrip('s').rpartition('m')
+        return int(minutes or 0) * 60 + float(secs)
+
+
+class RemoteProcess:
+    '''
+    Command running on an SSH channel. stdout and stderr are optional
+    local files the output is copied to as it arrives (stderr can be
+    STDOUT to merge it into stdout, resource accounting is then
+    disabled), files in opened are closed once copied. With codec
+    (see conquer.compress), stdin and stdout are compressed on the
+    channel.
+    '''
+
+    def __init__(self, connection, cmd, args=tuple(), stdin=None, mode=None,
+                 size=None, accounting=False, stdout=None, stderr=None,
+                 opened=(), codec=None):
+        self.errcode = None
+        self.mode = mode
+        self.size = size
+        self.connection = connection
+        self.upstream = None
+        cmd_line = cmd + ' ' + ' '.join(args)
+        self.stats = stage_stats('remote', cmd_line)
+        merge = stderr is STDOUT
+        self.accounting = Accounting() if accounting and not merge else None
+        if self.accounting:
+            cmd_line = self.accounting.command_line(cmd_line)
+        # Merged stderr would corrupt the compressed stdout
+        self.codec = codec if not merge else None
+        if self.codec:
+            cmd_line = self.codec.command_line(cmd_line, stdin=bool(stdin))
+        self.chan = None
+        self.killed = False
+        self.released = False
+        self.error = None
+        self.lock = threading.Lock()
+        self.to_join = []
+        self.redirected = set()
+        args = (cmd_line, stdin, stdout, stderr, opened, merge)
+        if connection.acquire(timeout=0):
+            self.opening = None
+            self.start(*args)
+        else:
+            # No free slot: wait for one in the background, the caller
+            # may be the one holding the results that use the others
+            self.opening = pump.submit(self.start_later, *args)
+
+    def start(self, cmd_line, stdin, stdout, stderr, opened, merge):
+        # Run cmd_line on a new channel, a session slot is taken
+        start = time.perf_counter()
+        chan = self.connection.open_channel()
+        try:
+            if merge:
+                chan.set_combine_stderr(True)
+            self._stdin = chan.makefile('wb')
+            self._stdout = chan.makefile('rb')
+            self._stderr = chan.makefile_stderr('rb')
+            if self.codec:
+                self.compressed()
+            chan.exec_command(cmd_line)
+        except Exception:
+            chan.close()
+            self.connection.release()
+            raise
+        self.stats['spawn_time'] = time.perf_counter() - start
+        with self.lock:
+            self.chan = chan
+            killed = self.killed
+        if killed:
+            # Killed while waiting for a slot
+            self.kill()
+            for fh in opened:
+                fh.close()
+            return
+
+        if stdin:
+            self.pull_stdin(stdin)
+        if stdout is not None:
+            self.redirect('stdout', stdout, opened)
+        if stderr is not None and not merge:
+            self.redirect('stderr', stderr, opened)
+
+    def start_later(self, cmd_line, stdin, stdout, stderr, opened, merge):
+        try:
+            while not self.connection.acquire(timeout=0.1):
+                if self.killed:
+                    raise RuntimeError('Remote command killed')
+            self.start(cmd_line, stdin, stdout, stderr, opened, merge)
+        except Exception as e:
+            self.error = e
+            self._stdin = self._stdout = self._stderr = io.BytesIO()
+            for fh in opened:
+                fh.close()
+
+    def started(self):
+        # Wait for the command to be started (see start_later)
+        if self.opening is not None:
+            self.opening.join()
+
+    @property
+    def stdin(self):
+        self.started()
+        return self._stdin
+
+    @property
+    def stdout(self):
+        self.started()
+        return self._stdout
+
+    @property
+    def stderr(self):
+        self.started()
+        return self._stderr
+
+    def wait(self):
+        self.started()
+        if self.error is not None:
+            raise self.error
+        self.errcode = self.chan.recv_exit_status()
+        for thread in self.to_join:
+            thread.join()
+        for stream in (self._stdin, self._stdout, self._stderr):
+            stream.flush()
+        if self.accounting and self.accounting.output is not None:
+            self.stats['rusage'] = self.accounting.rusage()
+        if self.codec:
+            from .compress import summary
+            self.stats['compression'] = summary(
+                self.codec, *self.codec_stats)
+        self.release()
+        stage_done(self.stats, self.errcode)
+        return self.errcode
+
+    def compressed(self):
+        # Compress stdin and decompress stdout on the fly
+        from .compress import CompressWriter, DecompressReader, stream_stats
+        self.codec_stats = stream_stats(), stream_stats()
+        self._stdin = CompressWriter(
+            self._stdin, self.codec.compressor(), self.codec_stats[0])
+        self._stdout = io.BufferedReader(DecompressReader(
+            self._stdout, self.codec.decompressor(), self.codec_stats[1]))
+
+    def release(self):
+        # Give back the session slot to the connection (kill and wait
+        # may race here)
+        with self.lock:
+            if self.released:
+                return
+            self.released = True
+        self.connection.release()
+
+    def streamer(self, stream, name):
+        streamer = Streamer(stream, name=name, mode=self.mode, size=self.size)
+        self.stats['streams'][name] = streamer.stats
+        return streamer
+
+    def pull_stdin(self, input_):
+        thread = self.streamer(input_, 'stdin').plug(
+            self._stdin, callback=self._close_stdin)
+        self.to_join.append(thread)
+
+    def _close_stdin(self):
+        self._stdin.flush()
+        self._stdin.close()
+        self.chan.shutdown_write()
+
+    def redirect(self, name, output, opened):
+        # Copy the stream to output right away, readers of the stream
+        # (Result or the next stage) get nothing
+        callback = output.close if output in opened else None
+        if name == 'stderr' and self.accounting:
+            output = self.accounting.wrap(output)
+        stream = getattr(self, '_' + name)
+        thread = self.streamer(stream, name).plug(output, callback=callback)
+        self.to_join.append(thread)
+        self.redirected.add(name)
+        setattr(self, '_' + name, io.BytesIO())
+
+    def push_stdout(self, output):
+        if 'stdout' in self.redirected:
+            return
+        thread = self.streamer(self.stdout, 'stdout').plug(output)
+        self.to_join.append(thread)
+
+    def push_stderr(self, output):
+        if 'stderr' in self.redirected:
+            return
+        if self.accounting:
+            output = self.accounting.wrap(output)
+        thread = self.streamer(self.stderr, 'stderr').plug(output)
+        self.to_join.append(thread)
+
+    def detach(self):
+        return pump.submit(self.wait)
+
+    def stop(self):
+        '''
+        Stop reading stdout: there is no SIGPIPE for a remote command,
+        its channel is closed
+        '''
+        self.kill()
+
+    def kill(self):
+        with self.lock:
+            self.killed = True
+            chan = self.chan
+        if chan is not None:
+            chan.close()
+            self.release()
@@ -0,0 +1,229 @@
+'''
+Broadcast the output of one command to several consumers, so that the
+producer runs only once:
+
+    tee = (sh.pg_dump + 'db').tee(sh.sha256sum, 'db.sql')
+    digest, size = tee()
+'''
+from collections import deque
+from pathlib import Path
+import io
+import tempfile
+import threading
+
+from .group import copy_chain
+from .main import Func, Result, is_cmd, pump
+
+
+class TeeBuffer(io.RawIOBase):
+    '''
+    Bounded buffer between the tee and one consumer. Once size bytes
+    are pending, put() blocks (policy 'block') or appends data to a
+    temporary file (policy 'spill') until the consumer catches up.
+    '''
+
+    def __init__(self, size, policy='block'):
+        if policy not in ('block', 'spill'):
+            raise ValueError(f'Unknown tee policy "{policy}"')
+        self.size = size
+        self.policy = policy
+        self.cond = threading.Condition()
+        self.chunks = deque()
+        self.pending = 0
+        self.current = memoryview(b'')
+        self.spill = None
+        self.spill_pos = 0
+        self.spilled = 0
+        self.eof = False
+        self.abandoned = False
+
+    def readable(self):
+        return True
+
+    def put(self, chunk):
+        '''
+        Add chunk for the consumer, return False if it is gone
+        '''
+        with self.cond:
+            while not self.abandoned:
+                if self.spill is not None:
+                    self.spill.seek(0, io.SEEK_END)
+                    self.spill.write(chunk)
+                    self.spilled += len(chunk)
+                elif self.pending < self.size:
+                    self.chunks.append(chunk)
+                    self.pending += len(chunk)
+                elif self.policy == 'spill':
+                    self.spill = tempfile.TemporaryFile()
+                    self.spill_pos = 0
+                    continue
+                else:
+                    # Slow consumer, wait for it
+                    self.cond.wait()
+                    continue
+                self.cond.notify_all()
+                return True
+            return False
+
+    def finish(self):
+        with self.cond:
+            self.eof = True
+            self.cond.notify_all()
+
+    def abandon(self):
+        # Consumer is done, drop what is left
+        with self.cond:
+            self.abandoned = True
+            self.chunks.clear()
+            self.pending = 0
+            self.close_spill()
+            self.cond.notify_all()
+
+    def close_spill(self):
+        if self.spill is not None:
+            self.spill.close()
+            self.spill = None
+
+    def next_chunk(self, size):
+        # Called with cond held, return the next data or b'' at eof
+        while True:
+            if self.chunks:
+                chunk = self.chunks.popleft()
+                self.pending -= len(chunk)
+                self.cond.notify_all()
+                return chunk
+            if self.spill is not None:
+                self.spill.seek(self.spill_pos)
+                chunk = self.spill.read(max(size, io.DEFAULT_BUFFER_SIZE))
+                if chunk:
+                    self.spill_pos += len(chunk)
+                    return chunk
+                # Consumer caught up, back to memory
+                self.close_spill()
+                continue
+            if self.eof or self.abandoned:
+                return b''
+            self.cond.wait()
+
+    def readinto(self, buff):
+        with self.cond:
+            if not self.current:
+                self.current = memoryview(self.next_chunk(len(buff)))
+            n = min(len(buff), len(self.current))
+            buff[:n] = self.current[:n]
+            self.current = self.current[n:]
+            return n
+
+
+class Tee:
+    '''
+    Run cmd once and feed its output to each sink, which can be:
+     - a Cmd or RemoteCmd (or a pipeline of them), a Result is returned
+       for it
+     - a Func, the list of the values it returned is returned
+     - a path or a writable file object, the number of bytes written
+       is returned
+
+    Each sink gets its own buffer of (at most) buffer bytes. With policy
+    'block' the producer is slowed down to the pace of the slowest sink,
+    with 'spill' the data a sink can not keep up with is stored in a
+    temporary file. A sink that stops reading (like `head`) is dropped,
+    the producer is stopped when no sink is left.
+    '''
+
+    CHUNK_SIZE = 2**16
+
+    def __init__(self, cmd, sinks, buffer=2**24, policy='block'):
+        if not sinks:
+            raise ValueError('Tee needs at least one sink')
+        self.cmd = cmd
+        self.sinks = sinks
+        self.buffers = [TeeBuffer(buffer, policy) for _ in sinks]
+        self.source = None
+        self.results = [None] * len(sinks)
+        self.errors = []
+        self.threads = []
+
+    def bg(self):
+        self.source = Result(self.cmd.run())
+        for idx, (sink, buff) in enumerate(zip(self.sinks, self.buffers)):
+            reader = io.BufferedReader(buff, self.CHUNK_SIZE)
+            self.start(self.consume, idx, sink, reader, buff)
+        self.start(self.broadcast)
+        return self
+
+    def start(self, target, *args):
+        self.threads.append(pump.submit(target, *args))
+
+    def broadcast(self):
+        try:
+            for chunk in self.source.iter_bytes(self.CHUNK_SIZE):
+                delivered = [buff.put(chunk) for buff in self.buffers]
+                if not any(delivered):
+                    # No sink left, stop (and kill) the producer
+                    break
+        except Exception as e:
+            self.errors.insert(0, e)
+        finally:
+            for buff in self.buffers:
+                buff.finish()
+
+    def consume(self, idx, sink, reader, buff):
+        try:
+            self.results[idx] = self.feed(sink, reader)
+        except Exception as e:
+            self.errors.append(e)
+        finally:
+            buff.abandon()
+
+    def feed(self, sink, reader):
+        if is_cmd(sink) or isinstance(sink, Func):
+            if head_of(sink).redirect_stdin is not None:
+                raise ValueError(f'Sink "{sink}" already has an input')
+            # Plug the reader into a copy, the sink given by the caller
+            # is left untouched
+            sink = copy_chain(sink)
+            head_of(sink).redirect_stdin = reader
+            if isinstance(sink, Func):
+                return list(sink.run(sink.args))
+            res = sink.bg()
+            res.wait()
+            return res
+        if isinstance(sink, (str, Path)):
+            with open(sink, 'wb') as fh:
+                return self.copy(reader, fh)
+        return self.copy(reader, sink)
+
+    def copy(self, reader, out):
+        size = 0
+        for chunk in iter(lambda: reader.read1(self.CHUNK_SIZE), b''):
+            out.write(chunk)
+            size += len(chunk)
+        return size
+
+    def wait(self):
+        '''
+        Wait for the producer and all the sinks, return the list of
+        sink results. The first error met (producer first) is raised.
+        '''
+        for thread in self.threads:
+            thread.join()
+        if self.errors:
+            raise self.errors[0]
+        return self.results
+
+    def kill(self):
+        if self.source is not None:
+            self.source.kill()
+        for buff in self.buffers:
+            buff.abandon()
+
+    def __call__(self):
+        return self.bg().wait()
+
+
+def head_of(node):
+    # First stage of the pipeline ending with node
+    while node.parent is not None:
+        node = node.parent
+    return node
@@ -0,0 +1,123 @@
+'''
+Tracers turning pipeline stats (see Result.stats) into spans. Register
+them with conquer.main.add_tracer:
+
+    from conquer.main import add_tracer
+    from conquer.trace import SpanTracer
+
+    tracer = add_tracer(SpanTracer())
+    (sh.seq + '1000' | sh.wc)()
+    tracer.spans  # -> one 'pipeline' span and one span per stage
+'''
+import os
+
+from .main import Tracer
+try:
+    from opentelemetry import trace as otel
+except ImportError:
+    otel = None
+
+
+def span_id(bits=64):
+    return os.urandom(bits // 8).hex()
+
+
+def attributes(stats):
+    # Flatten stage stats into OpenTelemetry-like attributes
+    attrs = {
+        'conquer.stage': stats['stage'],
+        'conquer.cmd': stats['cmd'],
+        'conquer.errcode': stats['errcode'],
+    }
+    if stats['spawn_time'] is not None:
+        attrs['conquer.spawn_time'] = stats['spawn_time']
+    for name, stream in stats['streams'].items():
+        for key, value in stream.items():
+            attrs[f'conquer.{name}.{key}'] = value
+    return attrs
+
+
+class SpanTracer(Tracer):
+    '''
+    Build one span (a dict following the OpenTelemetry data model) per
+    stage, children of a root 'pipeline' span. Spans are passed to
+    export or, if not given, accumulated in self.spans.
+    '''
+
+    def __init__(self, export=None):
+        self.export = export
+        self.spans = []
+
+    def on_result(self, stages):
+        if not stages:
+            return
+        trace_id = span_id(128)
+        root_id = span_id()
+        spans = []
+        for stats in stages:
+            spans.append(self.span(stats, trace_id, root_id))
+        root = {
+            'name': 'pipeline',
+            'trace_id': trace_id,
+            'span_id': root_id,
+            'parent_id': None,
+            'start_time': min(s['start_time'] for s in spans),
+            'end_time': max(s['end_time'] for s in spans),
+            'attributes': {'conquer.stages': len(spans)},
+            'status': spans[-1]['status'],
+        }
+        for span in [root] + spans:
+            if self.export is None:
+                self.spans.append(span)
+            else:
+                self.export(span)
+
+    def span(self, stats, trace_id, parent_id):
+        start = int(stats['start'] * 1e9)
+        wall_time = stats['wall_time'] or 0
+        return {
+            'name': stats['cmd'],
+            'trace_id': trace_id,
+            'span_id': span_id(),
+            'parent_id': parent_id,
+            'start_time': start,
+            'end_time': start + int(wall_time * 1e9),
+            'attributes': attributes(stats),
+            'status': 'OK' if not stats['errcode'] else 'ERROR',
+        }
+
+
+class OpenTelemetryTracer(Tracer):
+    '''
+    Report pipelines to OpenTelemetry (the opentelemetry-api package
+    must be installed), with the same layout as SpanTracer.
+    '''
+
+    def __init__(self, tracer_provider=None):
+        if otel is None:
+            raise RuntimeError(
+                'Please install opentelemetry-api to use OpenTelemetryTracer')
+        self.tracer = otel.get_tracer('conquer', tracer_provider=tracer_provider)
+
+    def on_result(self, stages):
+        if not stages:
+            return
+        start = min(int(s['start'] * 1e9) for s in stages)
+        end = max(int((s['start'] + (s['wall_time'] or 0)) * 1e9)
+                  for s in stages)
+        root = self.tracer.start_span(
+            'pipeline', start_time=start,
+            attributes={'conquer.stages': len(stages)})
+        context = otel.set_span_in_context(root)
+        for stats in stages:
+            attrs = {k: v for k, v in attributes(stats).items()
+                     if v is not None}
+            span = self.tracer.start_span(
+                stats['cmd'], context=context, attributes=attrs,
+                start_time=int(stats['start'] * 1e9))
+            if stats['errcode']:
+                span.set_status(otel.Status(otel.StatusCode.ERROR))
+            span.end(int((stats['start'] + (stats['wall_time'] or 0)) * 1e9))
+        if stages[-1]['errcode']:
+            root.set_status(otel.Status(otel.StatusCode.ERROR))
+        root.end(end)
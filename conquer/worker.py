@@ -0,0 +1,305 @@
+'''
+Persistent shells used to run many small commands without paying a
+process (or an SSH channel) creation for each of them.
+'''
+import io
+import os
+import queue
+import shlex
+import signal
+import subprocess
+import threading
+import uuid
+
+from .main import Result, pump
+
+
+class Shell:
+    '''
+    Long-lived sh process, local or running on an SSH channel, that
+    runs commands one after the other. Each command output is framed
+    with a random token:
+
+        <stdout>\\n<token> <errcode>\\n<stderr>\\n<token>\\n
+    '''
+
+    def __init__(self, connection=None):
+        self.token = f'__conquer_{uuid.uuid4().hex}__'.encode()
+        self.connection = connection
+        self.proc = self.chan = None
+        self.lock = threading.Lock()
+        if connection is None:
+            self.proc = subprocess.Popen(
+                ['/bin/sh'],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                # Own process group, so that kill() also stops the
+                # running command
+                start_new_session=True,
+            )
+            self.stdin = self.proc.stdin
+            self.stdout = self.proc.stdout
+        else:
+            self.chan = connection.open_session()
+            self.chan.exec_command('sh')
+            self.stdin = self.chan.makefile('wb')
+            self.stdout = self.chan.makefile('rb')
+        self.alive = True
+        # Stderr of each command is saved in a temporary directory
+        self.send('D=$(mktemp -d)\n')
+
+    def send(self, script):
+        self.stdin.write(script.encode())
+        self.stdin.flush()
+
+    def read_frame(self):
+        chunks = []
+        for line in iter(lambda: self.stdout.readline(2**16), b''):
+            if line.startswith(self.token):
+                # Drop the newline inserted before the token
+                return b''.join(chunks)[:-1], line[len(self.token):]
+            chunks.append(line)
+        self.alive = False
+        raise RuntimeError('Worker shell terminated')
+
+    def run(self, cmd_line):
+        '''
+        Run cmd_line, return stdout, stderr and the exit code
+        '''
+        token = self.token.decode()
+        self.send(
+            f'{{ {cmd_line}\n}} </dev/null 2>"$D/err"; '
+            f'printf "\\n%s %d\\n" {token} $?; '
+            f'[ -s "$D/err" ] && cat "$D/err"; '
+            f'printf "\\n%s\\n" {token}\n'
+        )
+        stdout, errcode = self.read_frame()
+        stderr, _ = self.read_frame()
+        return stdout, stderr, int(errcode)
+
+    def take_channel(self):
+        # Return the channel once, so that its connection slot is
+        # released once whatever the number of kill and close calls
+        with self.lock:
+            chan, self.chan = self.chan, None
+        return chan
+
+    def kill(self):
+        self.alive = False
+        if self.proc is not None:
+            try:
+                os.killpg(self.proc.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            return
+        chan = self.take_channel()
+        if chan is not None:
+            chan.close()
+            self.connection.release()
+
+    def close(self):
+        if not self.alive:
+            return
+        self.alive = False
+        try:
+            self.send('rm -rf "$D"; exit\n')
+        except (OSError, ValueError):
+            pass
+        if self.proc is not None:
+            self.proc.stdin.close()
+            self.proc.wait()
+            self.proc.stdout.close()
+            return
+        chan = self.take_channel()
+        if chan is not None:
+            chan.recv_exit_status()
+            chan.close()
+            self.connection.release()
+
+
+class Worker:
+    '''
+    Pool of at most size persistent shells, local or on the host behind
+    ssh (the shells then share the same connection and each keeps a
+    single channel open, at most max_sessions - 1 of them so that other
+    commands can still run on the host). Shells are started on demand.
+    Commands are created like with `sh`:
+
+        worker = Worker(size=4)
+        worker.stat('-c', '%s', 'setup.py')
+        worker.test + '-d' + '/tmp'
+
+    Arguments are quoted, pipes and redirections are not supported.
+    '''
+
+    def __init__(self, ssh=None, size=1):
+        self.ssh = ssh
+        if ssh is not None:
+            size = max(1, min(size, ssh.connection.max_sessions - 1))
+        self.size = size
+        self.shells = []
+        self.idle = queue.Queue()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        try:
+            shell = self.idle.get_nowait()
+        except queue.Empty:
+            shell = None
+        while shell is None:
+            shell = self.spawn()
+            if shell is None:
+                # None is also put when a shell died, its place is free
+                shell = self.idle.get()
+        return shell
+
+    def spawn(self):
+        # Start a new shell, None if the pool is full
+        with self.lock:
+            if len(self.shells) >= self.size:
+                return None
+            connection = self.ssh.connection if self.ssh else None
+            shell = Shell(connection)
+            self.shells.append(shell)
+            return shell
+
+    def release(self, shell):
+        if shell.alive:
+            self.idle.put(shell)
+            return
+        with self.lock:
+            self.shells.remove(shell)
+        # Free its channel if it died on its own
+        shell.kill()
+        # Wake a waiting thread, it starts a new shell if needed
+        self.idle.put(None)
+
+    def close(self):
+        with self.lock:
+            shells, self.shells = self.shells, []
+        for shell in shells:
+            shell.close()
+
+    def __getattr__(self, name):
+        return WorkerCmd(self, name)
+
+    def __call__(self, script):
+        return WorkerCmd(self, script)()
+
+
+class WorkerCmd:
+
+    def __init__(self, worker, cmd, args=tuple()):
+        self.worker = worker
+        self.cmd = cmd
+        self.args = args
+
+    def command_line(self, extra_args=tuple()):
+        args = ' '.join(shlex.quote(a) for a in self.args + extra_args)
+        return f'{self.cmd} {args}'
+
+    def run(self, extra_args=tuple()):
+        return WorkerProcess(self.worker, self.command_line(extra_args))
+
+    def __call__(self, *extra_args, _spill=None, _limit=None, _timeout=None,
+                 _cancel=None):
+        res = self.bg(*extra_args, _spill=_spill, _limit=_limit,
+                      _timeout=_timeout, _cancel=_cancel)
+        res.wait()
+        return res
+
+    def bg(self, *extra_args, _spill=None, _limit=None, _timeout=None,
+           _cancel=None):
+        process = self.run(extra_args)
+        res = Result(process, spill=_spill, limit=_limit, timeout=_timeout,
+                     cancel=_cancel)
+        return res
+
+    def clone(self, *extra_args):
+        return WorkerCmd(self.worker, self.cmd, self.args + extra_args)
+
+    def __add__(self, arg):
+        return self.clone(arg)
+
+    def __sub__(self, arg):
+        return self.clone(f'-{arg}')
+
+    def __truediv__(self, arg):
+        return self.clone(f'/{arg}')
+
+    def __str__(self):
+        return self.command_line()
+
+
+class WorkerProcess:
+    '''
+    Process-like wrapper (as expected by Result) around a command run
+    by a worker shell, the command is started in the background.
+    '''
+
+    def __init__(self, worker, cmd_line):
+        self.worker = worker
+        self.mode = self.size = None
+        self.shell = None
+        self.killed = False
+        self.lock = threading.Lock()
+        self.errcode = None
+        self.error = None
+        self.out = self.err = b''
+        self.outputs = []
+        self.thread = pump.submit(self._run, cmd_line)
+
+    def _run(self, cmd_line):
+        shell = self.worker.acquire()
+        with self.lock:
+            if self.killed:
+                self.worker.release(shell)
+                self.error = RuntimeError('Worker command killed')
+                self.errcode = -signal.SIGKILL
+                return
+            self.shell = shell
+        try:
+            self.out, self.err, self.errcode = shell.run(cmd_line)
+        except Exception as e:
+            self.error = e
+            self.errcode = -1
+        finally:
+            # The shell goes to other commands, kill() must not reach it
+            with self.lock:
+                self.shell = None
+            self.worker.release(shell)
+
+    @property
+    def stdout(self):
+        self.thread.join()
+        return io.BytesIO(self.out)
+
+    @property
+    def stderr(self):
+        self.thread.join()
+        return io.BytesIO(self.err)
+
+    def push_stdout(self, output):
+        self.outputs.append(('out', output))
+
+    def push_stderr(self, output):
+        self.outputs.append(('err', output))
+
+    def wait(self):
+        self.thread.join()
+        if self.error is not None and not self.err:
+            self.err = str(self.error).encode()
+        for name, output in self.outputs:
+            output.write(self.out if name == 'out' else self.err)
+        self.outputs = []
+        return self.errcode
+
+    def detach(self):
+        return pump.submit(self.wait)
+
+    def kill(self):
+        with self.lock:
+            self.killed = True
+            if self.shell is not None:
+                self.shell.kill()
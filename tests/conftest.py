@@ -0,0 +1,154 @@
+import io
+import subprocess
+
+import pytest
+from conquer.remote import Connection, SSH
+
+
+class FakeChannel:
+    # Channel of a remote command writing stdout and stderr
+
+    stdout = b'out\n'
+    stderr = b'err\n'
+
+    def __init__(self, **kw):
+        self.kw = kw
+        self.combine = False
+        self.closed = False
+        self.command = None
+
+    def makefile(self, mode):
+        return io.BytesIO() if 'w' in mode else io.BytesIO(self.stdout)
+
+    def makefile_stderr(self, mode):
+        return io.BytesIO(b'' if self.combine else self.stderr)
+
+    def set_combine_stderr(self, combine):
+        self.combine = combine
+
+    def exec_command(self, cmd_line):
+        self.command = cmd_line
+
+    def invoke_subsystem(self, name):
+        self.command = name
+
+    def recv_exit_status(self):
+        return 0
+
+    def shutdown_write(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class Stream:
+    # File of the local process, available once the command started
+
+    def __init__(self, chan, name):
+        self.chan = chan
+        self.name = name
+
+    def __getattr__(self, attr):
+        return getattr(getattr(self.chan.proc, self.name), attr)
+
+    def flush(self):
+        try:
+            getattr(self.chan.proc, self.name).flush()
+        except ValueError:
+            pass
+
+
+class LocalChannel:
+    # Channel running its command with a local sh
+
+    def __init__(self, **kw):
+        self.proc = None
+
+    def makefile(self, mode):
+        return Stream(self, 'stdin' if mode == 'wb' else 'stdout')
+
+    def makefile_stderr(self, mode):
+        return Stream(self, 'stderr')
+
+    def exec_command(self, cmd_line):
+        self.proc = subprocess.Popen(
+            ['sh', '-c', cmd_line], stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def recv_exit_status(self):
+        return self.proc.wait()
+
+    def shutdown_write(self):
+        pass
+
+    def close(self):
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.kill()
+            self.proc.wait()
+
+
+class FakeTransport:
+
+    def __init__(self, channel=FakeChannel):
+        self.channel = channel
+        self.active = True
+        self.keepalive = None
+
+    def is_active(self):
+        return self.active
+
+    def set_keepalive(self, interval):
+        self.keepalive = interval
+
+    def open_session(self, **kw):
+        return self.channel(**kw)
+
+
+class FakeClient:
+
+    def __init__(self, channel=FakeChannel):
+        self.transport = FakeTransport(channel)
+        self.closed = False
+
+    def get_transport(self):
+        return self.transport
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def fake_client():
+    '''
+    Class of the fake paramiko clients, FakeClient(channel) opens
+    channels with the channel factory
+    '''
+    return FakeClient
+
+
+@pytest.fixture
+def fake_connection():
+    '''
+    Factory of Connections on a fake client, see FakeChannel for the
+    default channels
+    '''
+    def make(channel=FakeChannel, max_sessions=8):
+        return Connection(lambda: FakeClient(channel),
+                          max_sessions=max_sessions, keepalive=None)
+    return make
+
+
+@pytest.fixture
+def fake_ssh(fake_connection):
+    '''
+    Factory of SSH instances on a fake connection
+    '''
+    def make(connection=None, host='fake', compress=None, **kw):
+        ssh = SSH.__new__(SSH)
+        ssh._host = host
+        ssh._accounting = False
+        ssh._compress = compress
+        ssh.connection = connection or fake_connection(**kw)
+        return ssh
+    return make
@@ -0,0 +1,126 @@
+import asyncio
+import os
+import threading
+
+import pytest
+from conquer import sh, Func
+from conquer.main import Cmd
+from conquer.remote import RemoteCmd
+
+
+def test_aio():
+    res = asyncio.run((sh.echo + 'ham\nspam').aio())
+    assert res.success
+    assert res == 'ham\nspam\n'
+
+
+def test_aio_pipe():
+    cmd = sh.python + 'tests/chatty.py' | sh.wc -'l'
+    res = asyncio.run(cmd.aio())
+    assert res.stdout.strip() == b'2000'
+
+
+def fn():
+    for i in range(10):
+        yield str(i)
+
+
+def test_aio_func():
+    cmd = Func(fn) | sh.cat
+    res = asyncio.run(cmd.aio())
+    assert res == '0123456789'
+
+
+def test_astream():
+    async def collect():
+        cmd = sh.echo + 'ham\nspam' | sh.cat
+        return [line async for line in cmd.astream()]
+    assert asyncio.run(collect()) == ['ham\n', 'spam\n']
+
+
+def test_concurrent():
+    async def many():
+        cmds = [(sh.echo + str(i)).aio() for i in range(50)]
+        return await asyncio.gather(*cmds)
+    results = asyncio.run(many())
+    assert [int(r.stdout) for r in results] == list(range(50))
+
+
+def test_aio_redirect(tmp_path):
+    out = tmp_path / 'out.txt'
+    cmd = (sh.echo + 'ham' > out) | sh.wc + '-c'
+    res = asyncio.run(cmd.aio())
+    assert res.stdout.strip() == b'0'
+    assert out.read_text() == 'ham\n'
+
+
+def test_aio_stream_result():
+    res = asyncio.run((sh.cat < sh.echo.bg('ham')).aio())
+    assert res.stdout == b'ham\n'
+
+    # Errors while feeding stdin are raised
+    with pytest.raises(RuntimeError):
+        asyncio.run((sh.cat < sh.ls.bg('/nope')).aio())
+
+
+def test_aio_shell_args():
+    # Same command line as the sync engine
+    cmd = Cmd('echo "$0|$1"', _shell=True)
+    res = asyncio.run(cmd.aio('a b', '$c'))
+    assert res.stdout == cmd('a b', '$c').stdout == b'a b|$c\n'
+
+
+class LoopChannel:
+    # Channel read by the asyncio engine: its fileno is readable once
+    # per chunk, the output comes after a short delay
+
+    def __init__(self, **kw):
+        self.read_fd, self.write_fd = os.pipe()
+        self.chunks = [b'out\n', b'']
+        self.closed = False
+
+    def exec_command(self, cmd_line):
+        threading.Timer(0.02, os.write, (self.write_fd, b'..')).start()
+
+    def setblocking(self, flag):
+        pass
+
+    def fileno(self):
+        return self.read_fd
+
+    def recv_stderr_ready(self):
+        return False
+
+    def recv(self, size):
+        os.read(self.read_fd, 1)
+        chunk = self.chunks.pop(0)
+        if not chunk:
+            # The engine stops watching the fd at eof
+            os.close(self.read_fd)
+            os.close(self.write_fd)
+        return chunk
+
+    def shutdown_write(self):
+        pass
+
+    def exit_status_ready(self):
+        return not self.chunks
+
+    def recv_exit_status(self):
+        return 0
+
+    def close(self):
+        self.closed = True
+
+
+def test_aio_sessions(fake_ssh):
+    # Many more commands than session slots
+    ssh = fake_ssh(channel=LoopChannel, max_sessions=4)
+
+    async def main():
+        jobs = [RemoteCmd(ssh, 'cmd').aio() for _ in range(50)]
+        return await asyncio.wait_for(asyncio.gather(*jobs), 10)
+
+    results = asyncio.run(main())
+    assert [r.stdout for r in results] == [b'out\n'] * 50
+    assert ssh.connection.stats()['channels'] == 0
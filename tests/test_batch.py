@@ -0,0 +1,92 @@
+import io
+import json
+import subprocess
+import sys
+import time
+
+import pytest
+from conquer.batch import Batch, load
+
+
+def test_load(tmp_path):
+    lines = tmp_path / 'jobs.txt'
+    lines.write_text('# comment\nlocal echo ham\n\nweb1 uptime -p\n')
+    assert load(str(lines)) == [
+        {'id': '0', 'host': 'local', 'cmd': 'echo ham'},
+        {'id': '1', 'host': 'web1', 'cmd': 'uptime -p'},
+    ]
+    doc = tmp_path / 'jobs.json'
+    doc.write_text(json.dumps({'jobs': [
+        'echo spam', {'id': 'up', 'host': 'web1', 'cmd': 'uptime'}]}))
+    assert load(str(doc)) == [
+        {'id': '0', 'host': 'local', 'cmd': 'echo spam'},
+        {'id': 'up', 'host': 'web1', 'cmd': 'uptime'},
+    ]
+    doc.write_text('[{"host": "web1"}]')
+    with pytest.raises(ValueError):
+        load(str(doc))
+
+
+def run(jobs, **kw):
+    out = io.StringIO()
+    counts = Batch(jobs, out=out, **kw).run()
+    return counts, [json.loads(line) for line in out.getvalue().splitlines()]
+
+
+def test_run():
+    jobs = [{'id': str(i), 'host': 'local', 'cmd': f'echo {i}'}
+            for i in range(20)]
+    jobs.append({'id': 'bad', 'host': 'local', 'cmd': 'echo oops >&2; exit 3'})
+    counts, records = run(jobs, concurrency=5)
+    assert counts == {'ok': 20, 'failed': 1, 'skipped': 0}
+    by_id = {r['id']: r for r in records}
+    assert by_id['7']['stdout'] == '7\n'
+    assert by_id['bad']['errcode'] == 3
+    assert by_id['bad']['stderr'] == 'oops\n'
+
+
+def test_limits():
+    jobs = [{'id': str(i), 'host': 'local', 'cmd': 'sleep 0.2'}
+            for i in range(6)]
+    start = time.perf_counter()
+    run(jobs, concurrency=6, per_host=2)
+    # Three waves of two jobs
+    assert time.perf_counter() - start >= 0.6
+
+    counts, records = run(jobs[:1], timeout=0.05)
+    assert counts['failed'] == 1
+    assert records[0]['error'].startswith('Timeout')
+
+    # The commands of a compound line are killed too
+    start = time.perf_counter()
+    job = {'id': 'slow', 'host': 'local', 'cmd': 'sleep 5; true'}
+    counts, records = run([job], timeout=0.2)
+    assert records[0]['error'].startswith('Timeout')
+    assert time.perf_counter() - start < 2
+
+
+def test_checkpoint(tmp_path):
+    checkpoint = str(tmp_path / 'done')
+    stamp = tmp_path / 'stamp'
+    jobs = [
+        {'id': 'a', 'host': 'local', 'cmd': f'echo a >> {stamp}'},
+        {'id': 'b', 'host': 'local', 'cmd': 'false'},
+    ]
+    assert run(jobs, checkpoint=checkpoint)[0]['failed'] == 1
+    counts, records = run(jobs, checkpoint=checkpoint)
+    assert counts == {'ok': 0, 'failed': 0, 'skipped': 2}
+    counts, records = run(jobs, checkpoint=checkpoint, retry_failed=True)
+    assert counts == {'ok': 0, 'failed': 1, 'skipped': 1}
+    assert [r['id'] for r in records] == ['b']
+    assert stamp.read_text() == 'a\n'
+
+
+def test_cli(tmp_path):
+    jobs = tmp_path / 'jobs.txt'
+    jobs.write_text('local echo ham\nlocal echo spam\n')
+    out = subprocess.run([sys.executable, '-m', 'conquer', str(jobs)],
+                         capture_output=True, text=True)
+    assert out.returncode == 0
+    records = [json.loads(line) for line in out.stdout.splitlines()]
+    assert sorted(r['stdout'] for r in records) == ['ham\n', 'spam\n']
+    assert json.loads(out.stderr) == {'ok': 2, 'failed': 0, 'skipped': 0}
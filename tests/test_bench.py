@@ -0,0 +1,25 @@
+import json
+from benchmarks.__main__ import main, compare
+
+
+def test_compare():
+    baseline = {
+        'speed': {'value': 100, 'unit': 'MB/s'},
+        'latency': {'value': 1, 'unit': 's'},
+    }
+    results = {
+        'speed': {'value': 50, 'unit': 'MB/s'},
+        'latency': {'value': 1.05, 'unit': 's'},
+        'new': {'value': 1, 'unit': 's'},
+    }
+    assert compare(results, baseline, 0.1) == [('speed', 2)]
+
+
+def test_run(tmp_path):
+    output = tmp_path / 'bench.json'
+    args = ['spawn', 'pipes', '--size', '1', '--spawn-count', '2',
+            '--output', str(output)]
+    assert main(args) == 0
+    results = json.loads(output.read_text())
+    assert results['pipe.cmd_func_cmd']['unit'] == 'MB/s'
+    assert main(args + ['--baseline', str(output), '--tolerance', '100']) == 0
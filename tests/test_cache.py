@@ -0,0 +1,100 @@
+import json
+import pickle
+import time
+
+import pytest
+from conquer import sh, Cache, Func
+
+
+def test_hit(tmp_path):
+    cache = Cache()
+    stamp = tmp_path / 'stamp'
+    cmd = sh.sh + '-c' + f'echo run >> {stamp}; echo hello'
+    first = cmd(_cache=cache)
+    second = cmd(_cache=cache)
+    assert first.stdout == second.stdout == b'hello\n'
+    assert stamp.read_text() == 'run\n'
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['hit_rate'] == 0.5
+
+    # Cached results can be iterated too
+    assert list(cmd.bg()) == ['hello\n']
+    assert list(cache.run(cmd)) == ['hello\n']
+
+
+def test_key():
+    cache = Cache()
+    assert cache.key(sh.echo, ('a',)) == cache.key(sh.echo + 'a')
+    assert cache.key(sh.echo + 'a') != cache.key(sh.echo + 'b')
+    assert cache.key(sh.echo | sh.cat) != cache.key(sh.cat)
+    # stdin is part of the key
+    first = sh.cat < 'setup.py'
+    assert cache.key(first) != cache.key(sh.cat < 'README.md')
+    assert cache.key(first) == cache.key(sh.cat < 'setup.py')
+    assert first().stdout == open('setup.py', 'rb').read()
+    # Func stages are not cached
+    assert cache.key(Func(str.upper) | sh.cat) is None
+    # So is the output limit
+    assert cache.key(sh.echo, limit=10) != cache.key(sh.echo)
+    sh.seq('100', _cache=cache)
+    assert len(sh.seq('100', _limit=10, _cache=cache).stdout) == 10
+
+
+def test_ttl_lru():
+    cache = Cache(ttl=0.1, max_size=2)
+    for arg in ('a', 'b', 'c'):
+        sh.echo(arg, _cache=cache)
+    assert cache.stats()['size'] == 2
+    sh.echo('c', _cache=cache)
+    assert cache.stats()['hits'] == 1
+    time.sleep(0.2)
+    sh.echo('c', _cache=cache)
+    assert cache.stats()['hits'] == 1
+
+
+def test_errors_not_cached():
+    cache = Cache()
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            sh.false(_cache=cache)
+    assert cache.stats()['size'] == 0
+
+
+def test_bypass_invalidate():
+    cache = Cache()
+    sh.echo('a', _cache=cache)
+    cache.run(sh.echo, 'a', refresh=True)
+    assert cache.stats()['hits'] == 0
+    cache.enabled = False
+    sh.echo('a', _cache=cache)
+    assert cache.stats()['bypassed'] == 1
+    cache.enabled = True
+    cache.invalidate(sh.echo, 'a')
+    assert cache.stats()['size'] == 0
+    sh.echo('b', _cache=cache)
+    cache.invalidate(host='local')
+    assert cache.stats()['size'] == 0
+
+
+def test_disk(tmp_path):
+    first = Cache(path=tmp_path)
+    sh.echo('disk', _cache=first)
+    second = Cache(path=tmp_path)
+    assert sh.echo('disk', _cache=second).stdout == b'disk\n'
+    assert second.stats()['hits'] == 1
+    second.clear()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_disk_format(tmp_path):
+    # Plain data, nothing read from the directory is unpickled
+    cache = Cache(path=tmp_path)
+    sh.echo('disk', _cache=cache)
+    path, = tmp_path.iterdir()
+    header, data = path.read_bytes().split(b'\n', 1)
+    assert json.loads(header)['errcode'] == 0
+    assert data == b'disk\n'
+    path.write_bytes(pickle.dumps({'stdout': b'evil\n'}))
+    assert Cache(path=tmp_path).get(path.name) is None
+    path.write_bytes(header + b'\ndi')
+    assert Cache(path=tmp_path).get(path.name) is None
@@ -0,0 +1,31 @@
+from conquer import sh
+from conquer.main import Capture
+
+
+def test_spill():
+    buff = Capture(spill=10)
+    buff.write(b'ham\n')
+    assert not buff.spilled
+    buff.write(b'spam\n' * 3)
+    assert buff.spilled
+    assert buff.getvalue() == b'ham\n' + b'spam\n' * 3
+    assert buff.view() == b'ham\n' + b'spam\n' * 3
+
+
+def test_limit():
+    buff = Capture(limit=6)
+    for i in range(10):
+        buff.write(str(i).encode())
+    assert buff.getvalue() == b'012789'
+    assert buff.dropped == 4
+
+
+def test_result():
+    res = (sh.seq + '10000')(_spill=1024)
+    assert res.stdout_view[:5] == b'1\n2\n3'
+    assert len(res.stdout.splitlines()) == 10000
+
+    size = len(sh.seq('10000').stdout)
+    res = (sh.seq + '10000')(_limit=10)
+    assert res.stdout == b'1\n2\n3' + b'0000\n'
+    assert res.stdout_dropped == size - 10
@@ -0,0 +1,24 @@
+from conquer import sh
+from conquer.remote import RemoteCmd
+
+
+def test_collapse(fake_ssh):
+    host, other = fake_ssh(host='ham'), fake_ssh(host='spam')
+    first = RemoteCmd(host, 'cat', ('big.log',))
+    cmd = first | RemoteCmd(host, 'grep') + 'ERR' | RemoteCmd(host, 'wc')
+    head, cmd_line = cmd.collapse(('-l',))
+    assert head is first
+    assert cmd_line == 'cat big.log | grep ERR | wc -l'
+
+    # Stop at host change and at local stages
+    cmd = sh.env | first | RemoteCmd(other, 'grep') + 'ERR'
+    head, cmd_line = cmd.collapse()
+    assert head is cmd
+    assert cmd_line == 'grep ERR'
+    head, cmd_line = cmd.parent.collapse()
+    assert head is first
+
+    # Stop at stages whose output is redirected
+    cmd = (first > 'out.log') | RemoteCmd(host, 'wc')
+    head, cmd_line = cmd.collapse()
+    assert head is cmd
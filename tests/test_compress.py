@@ -0,0 +1,63 @@
+import subprocess
+
+import pytest
+from conquer import sh
+from conquer.compress import Codec, resolve
+from conquer.remote import RemoteCmd
+
+from .conftest import LocalChannel
+
+
+def test_compress(fake_ssh):
+    ssh = fake_ssh(compress='gzip', channel=LocalChannel)
+    res = RemoteCmd(ssh, 'seq 100000')()
+    assert res.stdout == sh.seq('100000').stdout
+    stats = res.stats[-1]['compression']
+    assert stats['codec'] == 'gzip'
+    assert stats['stdout']['bytes'] == len(res.stdout)
+    assert stats['ratio'] > 2
+
+    # Compressed stdin, exit code and stderr are kept
+    cmd = sh.seq + '1000' | RemoteCmd(ssh, 'wc -l; echo err >&2; exit 3')
+    with pytest.raises(RuntimeError):
+        cmd()
+    res = cmd.bg()
+    try:
+        res.wait()
+    except RuntimeError:
+        pass
+    assert res.stdout.strip() == b'1000'
+    assert res.stderr == b'err\n'
+    assert res.process.errcode == 3
+    assert res.stats[-1]['compression']['stdin']['bytes'] == 3893
+
+
+def test_fallback(fake_ssh):
+    ssh = fake_ssh(compress='auto', channel=LocalChannel)
+    codec = resolve(ssh, 'auto')
+    assert codec.name in ('zstd', 'gzip') and codec.local()
+    ssh.connection.codecs = set()
+    assert resolve(ssh, 'auto') is None
+    res = RemoteCmd(ssh, 'echo raw')()
+    assert res.stdout == b'raw\n'
+    assert 'compression' not in res.stats[-1]
+    with pytest.raises(ValueError):
+        resolve(ssh, 'lzma')
+
+
+def test_script():
+    script = Codec('gzip').command_line('tr a-z A-Z', stdin=True)
+    data = subprocess.run(['gzip', '-c'], input=b'hello', capture_output=True)
+    out = subprocess.run(['sh', '-c', script], input=data.stdout,
+                         capture_output=True)
+    assert subprocess.run(['gzip', '-dc'], input=out.stdout,
+                          capture_output=True).stdout == b'HELLO'
+
+
+def test_option_names(fake_ssh):
+    # Options do not hide the remote commands with the same name
+    ssh = fake_ssh(compress='gzip')
+    assert isinstance(ssh.compress, RemoteCmd)
+    assert ssh.compress.compression == 'gzip'
+    with pytest.raises(AttributeError):
+        ssh._nope
@@ -0,0 +1,32 @@
+from concurrent import futures
+from conquer import sh, Func
+
+
+def square(line):
+    return int(line) ** 2
+
+
+def total(lines):
+    return sum(map(int, lines))
+
+
+def count(block):
+    return block.tobytes().count(b'\n')
+
+
+def test_process_pool():
+    cmd = sh.seq + '200' | Func(square, pool='process', workers=2)
+    assert list(cmd()) == [i * i for i in range(1, 201)]
+
+
+def test_batch():
+    cmd = sh.seq + '1000' | Func(total, batch=300, pool='thread')
+    res = list(cmd())
+    assert len(res) == 4
+    assert sum(res) == sum(range(1, 1001))
+
+
+def test_block():
+    with futures.ThreadPoolExecutor(2) as executor:
+        cmd = sh.seq + '10000' | Func(count, block=1024, pool=executor)
+        assert sum(cmd()) == 10000
@@ -0,0 +1,46 @@
+import pytest
+import conquer
+from conquer import sh, Group
+from conquer.group import copy_chain
+from conquer.remote import RemoteCmd
+
+
+def test_map():
+    cmd = sh.python + 'tests/chatty.py' | sh.wc
+    args = ['-m', '-w', '-L']
+    expected = {'-m': 7780, '-w': 2000, '-L': 3}
+    for arg, res in conquer.map(cmd, args, concurrency=2):
+        assert res.success
+        assert expected[arg] == int(res.stdout)
+
+
+def test_collect_all():
+    group = Group(sh.test, [('-d', '/'), ('-f', '/')])
+    results = group.results()
+    assert results[('-d', '/')].success
+    assert not results[('-f', '/')].success
+    assert set(group.timings) == {('-d', '/'), ('-f', '/')}
+
+
+def test_fail_fast():
+    with pytest.raises(RuntimeError):
+        list(Group(sh.sleep, ['10', 'nope'], fail_fast=True))
+
+
+def test_stdin_per_run(tmp_path):
+    path = tmp_path / 'in.txt'
+    path.write_bytes(b'0123456789')
+    cmd = sh.head + '-c' < str(path)
+    results = Group(cmd, ['3', '5']).results()
+    assert results['3'].stdout == b'012'
+    assert results['5'].stdout == b'01234'
+
+
+def test_bind_ssh(fake_ssh):
+    ssh0, ssh1 = fake_ssh(host='ham'), fake_ssh(host='spam')
+    cmd = RemoteCmd(ssh0, 'cat', ('log',)) | sh.sort | RemoteCmd(ssh0, 'grep')
+    other = copy_chain(cmd, ssh0, ssh1)
+    # Every stage of the template host moves to the target
+    assert other.ssh is other.parent.parent.ssh is ssh1
+    assert other.parent.cmd == cmd.parent.cmd
+    assert cmd.ssh is cmd.parent.parent.ssh is ssh0
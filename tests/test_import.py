@@ -0,0 +1,39 @@
+import subprocess
+import sys
+
+# Budget for `from conquer import sh` (paramiko alone takes more)
+BUDGET = 0.15
+SCRIPT = '''
+import sys
+from conquer import sh
+print(' '.join(sorted(sys.modules)))
+'''
+
+
+def import_time():
+    # Return the cumulative import time of conquer and the loaded
+    # modules, in a fresh interpreter
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', SCRIPT],
+                         capture_output=True, text=True, check=True)
+    for line in out.stderr.splitlines():
+        if line.endswith('| conquer'):
+            cumulative = int(line.split('|')[1])
+    return cumulative / 1e6, set(out.stdout.split())
+
+
+def test_import_budget():
+    timings = []
+    for _ in range(3):
+        elapsed, modules = import_time()
+        timings.append(elapsed)
+        for name in ('conquer.remote', 'paramiko', 'concurrent.futures'):
+            assert name not in modules
+    assert min(timings) < BUDGET
+
+
+def test_lazy_ssh():
+    import conquer
+    from conquer import main, remote
+    assert conquer.SSH is main.SSH is remote.SSH
+    assert main.is_cmd(remote.RemoteCmd(None, 'ls'))
+    assert not main.is_remote(conquer.sh.ls)
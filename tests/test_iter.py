@@ -0,0 +1,71 @@
+import pytest
+from conquer import sh, Func
+from conquer.main import Streamer, decode
+
+
+def test_decode():
+    data = 'hé ho ☃\n'.encode()
+    chunks = [data[i:i + 1] for i in range(len(data))]
+    assert ''.join(decode(chunks)) == 'hé ho ☃\n'
+
+
+def test_iter_split_char():
+    # Multibyte characters straddling two reads
+    cmd = (sh.printf + 'é' * 3000).stream_mode('line', size=1001)
+    assert ''.join(cmd.bg()) == 'é' * 3000
+
+
+def test_iter_bytes():
+    chunks = list(sh.seq.bg('1000').iter_bytes(100))
+    assert all(len(c) <= 100 for c in chunks)
+    assert b''.join(chunks) == sh.seq('1000').stdout
+
+
+def test_iter_lines():
+    res = (sh.printf + 'ham\nspam\neggs').bg()
+    assert list(res.iter_lines()) == ['ham\n', 'spam\n', 'eggs']
+    res = (sh.printf + 'ham\nspam\n').bg()
+    assert list(res.iter_lines(encoding=None, keepends=False)) == [
+        b'ham', b'spam']
+
+    # Lines longer than the read size are not split
+    line = 'x' * 100000
+    script = "print('x' * 100000); print('x' * 100000, end='')"
+    res = (sh.python + '-c').bg(script)
+    assert list(res.iter_lines()) == [line + '\n', line]
+
+
+def test_iter_records():
+    res = (sh.printf + 'a\\0b c\\0d\n\\0').bg()
+    assert list(res.iter_records()) == [b'a', b'b c', b'd\n']
+    res = (sh.printf + 'é|ô||').bg()
+    assert list(res.iter_records(b'||', encoding='utf-8',
+                                 keepends=True)) == ['é|ô||']
+
+    # A truncated character is an error
+    res = (sh.printf + 'a\\0b\\303').bg()
+    with pytest.raises(UnicodeDecodeError):
+        list(res.iter_records(encoding='utf-8'))
+
+
+def test_records_straddling():
+    class Reads:
+        # Stream returning fixed reads
+        def __init__(self, reads):
+            self.reads = iter(reads)
+
+        def readline(self):
+            pass
+
+        def read(self, size):
+            return next(self.reads, b'')
+
+    reads = [b'ab:', b':cd', b':', b':e']
+    streamer = Streamer(Reads(reads), mode=b'::')
+    assert list(streamer.reader()) == [b'ab::', b'cd::', b'e']
+
+
+def test_func_split_char():
+    cmd = (sh.printf + 'é' * 3000).stream_mode('line', size=1001) | Func(
+        str.upper) | sh.cat
+    assert cmd().stdout.decode() == 'É' * 3000
@@ -0,0 +1,63 @@
+from pathlib import Path
+import time
+
+import pytest
+from conquer import sh, Func
+from conquer.main import Cmd
+
+
+def test_pipeline():
+    cmd = sh.echo + 'ham\nspam\nfoo' | sh.grep + 'am' | sh.wc - 'l'
+    res = cmd(_native=True)
+    assert res.stdout.strip() == b'2'
+    assert res.process.errcodes == [0, 0, 0]
+
+
+def test_redirect(tmp_path):
+    path = tmp_path / 'out.txt'
+    path.write_text('ham\nspam\n')
+    cmd = (sh.cat < str(path)) | sh.wc - 'l'
+    assert cmd(_native=True).stdout.strip() == b'2'
+
+    res = sh.echo('ham')
+    cmd = (res > sh.cat) | sh.wc - 'c'
+    assert cmd(_native=True).stdout.strip() == b'4'
+
+
+def test_kill():
+    res = (sh.yes | sh.cat).bg(_native=True)
+    it = iter(res)
+    assert next(it) == 'y\n'
+    start = time.time()
+    res.kill()
+    res.process.wait()
+    assert time.time() - start < 1
+    assert res.process.errcodes == [-9, -9]
+
+
+def fn():
+    yield 'ham'
+
+
+def test_fallback():
+    # Func stages are not native
+    cmd = Func(fn) | sh.cat
+    assert cmd(_native=True) == 'ham'
+
+
+def test_spawn_error(tmp_path):
+    path = tmp_path / 'noexec'
+    path.write_text('echo ham\n')
+    src = tmp_path / 'in.txt'
+    src.write_text('ham\n')
+    cmd = (sh.cat < str(src)) | Cmd(str(path))
+    with pytest.raises(PermissionError):
+        cmd(_native=True)
+    # The caller's stdin is left open
+    assert not cmd.parent.redirect_stdin.closed
+    cmd.parent.redirect_stdin.close()
+
+
+def test_path_arg():
+    res = (sh.cat + Path('setup.py'))(_native=True)
+    assert res.stdout == Path('setup.py').read_bytes()
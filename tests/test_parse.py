@@ -0,0 +1,60 @@
+import json
+
+import pytest
+import conquer
+from conquer import sh
+from conquer.parse import Parser, complete
+
+
+def test_complete():
+    blocks = [b'a\nb', b'c', b'\nd\n', b'e']
+    assert list(complete(blocks, b'\n')) == [b'a\n', b'bc\nd\n', b'e']
+
+
+def test_jsonl():
+    docs = [{'n': i, 'text': 'é\nx' * (i % 3)} for i in range(2000)]
+    payload = '\n'.join(json.dumps(d, ensure_ascii=False) for d in docs)
+    # Small blocks so that documents straddle two reads
+    cmd = (sh.printf + '%s\n' + payload) | conquer.jsonl(block=1000)
+    assert list(cmd) == docs
+
+
+def test_jsonl_fallback():
+    cmd = (sh.printf + '1\n\n[2]\n {"a": null}\n') | conquer.jsonl()
+    assert list(cmd) == [1, [2], {'a': None}]
+
+    cmd = (sh.printf + '1\n2, 3\n') | conquer.jsonl()
+    with pytest.raises(ValueError):
+        list(cmd)
+
+
+def test_jsonl_error():
+    cmd = (sh.sh + '-c' + 'echo 1; exit 2') | conquer.jsonl()
+    with pytest.raises(RuntimeError):
+        list(cmd)
+
+
+def test_csv():
+    payload = 'name,comment\nham,"multi\nline, ""quoted"""\nspam,\n'
+    cmd = (sh.printf + '%s' + payload) | conquer.csv(block=7)
+    assert list(cmd) == [
+        ['name', 'comment'],
+        ['ham', 'multi\nline, "quoted"'],
+        ['spam', ''],
+    ]
+    cmd = (sh.printf + '%s' + payload) | conquer.csv(header=True)
+    assert list(cmd)[0] == {'name': 'ham', 'comment': 'multi\nline, "quoted"'}
+
+
+def test_tail_only():
+    with pytest.raises(ValueError):
+        sh.ls | conquer.jsonl() | sh.cat
+
+
+def test_custom():
+    def words(blocks):
+        for block in complete(blocks, b' '):
+            yield from block.split()
+
+    cmd = (sh.printf + 'ham spam eggs') | Parser(words, block=3)
+    assert list(cmd) == [b'ham', b'spam', b'eggs']
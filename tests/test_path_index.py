@@ -0,0 +1,35 @@
+import os
+from conquer import sh
+from conquer.main import path_index, PathIndex
+
+
+def test_cache():
+    path_index.refresh()
+    hits, misses = path_index.hits, path_index.misses
+    sh.echo
+    assert path_index.misses == misses + 1
+    sh.echo
+    sh.echo
+    assert path_index.hits == hits + 2
+    assert path_index.misses == misses + 1
+
+
+def test_invalidation(tmp_path, monkeypatch):
+    index = PathIndex()
+    monkeypatch.setenv('PATH', str(tmp_path))
+    assert index.resolve('ham') is None
+
+    # Directory content changed
+    script = tmp_path / 'ham'
+    script.write_text('#!/bin/sh\necho spam\n')
+    script.chmod(0o755)
+    os.utime(tmp_path, ns=(0, 1))
+    assert index.resolve('ham') == script
+    assert index.resolve('ham') == script
+    assert index.stats()['hits'] == 1
+
+    # PATH changed
+    monkeypatch.setenv('PATH', os.pathsep.join(('/nope', str(tmp_path))))
+    misses = index.misses
+    assert index.resolve('ham') == script
+    assert index.misses == misses + 1
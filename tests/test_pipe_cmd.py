@@ -1,4 +1,7 @@
-from conquer import sh
+from conquer import sh, Func
+from conquer.remote import RemoteCmd
+
+from .conftest import LocalChannel
 
 def test_base():
     cmd = sh.echo + "ham\nspam" | sh.head - '1'
@@ -24,3 +27,24 @@ def test_redirect():
     cmd = ('out.txt' > sh.cat)  | sh.wc -'l' # XXX add support for
                                              # piping to sh.wc() ?
     assert str(cmd()).strip() == '2'
+
+
+def test_early_exit():
+    # Upstream stages stop once downstream exits, like in a shell
+    res = (sh.yes | sh.head - 'n1')(_timeout=5)
+    assert res.stdout == b'y\n'
+    assert res.stats[0]['errcode'] == -13
+
+
+def test_early_exit_func():
+    # Also through a python stage
+    res = (sh.seq + '100000' | Func(str.upper) | sh.head - 'n1')(_timeout=5)
+    assert res.stdout == b'1\n'
+    assert res.stats[0]['errcode'] == -13
+
+
+def test_early_exit_remote(fake_ssh):
+    # The channel of a remote producer is closed
+    ssh = fake_ssh(channel=LocalChannel)
+    res = (RemoteCmd(ssh, 'yes') | sh.head - 'n1')(_timeout=5)
+    assert res.stdout == b'y\n'
@@ -0,0 +1,67 @@
+import threading
+import time
+
+import pytest
+from conquer.remote import Connection, ConnectionPool, RemoteCmd
+
+from .conftest import FakeChannel
+
+
+def test_sessions(fake_client):
+    conn = Connection(fake_client, max_sessions=2, keepalive=10)
+    assert conn.client.transport.keepalive == 10
+    conn.open_session()
+    conn.open_session()
+    assert conn.stats()['channels'] == 2
+
+    # Third session waits for a free slot
+    threading.Timer(0.1, conn.release).start()
+    conn.open_session()
+    stats = conn.stats()
+    assert stats['waits'] == 1
+    assert stats['wait_time'] >= 0.05
+
+
+def test_reconnect(fake_client):
+    conn = Connection(fake_client)
+    client = conn.client
+    client.transport.active = False
+    conn.open_session()
+    assert client.closed
+    assert conn.client is not client
+
+
+def test_eviction(fake_client):
+    pool = ConnectionPool(ttl=0.05, max_size=2)
+    first = pool.get('ham', fake_client)
+    assert pool.get('ham', fake_client) is first
+    first.open_session()
+    pool.get('spam', fake_client)
+    pool.get('foo', fake_client)
+    # ham is busy, so spam (least recently used idle) is evicted
+    assert list(pool.connections) == ['ham', 'foo']
+
+    time.sleep(0.1)
+    pool.get('bar', fake_client)
+    assert list(pool.connections) == ['ham', 'bar']
+    assert set(pool.stats()) == {'ham', 'bar'}
+
+
+def test_pending_commands(fake_ssh):
+    # More background commands than sessions do not block their caller
+    ssh = fake_ssh(max_sessions=2)
+    results = [RemoteCmd(ssh, 'cmd').bg() for _ in range(10)]
+    assert [r.stdout for r in results] == [b'out\n'] * 10
+    assert ssh.connection.stats()['channels'] == 0
+
+
+def test_exec_error(fake_ssh):
+    class BadChannel(FakeChannel):
+        def exec_command(self, cmd_line):
+            raise OSError('Channel closed')
+
+    ssh = fake_ssh(channel=BadChannel)
+    with pytest.raises(OSError):
+        RemoteCmd(ssh, 'cmd')()
+    # The session slot is given back
+    assert ssh.connection.stats()['channels'] == 0
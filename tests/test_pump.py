@@ -0,0 +1,39 @@
+import threading
+import time
+
+from conquer import sh
+from conquer.main import Pump, pump
+
+
+def test_reuse():
+    sh.echo('warm up')
+    before = pump.stats()
+    for i in range(50):
+        assert sh.echo(str(i)).stdout == b'%d\n' % i
+    stats = pump.stats()
+    assert stats['tasks'] - before['tasks'] >= 100
+    # Threads are reused, not spawned per stream
+    assert stats['spawned'] - before['spawned'] < 10
+
+
+def test_cap():
+    small = Pump(max_threads=2, idle_timeout=0.1)
+    gate = threading.Event()
+    done = []
+    tasks = [small.submit(lambda i=i: (gate.wait(), done.append(i)))
+             for i in range(5)]
+    time.sleep(0.05)
+    stats = small.stats()
+    assert stats['threads'] == stats['busy'] == 2
+    assert stats['queued'] == stats['max_queued'] == 3
+    gate.set()
+    for task in tasks:
+        task.join()
+    assert sorted(done) == list(range(5))
+    assert small.drain(timeout=1)
+
+    # Idle threads exit
+    time.sleep(0.3)
+    assert small.stats()['threads'] == 0
+    small.submit(done.append, 5).join()
+    assert small.stats()['spawned'] == 3
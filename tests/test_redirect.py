@@ -1,7 +1,64 @@
 from conquer import sh
+from conquer.main import STDOUT
+from conquer.remote import RemoteCmd
 
 def test_base():
     sh.ls() > 'out.txt'       # Redirect output to file
     cmd =  sh.wc < 'out.txt'  # Use file as stdin
     res = cmd()
     assert len(str(res).splitlines()) == 1
+
+
+def test_streaming(tmp_path):
+    out = tmp_path / 'out.txt'
+    cmd = sh.seq + '100000' > out
+    res = cmd()
+    assert res.stdout == b''
+    assert out.read_bytes() == sh.seq('100000').stdout
+    (sh.echo + 'end' >> out)()
+    assert out.read_bytes().endswith(b'99999\n100000\nend\n')
+    (sh.echo + 'new' > out)()
+    assert out.read_text() == 'new\n'
+
+
+def test_stderr(tmp_path):
+    err = tmp_path / 'err.txt'
+    script = 'echo out; echo err >&2'
+    res = (sh.sh + '-c' + script).redirect(stderr=err)()
+    assert (res.stdout, res.stderr) == (b'out\n', b'')
+    assert err.read_text() == 'err\n'
+
+    res = (sh.sh + '-c' + script).redirect(stderr=STDOUT)()
+    assert res.stdout == b'out\nerr\n'
+
+    both = tmp_path / 'both.txt'
+    (sh.sh + '-c' + script).redirect(both, STDOUT)()
+    assert both.read_text() == 'out\nerr\n'
+
+
+def test_pipeline(tmp_path):
+    # Redirected stages send nothing downstream, like in a shell
+    out = tmp_path / 'out.txt'
+    cmd = (sh.echo + 'hello' > out) | sh.wc + '-c'
+    assert cmd().stdout.strip() == b'0'
+    assert out.read_text() == 'hello\n'
+    assert (sh.echo + 'hello' | sh.cat > out)(_native=True).stdout == b''
+    assert out.read_text() == 'hello\n'
+
+
+def test_stream_result():
+    src = sh.seq.bg('1000')
+    res = (sh.wc + '-l' < src)()
+    assert res.stdout.strip() == b'1000'
+
+
+def test_remote(tmp_path, fake_ssh):
+    ssh = fake_ssh()
+    out, err = tmp_path / 'out', tmp_path / 'err'
+    res = RemoteCmd(ssh, 'cmd').redirect(out, err)()
+    assert (res.stdout, res.stderr) == (b'', b'')
+    assert (out.read_text(), err.read_text()) == ('out\n', 'err\n')
+
+    res = (RemoteCmd(ssh, 'cmd') >> out).redirect(stderr=STDOUT)()
+    assert res.stderr == b''
+    assert out.read_text() == 'out\nout\n'
@@ -0,0 +1,62 @@
+import io
+
+import pytest
+
+from conquer import sh
+from conquer.main import total_rusage
+from conquer.remote import Accounting
+
+
+def test_stages():
+    res = (sh.seq + '100000' | sh.wc + '-l')()
+    # Reaps upstream stages
+    total = res.rusage
+    seq, wc = (s['rusage'] for s in res.stats)
+    assert seq['max_rss'] > 0 and wc['max_rss'] > 0
+    assert total['user_time'] == seq['user_time'] + wc['user_time']
+    assert total['max_rss'] == max(seq['max_rss'], wc['max_rss'])
+    assert total['voluntary_switches'] >= seq['voluntary_switches']
+
+
+def test_native():
+    res = (sh.seq + '100000' | sh.wc + '-l')(_native=True)
+    group, = res.stats
+    assert len(group['rusages']) == 2
+    assert res.rusage == total_rusage(group['rusages'])
+
+
+def test_error():
+    res = sh.false.bg()
+    with pytest.raises(RuntimeError):
+        res.wait()
+    assert res.process.errcode == 1
+    assert res.rusage['user_time'] >= 0
+
+
+def test_accounting():
+    acc = Accounting()
+    output = io.BytesIO()
+    writer = acc.wrap(output)
+    token = acc.token
+    for chunk in (b'oops\nfail', token[:5], token[5:] + b'0m0.002s 0m0.000s\n',
+                  b'1m0.500s 0m0.010s\n'):
+        writer.write(chunk)
+    usage = acc.rusage()
+    assert output.getvalue() == b'oops\nfail'
+    assert usage['user_time'] == 60.5
+    assert usage['system_time'] == 0.01
+    assert usage['max_rss'] is None
+
+
+def test_accounting_shim():
+    # Run the shim locally
+    acc = Accounting()
+    script = acc.command_line('seq 100000 | wc -l; echo err >&2; false')
+    res = sh.sh.bg('-c', script)
+    with pytest.raises(RuntimeError):
+        res.wait()
+    output = io.BytesIO()
+    acc.wrap(output).write(res.stderr)
+    assert res.process.errcode == 1
+    assert output.getvalue() == b'err\n'
+    assert acc.rusage()['user_time'] >= 0
@@ -0,0 +1,37 @@
+import io
+import os
+from conquer import sh
+from conquer.main import Streamer
+
+
+def test_reader_modes():
+    data = b'ham\nspam\nfoo'
+    chunks = list(Streamer(io.BytesIO(data), mode='chunk', size=4).reader())
+    assert chunks == [b'ham\n', b'spam', b'\nfoo']
+
+    records = list(Streamer(io.BytesIO(b'ham\0spam\0foo'), mode=b'\0',
+                            size=3).reader())
+    assert records == [b'ham\0', b'spam\0', b'foo']
+
+    lines = list(Streamer(io.BytesIO(data)).reader())
+    assert lines == [b'ham\n', b'spam\n', b'foo']
+
+
+def test_pump():
+    data = os.urandom(2**18)
+    out = io.BytesIO()
+    streamer = Streamer(io.BufferedReader(io.BytesIO(data)), mode='chunk')
+    streamer.plug(out).join()
+    assert out.getvalue() == data
+
+
+def test_pipeline(tmp_path):
+    path = tmp_path / 'data.bin'
+    path.write_bytes(os.urandom(2**20))
+    cmd = (sh.cat < str(path)) | sh.wc - 'c'
+    cmd = cmd.stream_mode('chunk', 2**20)
+    res = cmd()
+    assert int(res.stdout) == 2**20
+
+    cmd = (sh.printf + 'ham\\0spam\\0').stream_mode(b'\0')
+    assert list(cmd.bg()) == ['ham\0', 'spam\0']
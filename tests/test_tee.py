@@ -0,0 +1,58 @@
+import hashlib
+import io
+
+import pytest
+from conquer import sh, Func
+from conquer.tee import TeeBuffer
+
+
+def test_tee(tmp_path):
+    data = sh.seq('100000').stdout
+    out = io.BytesIO()
+    sha, wc, size, lines, out_size = (sh.seq + '100000').tee(
+        sh.sha256sum, sh.wc + '-c', tmp_path / 'copy', Func(len), out,
+        buffer=4096)()
+    assert sha.stdout.split()[0].decode() == hashlib.sha256(data).hexdigest()
+    assert int(wc.stdout) == size == out_size == len(data)
+    assert (tmp_path / 'copy').read_bytes() == out.getvalue() == data
+    assert sum(lines) == len(data)
+
+
+def test_early_exit():
+    for policy in ('block', 'spill'):
+        head, wc = (sh.seq + '1000000').tee(
+            sh.head + '-1', sh.wc + '-l', buffer=1024, policy=policy)()
+        assert head.stdout == b'1\n'
+        assert wc.stdout == b'1000000\n'
+
+
+def test_sink_reuse():
+    # Sinks are not modified, they can be used again
+    wc = sh.wc + '-l'
+    for count in ('10', '20'):
+        res, = (sh.seq + count).tee(wc)()
+        assert res.stdout.strip() == count.encode()
+    assert wc.redirect_stdin is None
+
+
+def test_spill():
+    buff = TeeBuffer(10, policy='spill')
+    for i in range(5):
+        assert buff.put(b'%d-chunk;' % i)
+    assert buff.spilled > 0
+    buff.finish()
+    reader = io.BufferedReader(buff)
+    assert reader.read() == b''.join(b'%d-chunk;' % i for i in range(5))
+
+
+def test_abandon():
+    buff = TeeBuffer(10)
+    buff.abandon()
+    assert not buff.put(b'data')
+
+
+def test_errors():
+    with pytest.raises(RuntimeError):
+        (sh.sh + '-c' + 'exit 3').tee(sh.cat)()
+    with pytest.raises(RuntimeError):
+        (sh.seq + '10').tee(sh.cat, sh.false)()
@@ -0,0 +1,99 @@
+import os
+import signal
+import threading
+import time
+
+import pytest
+from conquer import sh, CancelToken, Group
+from conquer.main import Cancelled, Cmd, Timeout
+
+
+def test_timeout():
+    start = time.perf_counter()
+    with pytest.raises(Timeout):
+        (sh.sleep + '10' | sh.cat)(_timeout=0.2)
+    assert time.perf_counter() - start < 5
+
+
+def test_timeout_children():
+    # The shell children are killed too
+    start = time.perf_counter()
+    with pytest.raises(Timeout):
+        Cmd('sleep 5; echo x', _shell=True)(_timeout=0.2)
+    assert time.perf_counter() - start < 2
+
+
+def test_process_group():
+    # Only the stages that may be killed leave the terminal group
+    res = sh.sleep.bg('0.2')
+    assert os.getpgid(res.process.process.pid) == os.getpgrp()
+    res.wait()
+    res = sh.sleep.bg('0.2', _timeout=5)
+    assert os.getpgid(res.process.process.pid) != os.getpgrp()
+    res.wait()
+
+
+def test_interrupt():
+    # Ctrl-C does not reach the group of the stage, waiting kills it
+    res = (sh.sleep + '10' | sh.cat).bg(_timeout=30)
+    main = threading.main_thread().ident
+    threading.Timer(0.2, signal.pthread_kill, (main, signal.SIGINT)).start()
+    with pytest.raises(KeyboardInterrupt):
+        res.wait()
+    assert res.process.upstream.process.wait(timeout=2) == -9
+
+
+def test_no_timeout():
+    res = (sh.seq + '3')(_timeout=5)
+    assert res.stdout == b'1\n2\n3\n'
+
+
+def test_cancel():
+    token = CancelToken()
+    res = (sh.sleep + '10' | sh.cat).bg(_cancel=token)
+    threading.Timer(0.2, token.cancel).start()
+    with pytest.raises(Cancelled):
+        res.wait()
+    sleep, cat = res.stats
+    assert sleep['errcode'] == cat['errcode'] == -9
+
+
+def test_shared_deadline():
+    token = CancelToken(timeout=0.3)
+    results = [sh.sleep.bg('10', _cancel=token) for _ in range(3)]
+    for res in results:
+        with pytest.raises(Timeout):
+            res.wait()
+    assert token.remaining() == 0
+    # The token is now expired
+    with pytest.raises(Timeout):
+        sh.true(_cancel=token)
+
+
+def test_iter_timeout():
+    res = (sh.sh + '-c' + 'echo ham; sleep 10' | sh.cat).bg(
+        _timeout=0.3, _native=True)
+    lines = []
+    with pytest.raises(Timeout):
+        for line in res:
+            lines.append(line)
+    assert lines == ['ham\n']
+
+
+def test_iter_close():
+    before = threading.active_count()
+    lines = iter((sh.seq + '100000000' | sh.cat).bg())
+    assert next(lines) == '1\n'
+    lines.close()
+    # Helper threads terminate once all the stages are killed
+    deadline = time.monotonic() + 2
+    while threading.active_count() > before and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert threading.active_count() <= before
+
+
+def test_group():
+    group = Group(sh.sleep, ['0', '10'], timeout=0.3)
+    results = group.results()
+    assert results['0'].success
+    assert isinstance(results['10'], Timeout)
@@ -0,0 +1,65 @@
+import os
+
+from conquer import sh, Func
+from conquer.main import add_tracer, remove_tracer, Tracer
+from conquer.trace import SpanTracer
+
+
+def test_stats():
+    res = (sh.seq + '1000' | sh.wc + '-l')()
+    seq, wc = res.stats
+    assert os.path.basename(seq['cmd'].split()[0]) == 'seq'
+    assert os.path.basename(wc['cmd'].split()[0]) == 'wc'
+    assert seq['errcode'] == wc['errcode'] == 0
+    # Local stages are connected by a kernel pipe
+    assert 'stdout' not in seq['streams']
+    assert wc['streams']['stdout']['bytes'] == len(res.stdout)
+    assert all(s['wall_time'] >= 0 for s in res.stats)
+
+
+def test_func_stats():
+    upper = Func(str.upper)
+    res = (sh.seq + '10' | upper | sh.wc + '-l')()
+    seq, fn, wc = res.stats
+    assert fn['stage'] == 'func'
+    assert fn['calls'] == 10
+    assert wc['errcode'] == 0
+
+
+def test_tracer():
+    stages = []
+
+    class Collect(Tracer):
+        def on_stage(self, stats):
+            stages.append(stats)
+
+    tracer = add_tracer(Collect())
+    try:
+        res = (sh.seq + '10' | sh.wc)()
+        res.rusage  # Reap upstream stages
+    finally:
+        remove_tracer(tracer)
+    seq, wc = res.stats
+    assert any(s is seq for s in stages)
+    assert any(s is wc for s in stages)
+
+
+def test_spans():
+    tracer = add_tracer(SpanTracer())
+    try:
+        (sh.seq + '10' | sh.wc)()
+        try:
+            sh.false()
+        except RuntimeError:
+            pass
+    finally:
+        remove_tracer(tracer)
+
+    root, seq, wc, root_err, false = tracer.spans
+    assert root['name'] == 'pipeline'
+    assert seq['parent_id'] == wc['parent_id'] == root['span_id']
+    assert seq['trace_id'] == root['trace_id']
+    assert wc['attributes']['conquer.stdout.bytes'] > 0
+    assert seq['start_time'] <= seq['end_time']
+    assert root['status'] == 'OK'
+    assert false['status'] == root_err['status'] == 'ERROR'
@@ -0,0 +1,180 @@
+import os
+import shlex
+import threading
+import types
+
+import pytest
+from conquer import sh, remote
+from conquer.transfer import Transfer
+
+
+class FakeFile:
+
+    def __init__(self, path, mode):
+        self.fh = open(path, mode)
+        self.pipelined = False
+        self.prefetched = None
+
+    def set_pipelined(self, pipelined=True):
+        self.pipelined = pipelined
+
+    def prefetch(self, size=None):
+        self.prefetched = size
+
+    def read(self, size):
+        return self.fh.read(size)
+
+    def write(self, data):
+        assert self.pipelined
+        self.fh.write(data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.fh.close()
+
+
+class FakeSFTP:
+    # SFTP client backed by the local filesystem
+
+    def __init__(self):
+        self.closed = False
+
+    def open(self, path, mode):
+        return FakeFile(path, mode)
+
+    def stat(self, path):
+        return os.stat(path)
+
+    def listdir_attr(self, path):
+        return [types.SimpleNamespace(filename=e.name, st_mode=e.stat().st_mode)
+                for e in os.scandir(path)]
+
+    def mkdir(self, path):
+        os.mkdir(path)
+
+    def utime(self, path, times):
+        os.utime(path, times)
+
+    def chmod(self, path, mode):
+        os.chmod(path, mode)
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def sftp_ssh(fake_ssh, monkeypatch):
+    '''
+    Factory of SSH instances on a fake Connection, with SFTP clients
+    backed by the local filesystem. Channels opened for SFTP are kept
+    in ssh.channels.
+    '''
+    channels = []
+
+    def client(chan):
+        channels.append(chan)
+        return FakeSFTP()
+    monkeypatch.setattr(remote, 'paramiko',
+                        types.SimpleNamespace(SFTPClient=client))
+
+    def make(max_sessions=8):
+        ssh = fake_ssh(max_sessions=max_sessions)
+        ssh.channels = channels
+
+        def sha256sum(path):
+            # Computed locally but, like a remote command, holds a
+            # session while it runs
+            ssh.connection.open_session()
+            try:
+                return sh.sha256sum(shlex.split(path)[0])
+            finally:
+                ssh.connection.release()
+        ssh.__dict__['sha256sum'] = sha256sum
+        return ssh
+    return make
+
+
+def make_tree(root):
+    (root / 'sub').mkdir(parents=True)
+    (root / 'a.txt').write_bytes(b'a' * 3000000)
+    (root / 'sub' / 'b.txt').write_bytes(b'b')
+    (root / 'sub' / 'b.txt').chmod(0o600)
+
+
+def test_put_get(tmp_path, sftp_ssh):
+    ssh = sftp_ssh()
+    src = tmp_path / 'src'
+    make_tree(src)
+    progress = []
+    stats = ssh.put(src, str(tmp_path / 'remote'),
+                    progress=lambda *args: progress.append(args))
+    assert stats['files'] == 2
+    assert stats['bytes'] == 3000001
+    assert stats['throughput'] > 0
+    assert (tmp_path / 'remote' / 'a.txt').read_bytes() == b'a' * 3000000
+    assert (tmp_path / 'remote' / 'sub' / 'b.txt').stat().st_mode & 0o777 == 0o600
+    big = [done for path, done, total in progress if path.endswith('a.txt')]
+    assert big == [2**20, 2**21, 3000000]
+    assert ssh.connection.stats()['channels'] == 0
+    windows = {chan.kw['window_size'] for chan in ssh.channels}
+    assert windows == {Transfer(ssh).window}
+
+    stats = ssh.get(str(tmp_path / 'remote'), tmp_path / 'back')
+    assert stats['files'] == 2
+    assert (tmp_path / 'back' / 'sub' / 'b.txt').read_bytes() == b'b'
+    assert (tmp_path / 'back' / 'a.txt').stat().st_mtime == \
+        (src / 'a.txt').stat().st_mtime
+
+    # Single file
+    ssh.get(str(tmp_path / 'remote' / 'sub' / 'b.txt'), tmp_path / 'c.txt')
+    assert (tmp_path / 'c.txt').read_bytes() == b'b'
+
+
+@pytest.mark.parametrize('check', ['mtime', 'checksum'])
+def test_sync(tmp_path, sftp_ssh, check):
+    ssh = sftp_ssh()
+    src = tmp_path / 'src'
+    make_tree(src)
+    dst = str(tmp_path / 'dst')
+    assert ssh.sync(src, dst, check=check)['skipped'] == 0
+    stats = ssh.sync(src, dst, check=check)
+    assert stats['skipped'] == 2
+    assert stats['bytes'] == 0
+
+    (src / 'sub' / 'b.txt').write_bytes(b'c')
+    os.utime(src / 'sub' / 'b.txt', (0, 0))
+    stats = ssh.sync(src, dst, check=check)
+    assert stats['skipped'] == 1
+    assert (tmp_path / 'dst' / 'sub' / 'b.txt').read_bytes() == b'c'
+
+    stats = ssh.sync(dst, tmp_path / 'src', direction='get', check=check)
+    assert stats['skipped'] == 2
+
+
+def test_errors(tmp_path, sftp_ssh):
+    with pytest.raises(ValueError):
+        Transfer(sftp_ssh(), check='size')
+    with pytest.raises(ValueError):
+        sftp_ssh().sync(tmp_path, 'dst', direction='both')
+
+
+@pytest.mark.parametrize('check', [None, 'checksum'])
+def test_sessions(tmp_path, sftp_ssh, check):
+    # More workers than sessions
+    ssh = sftp_ssh(max_sessions=4)
+    src = tmp_path / 'src'
+    src.mkdir()
+    for i in range(20):
+        (src / f'{i}.txt').write_text(str(i))
+    dst = str(tmp_path / 'dst')
+    for _ in range(2):
+        thread = threading.Thread(target=ssh.sync, args=(src, dst),
+                                  kwargs={'workers': 8, 'check': check},
+                                  daemon=True)
+        thread.start()
+        thread.join(10)
+        assert not thread.is_alive()
+    assert sorted(os.listdir(dst)) == sorted(os.listdir(src))
+    assert ssh.connection.stats()['channels'] == 0
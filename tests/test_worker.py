@@ -0,0 +1,91 @@
+from concurrent import futures
+import time
+import pytest
+from conquer import Worker
+from conquer.remote import RemoteCmd
+from conquer.worker import Shell
+
+from .conftest import LocalChannel
+
+
+def test_base():
+    worker = Worker()
+    res = worker.echo('-n', 'ham spam')
+    assert res == 'ham spam'
+    assert worker.printf('ham\n\n')  == 'ham\n\n'
+    assert worker.true() == ''
+    assert len(worker.shells) == 1
+
+    with pytest.raises(RuntimeError) as exc:
+        worker.ls('/nope')
+    assert 'nope' in str(exc.value)
+
+    res = (worker.test + '-d' + '/').bg()
+    assert res.success
+    worker.close()
+
+
+def test_parallel():
+    worker = Worker(size=3)
+    args = [str(i) for i in range(20)]
+    with futures.ThreadPoolExecutor(5) as executor:
+        results = executor.map(worker.echo, args)
+    assert [int(r.stdout) for r in results] == list(range(20))
+    assert len(worker.shells) <= 3
+    worker.close()
+
+
+def test_kill():
+    worker = Worker()
+    res = worker.sleep.bg('10')
+    time.sleep(0.1)
+    start = time.time()
+    res.kill()
+    with pytest.raises(RuntimeError):
+        res.wait()
+    assert time.time() - start < 1
+    # Shell is replaced
+    assert worker.echo('ok') == 'ok\n'
+    worker.close()
+
+
+def test_kill_done():
+    worker = Worker()
+    done = worker.echo('ham')
+    res = worker.sleep.bg('0.5')
+    time.sleep(0.1)
+    # The shell now runs another command
+    done.kill()
+    assert res.success
+    worker.close()
+
+
+def test_remote_kill(fake_connection):
+    conn = fake_connection()
+    shell = Shell(conn)
+    shell.kill()
+    shell.kill()
+    shell.close()
+    # The session slot is released once
+    assert conn.stats()['channels'] == 0
+
+
+def test_remote_pool(fake_ssh):
+    ssh = fake_ssh(channel=LocalChannel, max_sessions=3)
+    conn = ssh.connection
+    worker = Worker(ssh, size=8)
+    # One session is left for other commands
+    assert worker.size == 2
+    results = [worker.echo.bg(str(i)) for i in range(6)]
+    assert [int(r.stdout) for r in results] == list(range(6))
+    assert conn.stats()['channels'] == 2
+    assert RemoteCmd(ssh, 'echo ok')().stdout == b'ok\n'
+
+    # A dead shell is replaced when a command needs it
+    with pytest.raises(RuntimeError):
+        worker.exit()
+    assert len(worker.shells) == 1
+    assert conn.stats()['channels'] == 1
+    assert worker.echo('ok') == 'ok\n'
+    worker.close()
+    assert conn.stats()['channels'] == 0
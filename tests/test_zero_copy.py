@@ -0,0 +1,38 @@
+import io
+import os
+from conquer import sh
+from conquer.main import Streamer, copy_fd
+
+
+def test_copy_fd(tmp_path):
+    src = tmp_path / 'src'
+    src.write_bytes(os.urandom(3 * 2**20))
+    dst = tmp_path / 'dst'
+    # File to file (sendfile)
+    with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+        copy_fd(fin.fileno(), fout.fileno())
+    assert dst.read_bytes() == src.read_bytes()
+
+    # Pipe to file (splice)
+    read_fd, write_fd = os.pipe()
+    os.write(write_fd, b'ham\nspam\n')
+    os.close(write_fd)
+    with open(dst, 'wb') as fout:
+        copy_fd(read_fd, fout.fileno())
+    os.close(read_fd)
+    assert dst.read_bytes() == b'ham\nspam\n'
+
+
+def test_plug_fallback():
+    out = io.BytesIO()
+    Streamer(io.BytesIO(b'ham\nspam\n')).plug(out).join()
+    assert out.getvalue() == b'ham\nspam\n'
+
+
+def test_result_to_file(tmp_path):
+    path = str(tmp_path / 'out.txt')
+    res = (sh.seq + '100000').bg()
+    assert res > path
+    with open(path, 'rb') as fh:
+        assert len(fh.read().splitlines()) == 100000
+    assert (sh.wc - 'l' < path)().stdout.strip() == b'100000'